@@ -1,19 +1,33 @@
 """Backward-compatibility entry point.
 
 Imports from this module (app, db, Link, Click, Reward) continue to work
-so that tasks.py, test_api.py, and ``FLASK_APP=app.py`` all function
-without modification.
+so that test_api.py and ``FLASK_APP=app.py`` function without
+modification.  ``app`` is built on first access (PEP 562), so importing
+this module for ``db`` or the models does not construct the web app.
 
 The real application code lives in the ``fiverr`` package.
 """
+import threading
+
 from fiverr import create_app, db
 from fiverr.models import Link, Click, Reward
 
-app = create_app()
-
 __all__ = ['app', 'db', 'Link', 'Click', 'Reward']
 
+_app_lock = threading.Lock()
+
+
+def __getattr__(name):
+    if name == 'app':
+        with _app_lock:
+            if 'app' not in globals():
+                globals()['app'] = create_app()
+        return globals()['app']
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
+
 if __name__ == '__main__':
+    app = __getattr__('app')
     with app.app_context():
         db.create_all()
     app.run(debug=True, host='localhost', port=5000, threaded=True)
@@ -0,0 +1 @@
+"""Benchmark scripts. Run with ``python -m benchmarks.<name> --help``."""
@@ -0,0 +1,69 @@
+"""Reward credit throughput per worker vs in-flight concurrency.
+
+Starts a local mock credit server and credits ``--credits`` clicks:
+first with a fresh ``requests.post`` per call (the old behaviour), then
+through the pooled :class:`CreditClient` at increasing concurrency.
+Reports rewards/sec and how many TCP connections each run opened.
+
+    python -m benchmarks.bench_credit_client --credits 200 --latency-ms 50
+"""
+import argparse
+import time
+
+import requests
+
+from benchmarks.mock_credit_server import MockCreditServer
+from fiverr.credit_client import CreditClient
+
+
+def _items(count):
+    return [
+        {'click_id': i, 'seller_id': f'seller{i % 10}', 'link_id': i, 'amount': 0.05}
+        for i in range(count)
+    ]
+
+
+def _measure(server, run):
+    connections = server.connections
+    start = time.perf_counter()
+    outcomes = run()
+    elapsed = time.perf_counter() - start
+    failed = sum(1 for status, _ in outcomes if status != 'completed')
+    return elapsed, server.connections - connections, failed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--credits', type=int, default=200)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--concurrency', default='1,2,4,8,16,32',
+                        help='Comma-separated in-flight levels for the pooled client')
+    args = parser.parse_args(argv)
+
+    server = MockCreditServer(latency=args.latency_ms / 1000).start()
+    url = f'{server.url}/credit'
+    items = _items(args.credits)
+    print(f'{"mode":<22}{"credits/s":>12}{"connections":>14}{"failed":>8}')
+
+    def fresh_connections():
+        outcomes = []
+        for item in items:
+            resp = requests.post(url, json=item, timeout=5,
+                                 headers={'Authorization': 'Bearer bench'})
+            outcomes.append(('completed' if resp.ok else 'failed', None))
+        return outcomes
+
+    elapsed, connections, failed = _measure(server, fresh_connections)
+    print(f'{"requests.post":<22}{len(items) / elapsed:>12.1f}{connections:>14}{failed:>8}')
+
+    for level in (int(v) for v in args.concurrency.split(',')):
+        client = CreditClient(url=url, token='bench', pool_size=level, concurrency=level)
+        elapsed, connections, failed = _measure(server, lambda: client.credit_many(items))
+        client.close()
+        print(f'{f"pooled x{level}":<22}{len(items) / elapsed:>12.1f}{connections:>14}{failed:>8}')
+
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
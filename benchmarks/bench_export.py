@@ -0,0 +1,68 @@
+"""Streaming export throughput and peak memory vs table size.
+
+Fills a scratch SQLite database with links, then exports each prefix
+size through :class:`TableExport` (discarding the output) and reports
+rows/sec and, from a second traced pass, the tracemalloc peak.  The
+peak should stay flat as the row count grows.
+
+    python -m benchmarks.bench_export --rows 10000,100000 --format csv --gzip
+"""
+import argparse
+import os
+import tempfile
+import time
+import tracemalloc
+
+from sqlalchemy import insert
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', default='10000,100000',
+                        help='Comma-separated table sizes to export')
+    parser.add_argument('--format', dest='fmt', choices=('ndjson', 'csv'), default='ndjson')
+    parser.add_argument('--gzip', action='store_true')
+    parser.add_argument('--batch-size', type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    from fiverr import create_app, db
+    from fiverr.export import TableExport
+    from fiverr.models import Link
+
+    sizes = sorted(int(v) for v in args.rows.split(','))
+    with tempfile.TemporaryDirectory() as tmp:
+        app = create_app({'SQLALCHEMY_DATABASE_URI': f'sqlite:///{os.path.join(tmp, "export.db")}'})
+        with app.app_context():
+            db.create_all()
+            print(f'{"rows":>10}{"rows/s":>12}{"MB out":>10}{"peak KB":>10}')
+            loaded = 0
+            for size in sizes:
+                for start in range(loaded, size, 10000):
+                    db.session.execute(insert(Link), [
+                        {'seller_id': f'seller{i % 100}',
+                         'original_url': f'https://fiverr.com/gigs/bench/{i}',
+                         'short_code': f'b{i}'}
+                        for i in range(start, min(start + 10000, size))
+                    ])
+                db.session.commit()
+                loaded = size
+
+                export = TableExport('links', args.fmt, compress=args.gzip,
+                                     batch_size=args.batch_size)
+                begin = time.perf_counter()
+                written = sum(len(chunk) for chunk in export)
+                elapsed = time.perf_counter() - begin
+
+                # Second pass under tracemalloc (which slows it down) for the peak.
+                tracemalloc.start()
+                for _ in TableExport('links', args.fmt, compress=args.gzip,
+                                     batch_size=args.batch_size):
+                    pass
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                print(f'{export.rows:>10}{export.rows / elapsed:>12.0f}'
+                      f'{written / 1e6:>10.1f}{peak / 1024:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
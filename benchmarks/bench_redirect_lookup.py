@@ -0,0 +1,74 @@
+"""Redirect link-resolution benchmark: SELECTs and latency per lookup.
+
+Resolves every short code once cold (DB) and then repeatedly warm (cache),
+counting the SQL statements each pass issues.  A warm pass must report
+0 SELECTs per lookup.
+
+    python -m benchmarks.bench_redirect_lookup --links 1000 --rounds 5
+"""
+import argparse
+import time
+
+from sqlalchemy import event, insert
+
+from fiverr import create_app, db
+from fiverr.models import Link
+
+
+def _run_pass(app, codes, lookup):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+        start = time.perf_counter()
+        for code in codes:
+            with app.test_request_context():
+                assert lookup(code) is not None
+        elapsed = time.perf_counter() - start
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', capture)
+
+    selects = sum(1 for s in statements if s.lstrip().upper().startswith('SELECT'))
+    return elapsed, selects
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--links', type=int, default=1000)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--database-url', default='sqlite:///:memory:')
+    args = parser.parse_args(argv)
+
+    app = create_app({
+        'SQLALCHEMY_DATABASE_URI': args.database_url,
+        'LINK_CACHE_SIZE': max(args.links, 1),
+    })
+    from fiverr.routes import _get_link_from_cache
+
+    with app.app_context():
+        db.create_all()
+        codes = [f'b{i:07d}' for i in range(args.links)]
+        db.session.execute(insert(Link), [
+            {'seller_id': f'seller{i}', 'original_url': f'https://fiverr.com/gigs/{i}',
+             'short_code': code}
+            for i, code in enumerate(codes)
+        ])
+        db.session.commit()
+
+        print(f'{"pass":<8}{"lookups":>10}{"SELECT/lookup":>16}{"us/lookup":>12}')
+        elapsed, selects = _run_pass(app, codes, _get_link_from_cache)
+        print(f'{"cold":<8}{len(codes):>10}{selects / len(codes):>16.2f}'
+              f'{elapsed / len(codes) * 1e6:>12.1f}')
+        for _ in range(args.rounds):
+            elapsed, selects = _run_pass(app, codes, _get_link_from_cache)
+            print(f'{"warm":<8}{len(codes):>10}{selects / len(codes):>16.2f}'
+                  f'{elapsed / len(codes) * 1e6:>12.1f}')
+
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
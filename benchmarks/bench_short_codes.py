@@ -0,0 +1,62 @@
+"""Link creation throughput: legacy random generator vs block allocator.
+
+Creates ``--links`` links per generator (code generation + INSERT +
+commit, as ``create_link`` does) and reports creates/sec and SELECTs per
+create.
+
+    python -m benchmarks.bench_short_codes --links 5000
+"""
+import argparse
+import time
+
+from sqlalchemy import event
+
+from fiverr import create_app, db
+from fiverr.models import Link
+from fiverr.utils import generate_random_short_code, generate_short_code
+
+
+def _create_links(count, generator, prefix):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', capture)
+    try:
+        start = time.perf_counter()
+        for i in range(count):
+            db.session.add(Link(
+                seller_id=f'{prefix}-seller',
+                original_url=f'https://fiverr.com/gigs/{prefix}/{i}',
+                short_code=generator(),
+            ))
+            db.session.commit()
+        elapsed = time.perf_counter() - start
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', capture)
+
+    selects = sum(1 for s in statements if s.lstrip().upper().startswith('SELECT'))
+    return elapsed, selects
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--links', type=int, default=5000)
+    parser.add_argument('--database-url', default='sqlite:///:memory:')
+    args = parser.parse_args(argv)
+
+    app = create_app({'SQLALCHEMY_DATABASE_URI': args.database_url})
+    with app.app_context():
+        db.create_all()
+        print(f'{"generator":<12}{"links":>8}{"creates/s":>12}{"SELECT/create":>15}')
+        for name, generator in (('random', generate_random_short_code),
+                                ('allocator', generate_short_code)):
+            elapsed, selects = _create_links(args.links, generator, name)
+            print(f'{name:<12}{args.links:>8}{args.links / elapsed:>12.0f}'
+                  f'{selects / args.links:>15.3f}')
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,79 @@
+"""Cold-start cost of the web app and the Celery worker.
+
+Each scenario runs in a fresh interpreter (``--runs`` times, median
+reported) so module caches never hide import cost:
+
+* ``import tasks``           what a worker pays before its first task
+* ``worker first task``      import + first ``settle_pending_rewards`` run
+* ``import app``             module import only (the app is built lazily)
+* ``create_app``             import + building the full web app
+* ``first request``          import + app + first ``GET /health``
+
+Point ``--redis-url`` at an unreachable host (the default) to check that
+startup no longer waits for a Redis connect timeout.
+
+    python -m benchmarks.bench_startup --runs 5
+    python -m benchmarks.bench_startup --redis-url redis://localhost:6379/0
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+SCENARIOS = {
+    'import tasks': 'import tasks',
+    'worker first task': (
+        'import tasks\n'
+        'tasks.settle_pending_rewards_task()\n'
+    ),
+    'import app': 'import app',
+    'create_app': 'from app import app',
+    'first request': (
+        'from app import app, db\n'
+        'with app.app_context():\n'
+        '    db.create_all()\n'
+        'assert app.test_client().get("/health").status_code == 200\n'
+    ),
+}
+
+_HARNESS = '''
+import json, time
+_start = time.perf_counter()
+{code}
+print(json.dumps(time.perf_counter() - _start))
+'''
+
+
+def _run(code, env):
+    out = subprocess.run(
+        [sys.executable, '-c', _HARNESS.format(code=code)],
+        env=env, capture_output=True, text=True, check=True,
+    )
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--redis-url', default='redis://10.255.255.1:6379/0',
+                        help='Redis to configure (default: unroutable, i.e. "Redis down")')
+    parser.add_argument('--database-url', default='sqlite:///:memory:')
+    args = parser.parse_args(argv)
+
+    env = dict(
+        os.environ,
+        REDIS_URL=args.redis_url,
+        DATABASE_URL=args.database_url,
+        UNIT_TEST='1',  # in-process Celery stub: no broker connection
+    )
+    print(f'{"scenario":<20}{"median ms":>12}{"min ms":>10}{"max ms":>10}')
+    for name, code in SCENARIOS.items():
+        timings = [_run(code, env) * 1000 for _ in range(args.runs)]
+        print(f'{name:<20}{statistics.median(timings):>12.1f}'
+              f'{min(timings):>10.1f}{max(timings):>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
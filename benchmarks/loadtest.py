@@ -0,0 +1,370 @@
+"""Open-loop load test: throughput and latency percentiles per endpoint.
+
+Drives ``POST /link``, ``GET /link/<code>`` (Zipf-distributed codes) and
+``GET /state`` at a fixed request rate and reports p50/p95/p99/max latency
+and throughput for each.  Latency is measured from each request's
+*scheduled* start, so a stalled server shows up as queueing delay instead
+of silently lowering the offered load.
+
+Targets:
+
+* ``--target inprocess`` (default): the Flask app in this process via its
+  test client, against ``--database-url`` (a temporary SQLite file by
+  default; pass a ``postgresql://`` URL for local Postgres);
+* ``--target http://host:port``: a running server, over HTTP.
+
+    python -m benchmarks.loadtest run --rate 200 --duration 30 --output new.json
+    python -m benchmarks.loadtest compare base.json new.json --threshold 0.10
+
+``compare`` exits with status 1 when any endpoint's p95/p99 latency grows,
+or its throughput drops, by more than the threshold.
+"""
+import argparse
+import bisect
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ENDPOINTS = ('create', 'redirect', 'state')
+PERCENTILES = (50, 95, 99)
+
+
+# -- Workload ------------------------------------------------------------------
+
+class ZipfCodes:
+    """Pick codes by rank with probability proportional to ``1 / rank**s``."""
+
+    def __init__(self, codes, s=1.1, seed=None):
+        self.codes = list(codes)
+        self._random = random.Random(seed)
+        total = 0.0
+        self._cumulative = []
+        for rank in range(1, len(self.codes) + 1):
+            total += 1.0 / rank ** s
+            self._cumulative.append(total)
+
+    def pick(self):
+        point = self._random.random() * self._cumulative[-1]
+        return self.codes[bisect.bisect_left(self._cumulative, point)]
+
+
+def parse_mix(value):
+    """``'create=1,redirect=8,state=1'`` -> ``{'create': 1.0, ...}``."""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip() not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f'unknown endpoint {name!r} in --mix')
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+# -- Targets -------------------------------------------------------------------
+
+class InProcessTarget:
+    """The Flask app driven through per-thread test clients."""
+
+    def __init__(self, database_url, overrides=None):
+        from fiverr import create_app, db
+
+        self._tmpdir = None
+        if database_url is None:
+            self._tmpdir = tempfile.mkdtemp(prefix='loadtest-')
+            database_url = f'sqlite:///{os.path.join(self._tmpdir, "loadtest.db")}'
+        self.description = f'inprocess ({database_url.split("://")[0]})'
+        # Batch reward mode: clicks stay pending instead of publishing a
+        # Celery task per redirect, so no broker is needed in-process.
+        self.app = create_app({
+            'SQLALCHEMY_DATABASE_URI': database_url,
+            'REWARD_MODE': 'batch',
+            **(overrides or {}),
+        })
+        self.db = db
+        self._local = threading.local()
+        with self.app.app_context():
+            db.create_all()
+
+    def seed(self, count):
+        from fiverr.links import insert_links_ignoring_duplicates
+
+        codes = [f'lt{i:06d}' for i in range(count)]
+        with self.app.app_context():
+            for start in range(0, count, 1000):
+                insert_links_ignoring_duplicates([
+                    {'seller_id': f'loadtest{i}', 'short_code': codes[i],
+                     'original_url': f'https://fiverr.com/gigs/loadtest{i}'}
+                    for i in range(start, min(start + 1000, count))
+                ])
+            self.db.session.commit()
+        return codes
+
+    def request(self, method, path, body=None):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        if method == 'POST':
+            response = client.post(path, json=body)
+        else:
+            response = client.get(path, follow_redirects=False)
+        return response.status_code, response.get_json(silent=True)
+
+    def close(self):
+        with self.app.app_context():
+            self.db.session.remove()
+            self.db.engine.dispose()
+        if self._tmpdir:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+
+class HttpTarget:
+    """A running server reached over keep-alive HTTP connections."""
+
+    def __init__(self, base_url):
+        self.base_url = base_url.rstrip('/')
+        self.description = self.base_url
+        self._local = threading.local()
+
+    def _session(self):
+        import requests
+
+        session = getattr(self._local, 'session', None)
+        if session is None:
+            session = self._local.session = requests.Session()
+        return session
+
+    def seed(self, count):
+        codes = []
+        for start in range(0, count, 1000):
+            status, body = self.request('POST', '/links/batch', [
+                {'seller_id': f'loadtest{i}',
+                 'original_url': f'https://fiverr.com/gigs/loadtest{i}'}
+                for i in range(start, min(start + 1000, count))
+            ])
+            if status >= 300:
+                raise RuntimeError(f'seeding failed with HTTP {status}: {body}')
+            failed = [result for result in body['results'] if result['status'] == 'error']
+            if failed:
+                raise RuntimeError(f'seeding failed for {len(failed)} links: {failed[0]}')
+            codes.extend(result['link']['short_code'] for result in body['results'])
+        return codes
+
+    def request(self, method, path, body=None):
+        response = self._session().request(
+            method, self.base_url + path, json=body, allow_redirects=False, timeout=30,
+        )
+        try:
+            payload = response.json()
+        except ValueError:
+            payload = None
+        return response.status_code, payload
+
+    def close(self):
+        pass
+
+
+# -- Run -----------------------------------------------------------------------
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-pct * len(sorted_values) // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(latencies, errors, elapsed):
+    results = {}
+    for name in ENDPOINTS:
+        values = sorted(latencies.get(name, []))
+        if not values and not errors.get(name):
+            continue
+        entry = {
+            'requests': len(values),
+            'errors': errors.get(name, 0),
+            'throughput_rps': len(values) / elapsed if elapsed else 0.0,
+            'max_ms': values[-1] * 1000 if values else None,
+        }
+        for pct in PERCENTILES:
+            value = percentile(values, pct)
+            entry[f'p{pct}_ms'] = value * 1000 if value is not None else None
+        results[name] = entry
+    return results
+
+
+def run_load(target, rate, duration, mix, codes, zipf_s=1.1, concurrency=16, seed=None):
+    """Offer ``rate`` requests/s for ``duration`` seconds. Returns the summary."""
+    chooser = random.Random(seed)
+    zipf = ZipfCodes(codes, zipf_s, seed)
+    names = list(mix)
+    cum_weights = list(itertools.accumulate(mix[name] for name in names))
+    latencies = {name: [] for name in ENDPOINTS}
+    errors = {name: 0 for name in ENDPOINTS}
+    lock = threading.Lock()
+    created = itertools.count()
+
+    def fire(name, scheduled):
+        if name == 'create':
+            n = next(created)
+            method, path, body = 'POST', '/link', {
+                'seller_id': f'loadtest-new{n % 100}',
+                'original_url': f'https://fiverr.com/gigs/loadtest-new{n}',
+            }
+            ok = (200, 201)
+        elif name == 'redirect':
+            method, path, body, ok = 'GET', f'/link/{zipf.pick()}', None, (302,)
+        else:
+            method, path, body, ok = 'GET', '/state?limit=20', None, (200,)
+        try:
+            status, _ = target.request(method, path, body)
+            failed = status not in ok
+        except Exception:
+            failed = True
+        latency = time.perf_counter() - scheduled
+        with lock:
+            if failed:
+                errors[name] += 1
+            else:
+                latencies[name].append(latency)
+
+    interval = 1.0 / rate
+    total = int(rate * duration)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for i in range(total):
+            scheduled = start + i * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            name = chooser.choices(names, cum_weights=cum_weights)[0]
+            pool.submit(fire, name, scheduled)
+    elapsed = time.perf_counter() - start
+    return summarize(latencies, errors, elapsed)
+
+
+def print_results(results, out=sys.stdout):
+    header = f'{"endpoint":<10}{"reqs":>8}{"errors":>8}{"rps":>10}'
+    header += ''.join(f'{"p%d ms" % pct:>10}' for pct in PERCENTILES) + f'{"max ms":>10}'
+    print(header, file=out)
+    for name, entry in results.items():
+        row = f'{name:<10}{entry["requests"]:>8}{entry["errors"]:>8}{entry["throughput_rps"]:>10.1f}'
+        for key in [f'p{pct}_ms' for pct in PERCENTILES] + ['max_ms']:
+            value = entry[key]
+            row += f'{value:>10.2f}' if value is not None else f'{"-":>10}'
+        print(row, file=out)
+
+
+# -- Compare -------------------------------------------------------------------
+
+def compare(baseline, current, threshold=0.10):
+    """Return ``[(endpoint, metric, baseline, current, change)]`` regressions."""
+    regressions = []
+    for name, base in baseline['results'].items():
+        new = current['results'].get(name)
+        if new is None:
+            continue
+        for metric in ('p95_ms', 'p99_ms'):
+            if base.get(metric) and new.get(metric) is not None:
+                change = new[metric] / base[metric] - 1
+                if change > threshold:
+                    regressions.append((name, metric, base[metric], new[metric], change))
+        if base.get('throughput_rps'):
+            change = new['throughput_rps'] / base['throughput_rps'] - 1
+            if change < -threshold:
+                regressions.append((name, 'throughput_rps', base['throughput_rps'],
+                                    new['throughput_rps'], change))
+        if new.get('errors', 0) > base.get('errors', 0):
+            regressions.append((name, 'errors', base.get('errors', 0), new['errors'], None))
+    return regressions
+
+
+def _compare_command(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    with open(args.current) as f:
+        current = json.load(f)
+    if baseline.get('params') != current.get('params'):
+        print('warning: runs used different parameters; throughput is not comparable')
+    regressions = compare(baseline, current, args.threshold)
+    if not regressions:
+        print(f'No regressions beyond {args.threshold:.0%}')
+        return 0
+    for name, metric, before, after, change in regressions:
+        delta = f' ({change:+.1%})' if change is not None else ''
+        print(f'REGRESSION {name} {metric}: {before:.2f} -> {after:.2f}{delta}')
+    return 1
+
+
+def _run_command(args):
+    if args.target == 'inprocess':
+        target = InProcessTarget(args.database_url)
+    else:
+        target = HttpTarget(args.target)
+    try:
+        codes = target.seed(args.links)
+        if args.warmup:
+            run_load(target, args.rate, args.warmup, args.mix, codes,
+                     args.zipf_s, args.concurrency, args.seed)
+        results = run_load(target, args.rate, args.duration, args.mix, codes,
+                           args.zipf_s, args.concurrency, args.seed)
+    finally:
+        target.close()
+
+    print(f'target: {target.description}, offered {args.rate} req/s for {args.duration}s')
+    print_results(results)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'target': target.description,
+                'started_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                'python': platform.python_version(),
+                'params': {
+                    'rate': args.rate, 'duration': args.duration, 'links': args.links,
+                    'mix': args.mix, 'zipf_s': args.zipf_s, 'concurrency': args.concurrency,
+                },
+                'results': results,
+            }, f, indent=2)
+        print(f'results written to {args.output}')
+    return 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    run = commands.add_parser('run', help='Generate load and report latencies')
+    run.add_argument('--target', default='inprocess',
+                     help="'inprocess' or the base URL of a running server")
+    run.add_argument('--database-url', default=None,
+                     help='In-process target only (default: temporary SQLite file)')
+    run.add_argument('--rate', type=float, default=100, help='Offered requests per second')
+    run.add_argument('--duration', type=float, default=10, help='Measured seconds')
+    run.add_argument('--warmup', type=float, default=2, help='Unmeasured seconds first')
+    run.add_argument('--links', type=int, default=1000, help='Links seeded before the run')
+    run.add_argument('--mix', type=parse_mix, default=parse_mix('create=1,redirect=8,state=1'))
+    run.add_argument('--zipf-s', type=float, default=1.1, help='Zipf exponent for redirects')
+    run.add_argument('--concurrency', type=int, default=16, help='Max requests in flight')
+    run.add_argument('--seed', type=int, default=None)
+    run.add_argument('--output', help='Write results as JSON to this file')
+    run.set_defaults(handler=_run_command)
+
+    cmp_parser = commands.add_parser('compare', help='Flag regressions between two runs')
+    cmp_parser.add_argument('baseline')
+    cmp_parser.add_argument('current')
+    cmp_parser.add_argument('--threshold', type=float, default=0.10,
+                            help='Allowed relative change (0.10 = 10%%)')
+    cmp_parser.set_defaults(handler=_compare_command)
+
+    args = parser.parse_args(argv)
+    return args.handler(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
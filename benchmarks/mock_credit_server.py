@@ -0,0 +1,150 @@
+"""Local stand-in for the Bedrock credit service.
+
+Accepts ``POST /credit`` (one credit) and ``POST /credit/batch``
+(``{"credits": [...]}``), waits ``--latency-ms`` per request and answers
+like the real service.  HTTP/1.1 keep-alive is supported, and
+``GET /stats`` reports requests served and TCP connections accepted, so
+connection reuse is visible.
+
+Faults can be injected: ``--failure-rate`` answers that fraction of
+credit requests with ``--fail-status`` (503 by default).  In-process
+users can change ``server.failure_rate`` / ``server.latency`` on the fly
+to simulate an outage and its recovery.
+
+    python -m benchmarks.mock_credit_server --port 8099 --latency-ms 50
+    python -m benchmarks.mock_credit_server --failure-rate 0.3 --fail-status 500
+    BEDROCK_CREDIT_URL=http://127.0.0.1:8099/credit BEDROCK_BEARER_TOKEN=x celery -A tasks worker
+"""
+import argparse
+import itertools
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class MockCreditServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address=('127.0.0.1', 0), latency=0.05, failure_rate=0.0,
+                 fail_status=503, seed=None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.fail_status = fail_status
+        self._random = random.Random(seed)
+        self.requests = 0
+        self.failures = 0
+        self.connections = 0
+        self._txn_ids = itertools.count(1)
+        self._stats_lock = threading.Lock()
+        super().__init__(address, _Handler)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def process_request(self, request, client_address):
+        with self._stats_lock:
+            self.connections += 1
+        super().process_request(request, client_address)
+
+    def inject_failure(self):
+        """Whether this request should fail (counted when it does)."""
+        with self._stats_lock:
+            if self.failure_rate and self._random.random() < self.failure_rate:
+                self.failures += 1
+                return True
+            return False
+
+    def next_txn_id(self):
+        with self._stats_lock:
+            self.requests += 1
+        return f'mock-txn-{next(self._txn_ids)}'
+
+    def start(self):
+        """Serve from a daemon thread. Returns self."""
+        threading.Thread(target=self.serve_forever, name='mock-credit-server', daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Send headers and body in one segment; otherwise Nagle plus delayed
+    # ACKs add ~40ms to every keep-alive response.
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._reply(200, {
+                'requests': self.server.requests,
+                'failures': self.server.failures,
+                'connections': self.server.connections,
+            })
+        else:
+            self._reply(404, {'error': 'not found'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            self._reply(400, {'error': 'invalid JSON'})
+            return
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        if self.path.startswith('/credit') and self.server.inject_failure():
+            self._reply(self.server.fail_status, {'error': 'injected failure'})
+        elif self.path == '/credit':
+            self._reply(200, {'transaction_id': self.server.next_txn_id()})
+        elif self.path == '/credit/batch':
+            self._reply(200, {'results': [
+                {'status': 'completed', 'transaction_id': self.server.next_txn_id()}
+                for _ in payload.get('credits', [])
+            ]})
+        else:
+            self._reply(404, {'error': 'not found'})
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    parser.add_argument('--latency-ms', type=float, default=50)
+    parser.add_argument('--failure-rate', type=float, default=0.0,
+                        help='Fraction of credit requests answered with --fail-status')
+    parser.add_argument('--fail-status', type=int, default=503)
+    args = parser.parse_args(argv)
+
+    server = MockCreditServer(
+        (args.host, args.port), latency=args.latency_ms / 1000,
+        failure_rate=args.failure_rate, fail_status=args.fail_status,
+    )
+    print(f'Mock credit service on {server.url}/credit ({args.latency_ms:g}ms latency)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
@@ -44,6 +44,28 @@ def make_celery(app_name=__name__):
     backend = os.getenv('CELERY_RESULT_BACKEND', broker)
     celery = Celery(app_name, broker=broker, backend=backend)
     celery.conf.update(task_track_started=True)
+
+    beat_schedule = {
+        'roll-up-clicks': {
+            'task': 'tasks.roll_up_clicks',
+            'schedule': float(os.getenv('ROLLUP_INTERVAL', '60')),
+        },
+        'maintain-click-partitions': {
+            'task': 'tasks.maintain_click_partitions',
+            'schedule': float(os.getenv('PARTITION_MAINTENANCE_INTERVAL', '3600')),
+        },
+        'retry-rewards': {
+            'task': 'tasks.retry_rewards',
+            'schedule': float(os.getenv('REWARD_RETRY_INTERVAL', '15')),
+        },
+    }
+    if os.getenv('REWARD_MODE') == 'batch':
+        # Close a reward batch at least every REWARD_BATCH_INTERVAL seconds.
+        beat_schedule['settle-pending-rewards'] = {
+            'task': 'tasks.settle_pending_rewards',
+            'schedule': float(os.getenv('REWARD_BATCH_INTERVAL', '2')),
+        }
+    celery.conf.beat_schedule = beat_schedule
     return celery
 
 
@@ -1,42 +1,130 @@
 import logging
+import threading
+import time
 
 from flask import Flask, jsonify
 from flask_sqlalchemy import SQLAlchemy
 from dotenv import load_dotenv
 
+from fiverr.replicas import RoutingSession
+
 load_dotenv()
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 logger = logging.getLogger(__name__)
 
 
-def _init_redis(app):
-    """Create a Redis client and store it on the app.
+def get_redis(app=None):
+    """Return the app's Redis client, connecting on first use.
 
-    Returns None (and logs a warning) when Redis is unavailable so the
-    application degrades gracefully to DB-only lookups.
+    Nothing touches Redis at startup: the first caller pings it (1s connect
+    timeout).  Returns None (and logs a warning) while Redis is unavailable
+    so the application degrades gracefully to DB-only lookups; once
+    ``REDIS_RETRY_SECONDS`` have passed the next caller schedules another
+    attempt on a background thread and still gets None.  A caller that
+    finds a connection attempt already in progress gets None instead of
+    waiting.  Once connected, None is also returned while the Redis circuit
+    breaker is open (see :mod:`fiverr.redis_circuit`).
     """
-    try:
-        import redis
-        client = redis.Redis.from_url(
-            app.config.get('REDIS_URL', 'redis://localhost:6379/0'),
-            decode_responses=True,
-            socket_connect_timeout=1,
-        )
-        client.ping()
+    from flask import current_app
+    app = app or current_app._get_current_object()
+    client = app.extensions.get('redis')
+    if client is not None:
+        from fiverr.circuit import CLOSED
+        breaker = app.extensions.get('redis_breaker')
+        if breaker is not None and breaker.state != CLOSED:
+            return None
         return client
-    except Exception as exc:
-        logger.warning("Redis unavailable, caching disabled: %s", exc)
+    if 'redis' in app.extensions:
+        # A previous attempt failed; retry without holding up this caller.
+        now = time.monotonic()
+        if now >= app.extensions.get('redis_retry_at', 0):
+            app.extensions['redis_retry_at'] = now + app.config.get('REDIS_RETRY_SECONDS', 30)
+            connect_redis_in_background(app)
         return None
+    return _connect_redis(app)
 
 
-def create_app(config_overrides=None):
+def _connect_redis(app):
+    """One connection attempt; returns the client or None."""
+    lock = app.extensions.setdefault('redis_lock', threading.Lock())
+    if not lock.acquire(blocking=False):
+        return None
+    try:
+        if app.extensions.get('redis') is not None:
+            return app.extensions['redis']
+        try:
+            import redis
+            client = redis.Redis.from_url(
+                app.config.get('REDIS_URL', 'redis://localhost:6379/0'),
+                decode_responses=True,
+                socket_connect_timeout=1,
+                socket_timeout=app.config.get('REDIS_SOCKET_TIMEOUT'),
+            )
+            client.ping()
+        except Exception as exc:
+            logger.warning("Redis unavailable, caching disabled: %s", exc)
+            app.extensions['redis'] = None
+            app.extensions['redis_retry_at'] = (
+                time.monotonic() + app.config.get('REDIS_RETRY_SECONDS', 30)
+            )
+            return None
+        from fiverr.redis_circuit import create_redis_breaker
+        create_redis_breaker(app, client)
+        app.extensions['redis'] = client
+    finally:
+        lock.release()
+
+    for hook in app.extensions.get('redis_connect_hooks', ()):
+        try:
+            hook(client)
+        except Exception as exc:
+            logger.warning("Redis connect hook %s failed: %s", getattr(hook, '__name__', hook), exc)
+    return client
+
+
+def on_redis_connect(app, hook):
+    """Call ``hook(client)`` once Redis is connected (now, if it already is)."""
+    app.extensions.setdefault('redis_connect_hooks', []).append(hook)
+    client = app.extensions.get('redis')
+    if client is not None:
+        hook(client)
+
+
+def connect_redis_in_background(app):
+    """Resolve the Redis connection off the startup path (daemon thread)."""
+    thread = threading.Thread(target=_connect_redis, args=(app,), name='redis-connect', daemon=True)
+    thread.start()
+    return thread
+
+
+def _init_link_cache(app):
+    """Create the L1 link cache and subscribe it to cross-worker invalidations."""
+    max_entries = app.config.get('LINK_CACHE_SIZE', 0)
+    if max_entries <= 0:
+        app.extensions['link_cache'] = None
+        return
+
+    from fiverr.cache import LocalLinkCache, start_invalidation_listener
+    local_cache = LocalLinkCache(
+        max_entries=max_entries,
+        max_bytes=app.config['LINK_CACHE_MAX_BYTES'],
+        ttl=app.config['LINK_CACHE_TTL'],
+    )
+    app.extensions['link_cache'] = local_cache
+    on_redis_connect(app, lambda client: start_invalidation_listener(client, local_cache))
+
+
+def create_app(config_overrides=None, web=True):
     """Application factory.
 
     Args:
         config_overrides: dict of config keys to override (used by tests).
+        web: when False, build a worker app — config, database and a lazily
+            connected Redis only, with no blueprint, request hooks, caches,
+            CLI commands or background threads.
     Returns:
-        Configured Flask application with all extensions and blueprints.
+        Configured Flask application.
     """
     app = Flask(__name__)
 
@@ -47,15 +135,59 @@ def create_app(config_overrides=None):
     if config_overrides:
         app.config.update(config_overrides)
 
+    # The engine is created here but opens no connection until first use.
     db.init_app(app)
 
-    # Initialise Redis (graceful degradation if unavailable).
-    app.extensions['redis'] = _init_redis(app)
+    # Read replicas (if configured) for the session's read-only blocks.
+    from fiverr.replicas import init_replicas
+    init_replicas(app)
+
+    if not web:
+        if app.config.get('METRICS_ENABLED'):
+            from fiverr import metrics
+            metrics.configure(app)
+        return app
+
+    # Request latency / status metrics and DB pool checkout timing.
+    if app.config.get('METRICS_ENABLED'):
+        from fiverr import metrics
+        metrics.init_app(app)
+
+    # In-process L1 link cache in front of Redis (disabled when size is 0).
+    _init_link_cache(app)
+
+    # Heavy-hitter tracker; hot links are pinned in Redis and refreshed ahead.
+    from fiverr.hotlinks import init_hot_links, start_hot_link_refresher
+    if init_hot_links(app) is not None:
+        on_redis_connect(app, lambda client: start_hot_link_refresher(
+            app, app.config['HOT_LINK_REFRESH_SECONDS']
+        ))
+
+    # Windowed duplicate-click suppression (off unless CLICK_DEDUP_ENABLED).
+    from fiverr.dedup import init_click_dedup
+    init_click_dedup(app)
+
+    # Opt-in per-request timing and sampled profiling (no hooks when off).
+    if app.config.get('REQUEST_TIMING_ENABLED') or app.config.get('REQUEST_PROFILE_SAMPLE'):
+        from fiverr import instrumentation
+        instrumentation.init_app(app)
 
     # Register blueprint — imported lazily to avoid circular imports.
     from fiverr.routes import api_bp
     app.register_blueprint(api_bp)
 
+    from fiverr.cli import register_commands
+    register_commands(app)
+
+    # Optionally preload hot links into Redis without delaying startup.
+    if app.config.get('CACHE_WARMUP_ON_START'):
+        from fiverr.warmup import start_background_warmup
+        on_redis_connect(app, lambda client: start_background_warmup(app))
+
+    # Connect to Redis off the startup path; until then (and while Redis is
+    # down) requests are served from the DB.
+    connect_redis_in_background(app)
+
     # App-wide error handlers (blueprint-level 404 doesn't catch unknown URLs).
     @app.errorhandler(404)
     def not_found(error):
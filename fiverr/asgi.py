@@ -0,0 +1,331 @@
+"""Native asyncio redirect service (ASGI).
+
+Serves only ``GET /link/<short_code>``, with async Redis and an async
+SQLAlchemy engine, so one process holds thousands of in-flight redirects
+without a thread each.  It shares the ``links``/``clicks`` tables, the
+``link:{short_code}`` Redis hashes and the click stream with the Flask app,
+so both stacks can run side by side::
+
+    pip install uvicorn asyncpg        # aiosqlite for SQLite
+    uvicorn fiverr.asgi:app --workers 4
+
+Everything else (link creation, analytics) stays on the Flask app.
+"""
+import asyncio
+import json
+import logging
+from urllib.parse import quote
+
+from sqlalchemy import insert, select, update
+
+from fiverr.cache import LinkRecord, LocalLinkCache, link_cache_key, store_link
+from fiverr.circuit import CLOSED, OPEN, CircuitBreaker
+from fiverr.clickstream import click_event
+from fiverr.config import Config
+from fiverr.dedup import AsyncRedisClickDeduper, RotatingBloomFilter, is_duplicate_click_async
+from fiverr.metrics import observe_circuit_state
+from fiverr.models import Click, Link
+from fiverr.redis_circuit import guard_async_redis
+from fiverr.rewards import REWARD_AMOUNT
+
+logger = logging.getLogger(__name__)
+
+_ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'postgres': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def async_database_url(url):
+    """Map a sync database URL onto its async driver (asyncpg / aiosqlite)."""
+    scheme, sep, rest = url.partition('://')
+    base = scheme.split('+', 1)[0]
+    if base not in _ASYNC_DRIVERS:
+        raise ValueError(f'No async driver configured for {scheme!r} URLs')
+    return f'{_ASYNC_DRIVERS[base]}{sep}{rest}'
+
+
+class RedirectService:
+    """ASGI application resolving short codes and recording clicks."""
+
+    def __init__(self, config_overrides=None):
+        self.config = {
+            key: getattr(Config, key) for key in dir(Config) if key.isupper()
+        }
+        if config_overrides:
+            self.config.update(config_overrides)
+        self.engine = None
+        self.redis = None
+        self.redis_breaker = None
+        self.link_cache = None
+        self.click_dedup = None
+        self._started = False
+        self._start_lock = asyncio.Lock()
+        self._background = set()
+
+    async def startup(self):
+        if self._started:
+            return
+        async with self._start_lock:
+            if self._started:
+                return
+            from sqlalchemy.ext.asyncio import create_async_engine
+
+            self.engine = create_async_engine(
+                async_database_url(self.config['SQLALCHEMY_DATABASE_URI']),
+                **self.config.get('ASYNC_ENGINE_OPTIONS', {}),
+            )
+            self.redis = await self._connect_redis()
+            if self.config.get('LINK_CACHE_SIZE', 0) > 0:
+                self.link_cache = LocalLinkCache(
+                    max_entries=self.config['LINK_CACHE_SIZE'],
+                    max_bytes=self.config['LINK_CACHE_MAX_BYTES'],
+                    ttl=self.config['LINK_CACHE_TTL'],
+                )
+            if self.config.get('CLICK_DEDUP_ENABLED'):
+                window = self.config['CLICK_DEDUP_WINDOW_SECONDS']
+                self.click_dedup = RotatingBloomFilter(
+                    window_seconds=window,
+                    capacity=self.config['CLICK_DEDUP_CAPACITY'],
+                    error_rate=self.config['CLICK_DEDUP_ERROR_RATE'],
+                )
+                if self.config.get('CLICK_DEDUP_BACKEND') == 'redis' and self.redis is not None:
+                    self.click_dedup = AsyncRedisClickDeduper(
+                        self.redis, window, fallback=self.click_dedup
+                    )
+            self._started = True
+
+    async def _connect_redis(self):
+        """Connect and ping Redis; the client is guarded by ``self.redis_breaker``."""
+        try:
+            import redis.asyncio as aioredis
+            client = aioredis.Redis.from_url(
+                self.config.get('REDIS_URL', 'redis://localhost:6379/0'),
+                decode_responses=True,
+                socket_connect_timeout=1,
+                socket_timeout=self.config.get('REDIS_SOCKET_TIMEOUT'),
+            )
+            await client.ping()
+        except Exception as exc:
+            logger.warning("Redis unavailable, async redirects use the DB only: %s", exc)
+            return None
+
+        def on_state_change(breaker, previous, state):
+            observe_circuit_state(breaker, previous, state)
+            if state == OPEN and previous == CLOSED:
+                logger.warning("Redis circuit opened, async redirects use the DB only")
+
+        self.redis_breaker = CircuitBreaker(
+            'redis',
+            failure_threshold=self.config.get('REDIS_BREAKER_FAILURES', 5),
+            reset_timeout=self.config.get('REDIS_BREAKER_RESET_SECONDS', 5),
+            on_state_change=on_state_change,
+        )
+        observe_circuit_state(self.redis_breaker, None, CLOSED)
+        return guard_async_redis(client, self.redis_breaker)
+
+    def _redis_up(self):
+        """Whether Redis is connected and its circuit lets commands through."""
+        return self.redis is not None and self.redis_breaker.state != OPEN
+
+    async def shutdown(self):
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+        if self.redis is not None:
+            await self.redis.close()
+        if self.engine is not None:
+            await self.engine.dispose()
+        self._started = False
+
+    # -- ASGI -----------------------------------------------------------------
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        await self.startup()
+        path = scope['path']
+        if scope['method'] != 'GET' or not path.startswith('/link/'):
+            await _send_json(send, 404, {'error': 'Endpoint not found'})
+            return
+
+        short_code = path[len('/link/'):]
+        if not short_code or '/' in short_code:
+            await _send_json(send, 404, {'error': 'Endpoint not found'})
+            return
+        if len(short_code) > 10:
+            await _send_json(send, 400, {'error': 'Invalid short code'})
+            return
+
+        try:
+            link = await self.resolve(short_code)
+            if link is None:
+                await _send_json(send, 404, {'error': 'Short link not found'})
+                return
+            headers = _headers(scope)
+            await self.record_click(link, _client_ip(scope, headers), headers.get('user-agent', ''))
+        except Exception as exc:
+            logger.exception("Async redirect failed for %s", short_code)
+            await _send_json(send, 500, {'error': str(exc)})
+            return
+
+        await send({
+            'type': 'http.response.start',
+            'status': 302,
+            'headers': [
+                (b'location', quote(link.original_url, safe=":/?#[]@!$&'()*+,;=%~").encode()),
+                (b'content-length', b'0'),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': b''})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                try:
+                    await self.startup()
+                except Exception as exc:
+                    await send({'type': 'lifespan.startup.failed', 'message': str(exc)})
+                    return
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await self.shutdown()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # -- Redirect path --------------------------------------------------------
+
+    async def resolve(self, short_code):
+        """L1, then Redis, then the DB — same tiers and key format as the Flask app."""
+        if self.link_cache is not None:
+            record = self.link_cache.get(short_code)
+            if record:
+                return record
+
+        cache_key = link_cache_key(short_code)
+        if self._redis_up():
+            try:
+                cached = await self.redis.hgetall(cache_key)
+                if cached:
+                    record = LinkRecord.from_cache(cached)
+                    if self.link_cache is not None:
+                        self.link_cache.set(short_code, record)
+                    return record
+            except Exception:
+                pass  # Redis down mid-request — fall through to DB
+
+        async with self.engine.connect() as conn:
+            row = (await conn.execute(
+                select(Link.id, Link.original_url, Link.seller_id)
+                .where(Link.short_code == short_code)
+            )).first()
+        if not row:
+            return None
+
+        record = LinkRecord(*row)
+        if self.link_cache is not None:
+            self.link_cache.set(short_code, record)
+        if self._redis_up():
+            try:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    store_link(pipe, short_code, record)
+                    await pipe.execute()
+            except Exception:
+                pass
+        return record
+
+    async def is_duplicate(self, link, ip_address, user_agent):
+        """Same window and key as fiverr.dedup; the Redis backend is shared with Flask."""
+        return await is_duplicate_click_async(self.click_dedup, link.id, ip_address, user_agent)
+
+    async def record_click(self, link, ip_address, user_agent):
+        duplicate = await self.is_duplicate(link, ip_address, user_agent)
+        if self.config.get('CLICK_INGEST_MODE') == 'stream' and self._redis_up():
+            try:
+                await self.redis.xadd(
+                    self.config['CLICK_STREAM_KEY'],
+                    click_event(link.id, link.seller_id, ip_address, user_agent,
+                                duplicate=duplicate),
+                    maxlen=self.config.get('CLICK_STREAM_MAXLEN'),
+                    approximate=True,
+                )
+                return
+            except Exception as exc:
+                logger.warning("Click stream append failed, writing inline: %s", exc)
+
+        if duplicate:
+            async with self.engine.begin() as conn:
+                await conn.execute(
+                    update(Link)
+                    .where(Link.id == link.id)
+                    .values(click_count=Link.click_count + 1)
+                )
+            return
+
+        async with self.engine.begin() as conn:
+            click_id = (await conn.execute(
+                insert(Click)
+                .values(link_id=link.id, ip_address=ip_address, user_agent=user_agent)
+                .returning(Click.id)
+            )).scalar_one()
+            await conn.execute(
+                update(Link)
+                .where(Link.id == link.id)
+                .values(click_count=Link.click_count + 1)
+            )
+
+        if self.config.get('REWARD_MODE') != 'batch':
+            self._spawn(self._enqueue_reward(click_id, link.seller_id, link.id))
+
+    def _spawn(self, coro):
+        task = asyncio.ensure_future(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _enqueue_reward(self, click_id, seller_id, link_id):
+        """Publish the reward task by name (no Flask app import in this process)."""
+        try:
+            from celery_app import celery
+            await asyncio.to_thread(
+                celery.send_task, 'tasks.process_reward',
+                args=[click_id, seller_id, link_id, REWARD_AMOUNT],
+            )
+        except Exception as exc:
+            logger.warning("Reward enqueue failed: %s", exc)
+
+
+def _headers(scope):
+    return {
+        name.decode('latin-1').lower(): value.decode('latin-1')
+        for name, value in scope.get('headers', [])
+    }
+
+
+def _client_ip(scope, headers):
+    """Same rule as utils.get_client_ip: first X-Forwarded-For hop, else peer."""
+    forwarded = headers.get('x-forwarded-for')
+    if forwarded:
+        return forwarded.split(',')[0]
+    client = scope.get('client')
+    return client[0] if client else None
+
+
+async def _send_json(send, status, payload):
+    body = json.dumps(payload).encode()
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+app = RedirectService()
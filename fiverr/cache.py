@@ -0,0 +1,202 @@
+"""In-process (L1) link cache layered in front of the Redis hash cache.
+
+Hot short codes resolve from process memory with no network call.  The
+cache is a bounded LRU (entry- and byte-capped) with a per-entry TTL, so
+a stale entry can live at most ``ttl`` seconds even if an invalidation
+message is lost.  Invalidations fan out to every worker through Redis
+pub/sub.
+"""
+import logging
+import sys
+import threading
+import time
+from collections import OrderedDict
+from typing import NamedTuple
+
+logger = logging.getLogger(__name__)
+
+INVALIDATION_CHANNEL = 'link-cache:invalidate'
+
+# TTL of the shared Redis link hashes.
+REDIS_LINK_TTL = 3600
+
+
+def link_cache_key(short_code):
+    """Redis hash key for a link; shared by the Flask and asyncio stacks."""
+    return f'link:{short_code}'
+
+
+def store_link(redis_client, short_code, record, ttl=REDIS_LINK_TTL):
+    """Write a link hash and its TTL (works on clients and pipelines)."""
+    cache_key = link_cache_key(short_code)
+    redis_client.hset(cache_key, mapping=record.to_cache())
+    redis_client.expire(cache_key, ttl)
+
+# Approximate per-entry bookkeeping cost (OrderedDict node, entry tuples).
+_ENTRY_OVERHEAD = 200
+
+
+class LinkRecord(NamedTuple):
+    """Immutable view of the link fields the redirect path needs.
+
+    Built straight from a cache hash (or a DB row) so a warm redirect never
+    touches the ORM session.
+    """
+    id: int
+    original_url: str
+    seller_id: str
+
+    @classmethod
+    def from_cache(cls, cached):
+        return cls(int(cached['id']), cached['original_url'], cached['seller_id'])
+
+    def to_cache(self):
+        return {
+            'id': str(self.id),
+            'original_url': self.original_url,
+            'seller_id': self.seller_id,
+        }
+
+
+def _entry_size(key, value):
+    return _ENTRY_OVERHEAD + sys.getsizeof(key) + sum(sys.getsizeof(v) for v in value)
+
+
+class LocalLinkCache:
+    """Thread-safe, TTL-aware LRU keyed by short code.
+
+    Values are :class:`LinkRecord` tuples (or any other immutable
+    sequence).
+    """
+
+    def __init__(self, max_entries=10000, max_bytes=32 * 1024 * 1024, ttl=60,
+                 clock=time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] <= self._clock():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def set(self, key, value):
+        size = _entry_size(key, value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+            self._data[key] = (self._clock() + self.ttl, size, value)
+            self._bytes += size
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._data))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._data:
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        _, size, _ = self._data.pop(key)
+        self._bytes -= size
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._data),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'invalidations': self.invalidations,
+            }
+
+    def __len__(self):
+        return len(self._data)
+
+
+def start_invalidation_listener(redis_client, local_cache):
+    """Drop L1 entries named on the invalidation channel (daemon thread).
+
+    Returns the thread, or None if the subscription could not be set up.
+    """
+    try:
+        pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(INVALIDATION_CHANNEL)
+    except Exception as exc:
+        logger.warning("L1 cache invalidation listener disabled: %s", exc)
+        return None
+
+    def listen():
+        while True:
+            try:
+                # Poll rather than block in listen(): the client's socket
+                # timeout would otherwise fire on every idle second.
+                message = pubsub.get_message(timeout=1.0)
+                if message and message.get('type') == 'message':
+                    local_cache.invalidate(message['data'])
+            except Exception as exc:
+                # Connection dropped: everything cached may have missed an
+                # invalidation, so start over from an empty cache.
+                logger.warning("L1 invalidation listener reconnecting: %s", exc)
+                local_cache.clear()
+                time.sleep(1)
+
+    thread = threading.Thread(target=listen, name='link-cache-invalidator', daemon=True)
+    thread.start()
+    return thread
+
+
+def invalidate_link(app, short_code):
+    """Evict ``short_code`` from every cache tier in every worker.
+
+    Call this whenever a link's cached fields (``original_url``,
+    ``seller_id``) change or the link is removed.
+    """
+    local_cache = app.extensions.get('link_cache')
+    if local_cache is not None:
+        local_cache.invalidate(short_code)
+
+    from fiverr import get_redis
+
+    redis_client = get_redis(app)
+    if redis_client:
+        try:
+            redis_client.delete(link_cache_key(short_code))
+            redis_client.publish(INVALIDATION_CHANNEL, short_code)
+        except Exception as exc:
+            logger.warning("Link cache invalidation failed for %s: %s", short_code, exc)
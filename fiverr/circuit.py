@@ -0,0 +1,102 @@
+"""Circuit breaker for calls to a dependency that can degrade.
+
+``closed``: calls go through; ``failure_threshold`` consecutive failures
+open the circuit.  ``open``: calls are rejected immediately for
+``reset_timeout`` seconds.  ``half_open``: up to ``half_open_max_calls``
+probe calls are let through; a success closes the circuit, a failure
+re-opens it for another ``reset_timeout``.
+
+Breakers are per process and thread-safe::
+
+    breaker = CircuitBreaker('credit', failure_threshold=5, reset_timeout=30)
+    if breaker.allow():
+        try:
+            result = call()
+        except TransientError:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+"""
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitOpenError(Exception):
+    """Raised by :meth:`CircuitBreaker.call` when the circuit rejects a call."""
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, half_open_max_calls=1,
+                 clock=time.monotonic, on_state_change=None):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_max_calls = half_open_max_calls
+        self._clock = clock
+        self._on_state_change = on_state_change
+        self._lock = threading.Lock()
+        self._state = CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+
+    @property
+    def state(self):
+        with self._lock:
+            self._refresh()
+            return self._state
+
+    def _refresh(self):
+        if self._state == OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._transition(HALF_OPEN)
+            self._probes = 0
+
+    def _transition(self, state):
+        previous, self._state = self._state, state
+        if self._on_state_change and previous != state:
+            self._on_state_change(self, previous, state)
+
+    def allow(self):
+        """Whether a call may proceed now (counts as a probe when half-open)."""
+        with self._lock:
+            self._refresh()
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and self._probes < self.half_open_max_calls:
+                self._probes += 1
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            if self._state != CLOSED:
+                self._transition(CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == HALF_OPEN or self._failures >= self.failure_threshold:
+                self._opened_at = self._clock()
+                self._transition(OPEN)
+
+    def call(self, func, *args, **kwargs):
+        """Run ``func`` through the breaker; any exception counts as a failure."""
+        if not self.allow():
+            raise CircuitOpenError(f'circuit {self.name!r} is open')
+        try:
+            result = func(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        self.record_success()
+        return result
+
+    def stats(self):
+        with self._lock:
+            self._refresh()
+            return {'name': self.name, 'state': self._state, 'failures': self._failures}
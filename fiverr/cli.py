@@ -0,0 +1,142 @@
+"""Flask CLI commands (``flask --app app <command>``)."""
+import os
+import socket
+
+import click
+from flask.cli import with_appcontext
+
+
+@click.command('consume-clicks')
+@click.option('--consumer', default=None,
+              help='Consumer name within the group (default: host-pid). A dead '
+                   "consumer's unacked clicks are claimed by the others once idle.")
+@click.option('--batch-size', default=None, type=int,
+              help='Max clicks per write batch (default: CLICK_BATCH_SIZE).')
+@click.option('--block-ms', default=5000, show_default=True,
+              help='How long to wait for new clicks before polling again.')
+@with_appcontext
+def consume_clicks_command(consumer, batch_size, block_ms):
+    """Drain the click stream into the database."""
+    from flask import current_app
+    from fiverr.clickstream import run_consumer
+
+    consumer = consumer or f'{socket.gethostname()}-{os.getpid()}'
+    batch_size = batch_size or current_app.config['CLICK_BATCH_SIZE']
+    click.echo(f'Consuming clicks as {consumer!r} (batch size {batch_size})')
+    run_consumer(consumer, batch_size=batch_size, block_ms=block_ms)
+
+
+@click.command('warm-cache')
+@click.option('--top', 'top_n', default=None, type=int,
+              help='How many links to preload (default: CACHE_WARMUP_TOP_N).')
+@click.option('--source', type=click.Choice(['click_count', 'recent']), default=None,
+              help='Rank by lifetime clicks or by the last 24h of rollups.')
+@click.option('--window-hours', default=24, show_default=True,
+              help='Window for --source recent.')
+@with_appcontext
+def warm_cache_command(top_n, source, window_hours):
+    """Preload the hottest links into the Redis cache."""
+    from flask import current_app
+    from fiverr import get_redis
+    from fiverr.warmup import warm_link_cache
+
+    app = current_app._get_current_object()
+    if not get_redis(app):
+        raise click.ClickException('Redis is unavailable; nothing to warm')
+    result = warm_link_cache(
+        app,
+        top_n=top_n or app.config['CACHE_WARMUP_TOP_N'],
+        source=source or app.config['CACHE_WARMUP_SOURCE'],
+        window_hours=window_hours,
+    )
+    click.echo(f"Loaded {result['loaded']} keys in {result['elapsed_seconds']:.3f}s "
+               f"(source: {result['source']})")
+
+
+@click.command('reconcile-credits')
+@click.option('--fix', is_flag=True, help='Reset drifted links to their ledger total.')
+@with_appcontext
+def reconcile_credits_command(fix):
+    """Check links.credits_earned against the completed rewards ledger."""
+    from fiverr.rewards import reconcile_credits
+
+    drift = reconcile_credits(fix=fix)
+    for link_id, recorded, ledger in drift:
+        click.echo(f'link {link_id}: credits_earned={recorded} ledger={ledger}')
+    if not drift:
+        click.echo('All links match the rewards ledger')
+    elif fix:
+        click.echo(f'Fixed {len(drift)} link(s)')
+    else:
+        raise click.ClickException(f'{len(drift)} link(s) drifted; re-run with --fix')
+
+
+@click.command('export')
+@click.argument('table', type=click.Choice(['links', 'clicks', 'rewards']))
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), default='ndjson',
+              show_default=True)
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip the output.')
+@click.option('--since-id', default=None, type=int,
+              help='Only rows with a larger id (resume / incremental dumps).')
+@click.option('--batch-size', default=5000, show_default=True,
+              help='Rows fetched per cursor round trip.')
+@click.option('-o', '--output', default='-', type=click.Path(dir_okay=False, allow_dash=True),
+              help='Output file (default: stdout).')
+@with_appcontext
+def export_command(table, fmt, compress, since_id, batch_size, output):
+    """Stream a full table dump as NDJSON or CSV (from a replica if configured)."""
+    import time
+    from fiverr.export import TableExport
+    from fiverr.replicas import use_replica
+
+    export = TableExport(table, fmt, compress=compress, since_id=since_id,
+                         batch_size=batch_size)
+    start = time.perf_counter()
+    with use_replica(), click.open_file(output, 'wb') as out:
+        for chunk in export:
+            out.write(chunk)
+    elapsed = time.perf_counter() - start
+    click.echo(f'Exported {export.rows} {table} rows in {elapsed:.3f}s', err=True)
+
+
+@click.command('import-links')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'ndjson']), default=None,
+              help='Input format (default: from the file extension).')
+@click.option('--batch-size', default=10000, show_default=True,
+              help='Records validated and merged per transaction.')
+@click.option('--rejects', 'rejects_path', default=None, type=click.Path(dir_okay=False),
+              help='Where to write rejected records (default: PATH.rejects.ndjson).')
+@click.option('--quiet', is_flag=True, help='Only print the final summary.')
+@with_appcontext
+def import_links_command(path, fmt, batch_size, rejects_path, quiet):
+    """Bulk-load (seller_id, original_url) pairs from CSV or NDJSON."""
+    from fiverr.importer import import_links
+
+    def progress(totals):
+        click.echo(f"{totals['read']} read, {totals['created']} created, "
+                   f"{totals['rejected']} rejected "
+                   f"({totals['read'] / max(totals['elapsed_seconds'], 1e-9):.0f} rows/s)",
+                   err=True)
+
+    try:
+        result = import_links(
+            path, fmt=fmt, batch_size=batch_size,
+            rejects_path=rejects_path or f'{path}.rejects.ndjson',
+            progress=None if quiet else progress,
+        )
+    except ValueError as exc:
+        raise click.ClickException(str(exc))
+    click.echo(f"Imported {result['read']} rows in {result['elapsed_seconds']:.3f}s "
+               f"({result['rows_per_second']:.0f} rows/s): {result['created']} created, "
+               f"{result['existing']} existing, {result['rejected']} rejected")
+    if result['rejects_path']:
+        click.echo(f"Rejected rows written to {result['rejects_path']}")
+
+
+def register_commands(app):
+    app.cli.add_command(consume_clicks_command)
+    app.cli.add_command(warm_cache_command)
+    app.cli.add_command(reconcile_credits_command)
+    app.cli.add_command(export_command)
+    app.cli.add_command(import_links_command)
@@ -0,0 +1,385 @@
+"""Write-behind click ingestion.
+
+In ``stream`` mode the redirect only appends a click event to an
+append-only log and returns.  A consumer-group worker drains the log in
+batches: one multi-row ``Click`` INSERT plus one aggregated
+``click_count`` UPDATE per link, committed together.  Entries are acked
+only after the commit, so a crashed writer's batch is redelivered
+(at-least-once delivery): to the same consumer name when it comes back,
+or to any other consumer once it has been pending for
+``CLICK_STREAM_CLAIM_IDLE_MS``.
+
+Events flagged ``duplicate`` (repeat clicks suppressed by
+:mod:`fiverr.dedup`) only add to ``click_count``; they get no Click row
+and no reward.
+
+An entry that can never be written (unparseable fields, a link that no
+longer exists) is moved to a dead-letter log and acked, so it cannot
+hold up the entries behind it: a batch the database rejects is split in
+halves until the bad entry is isolated.  Entries trimmed from the stream
+by ``MAXLEN`` before they were written come back empty and are acked.
+"""
+import itertools
+import logging
+import threading
+import time
+from collections import Counter, OrderedDict, deque
+from datetime import datetime, timezone
+
+from flask import current_app
+from sqlalchemy import insert, update
+from sqlalchemy.exc import DataError, IntegrityError
+
+from fiverr import db, get_redis
+from fiverr.metrics import CLICKS_DEAD_LETTERED
+from fiverr.models import Click, Link
+from fiverr.rewards import enqueue_reward
+
+logger = logging.getLogger(__name__)
+
+
+class RedisClickLog:
+    """Click log backed by a Redis Stream and a consumer group.
+
+    ``reader`` (default: ``client``) serves :meth:`read`.  A blocking
+    XREADGROUP outlasts the cache client's socket timeout, so consumers
+    read through a separate, unguarded client without one.  Entries
+    pending for another consumer longer than ``claim_idle_ms`` (a writer
+    that died mid-batch) are claimed with XAUTOCLAIM.
+    """
+
+    def __init__(self, client, stream_key, group, maxlen=None, reader=None, claim_idle_ms=None):
+        self.client = client
+        self.reader = reader or client
+        self.stream_key = stream_key
+        self.group = group
+        self.maxlen = maxlen
+        self.claim_idle_ms = claim_idle_ms
+        self._claim_start = '0-0'
+        self._group_ready = False
+
+    def _ensure_group(self):
+        if self._group_ready:
+            return
+        try:
+            self.client.xgroup_create(self.stream_key, self.group, id='0', mkstream=True)
+        except Exception as exc:
+            # BUSYGROUP: another worker created it first.
+            if 'BUSYGROUP' not in str(exc):
+                raise
+        self._group_ready = True
+
+    def append(self, fields):
+        return self.client.xadd(
+            self.stream_key, fields, maxlen=self.maxlen, approximate=True
+        )
+
+    def read(self, consumer, count, block_ms=None):
+        """Return up to ``count`` (entry_id, fields) pairs for ``consumer``.
+
+        Entries this consumer read earlier but never acked are returned
+        first, so a restarted worker finishes its own backlog; then entries
+        other consumers left idle for ``claim_idle_ms``; then new ones.
+        """
+        self._ensure_group()
+        entries = self._read_group(consumer, '0', count)
+        if not entries:
+            entries = self._claim_idle(consumer, count)
+        if not entries:
+            entries = self._read_group(consumer, '>', count, block_ms)
+        return entries
+
+    def _read_group(self, consumer, start, count, block_ms=None):
+        while True:
+            response = self.reader.xreadgroup(
+                self.group, consumer, {self.stream_key: start}, count=count, block=block_ms,
+            )
+            pairs = [pair for _, stream_entries in (response or []) for pair in stream_entries]
+            entries = self._drop_trimmed(pairs)
+            # A page of trimmed entries may hide live ones behind it.
+            if entries or len(entries) == len(pairs):
+                return entries
+
+    def _drop_trimmed(self, pairs):
+        """Ack entries trimmed by MAXLEN (no fields left); return the others."""
+        trimmed = [entry_id for entry_id, fields in pairs if not fields]
+        if trimmed:
+            logger.warning("Acking %d click entries trimmed before they were written", len(trimmed))
+            self.ack(trimmed)
+        return [(entry_id, fields) for entry_id, fields in pairs if fields]
+
+    def _claim_idle(self, consumer, count):
+        if self.claim_idle_ms is None:
+            return []
+        # Reply: [next start id, claimed entries, (Redis 7) deleted ids].
+        response = self.reader.xautoclaim(
+            self.stream_key, self.group, consumer, self.claim_idle_ms,
+            start_id=self._claim_start, count=count,
+        )
+        self._claim_start = response[0]
+        entries = self._drop_trimmed(response[1])
+        if entries:
+            logger.warning("Consumer %s claimed %d idle click entries", consumer, len(entries))
+        return entries
+
+    def ack(self, entry_ids):
+        if entry_ids:
+            self.client.xack(self.stream_key, self.group, *entry_ids)
+
+    def dead_letter(self, entry_id, fields, error):
+        """Move an unwritable entry to ``<stream>:dead`` and ack it."""
+        self.client.xadd(
+            f'{self.stream_key}:dead', {**fields, 'entry_id': entry_id, 'error': error},
+            maxlen=self.maxlen, approximate=True,
+        )
+        self.ack([entry_id])
+
+    def remove_consumer(self, consumer):
+        """Drop ``consumer`` from the group unless it still has pending entries."""
+        pending = self.client.xpending_range(
+            self.stream_key, self.group, min='-', max='+', count=1, consumername=consumer,
+        )
+        if not pending:
+            self.client.xgroup_delconsumer(self.stream_key, self.group, consumer)
+
+
+class LocalClickLog:
+    """In-process stand-in for :class:`RedisClickLog`.
+
+    Same append/read/ack contract (including redelivery of unacked
+    entries and claiming of idle ones), but nothing survives the process.
+    Used by the test suite and single-process development setups.
+    """
+
+    def __init__(self, claim_idle_ms=None, clock=time.monotonic):
+        self.claim_idle_ms = claim_idle_ms
+        self._clock = clock
+        self._entries = deque()
+        self._pending = {}
+        self._delivered_at = {}
+        self.dead_letters = []
+        self._ids = itertools.count(1)
+        self._cond = threading.Condition()
+
+    def append(self, fields):
+        with self._cond:
+            entry_id = f'{int(time.time() * 1000)}-{next(self._ids)}'
+            self._entries.append((entry_id, dict(fields)))
+            self._cond.notify()
+            return entry_id
+
+    def read(self, consumer, count, block_ms=None):
+        with self._cond:
+            pending = self._pending.setdefault(consumer, OrderedDict())
+            if pending:
+                return list(itertools.islice(pending.items(), count))
+            entries = self._claim_idle(pending, count)
+            if entries:
+                return entries
+            if not self._entries and block_ms:
+                self._cond.wait(block_ms / 1000.0)
+            while self._entries and len(entries) < count:
+                entry = self._entries.popleft()
+                pending[entry[0]] = entry[1]
+                self._delivered_at[entry[0]] = self._clock()
+                entries.append(entry)
+            return entries
+
+    def _claim_idle(self, pending, count):
+        if self.claim_idle_ms is None:
+            return []
+        cutoff = self._clock() - self.claim_idle_ms / 1000.0
+        entries = []
+        for other in self._pending.values():
+            for entry_id, fields in list(other.items()):
+                if len(entries) == count:
+                    return entries
+                if other is not pending and self._delivered_at[entry_id] <= cutoff:
+                    del other[entry_id]
+                    pending[entry_id] = fields
+                    self._delivered_at[entry_id] = self._clock()
+                    entries.append((entry_id, fields))
+        return entries
+
+    def ack(self, entry_ids):
+        with self._cond:
+            for pending in self._pending.values():
+                for entry_id in entry_ids:
+                    pending.pop(entry_id, None)
+            for entry_id in entry_ids:
+                self._delivered_at.pop(entry_id, None)
+
+    def dead_letter(self, entry_id, fields, error):
+        with self._cond:
+            self.dead_letters.append((entry_id, {**fields, 'error': error}))
+        self.ack([entry_id])
+
+    def remove_consumer(self, consumer):
+        with self._cond:
+            if not self._pending.get(consumer):
+                self._pending.pop(consumer, None)
+
+    def __len__(self):
+        with self._cond:
+            return len(self._entries) + sum(len(p) for p in self._pending.values())
+
+
+def get_click_log(app=None):
+    """Return the app's click log, creating it on first use.
+
+    Returns None when ingestion is synchronous, or when the Redis backend
+    is selected but Redis is unavailable (callers then write inline).
+    """
+    app = app or current_app._get_current_object()
+    if app.config.get('CLICK_INGEST_MODE', 'sync') != 'stream':
+        return None
+
+    click_log = app.extensions.get('click_log')
+    if click_log is None:
+        claim_idle_ms = app.config.get('CLICK_STREAM_CLAIM_IDLE_MS')
+        if app.config.get('CLICK_STREAM_BACKEND') == 'local':
+            click_log = LocalClickLog(claim_idle_ms=claim_idle_ms)
+        else:
+            redis_client = get_redis(app)
+            if not redis_client:
+                return None
+            click_log = RedisClickLog(
+                redis_client,
+                app.config['CLICK_STREAM_KEY'],
+                app.config['CLICK_STREAM_GROUP'],
+                maxlen=app.config.get('CLICK_STREAM_MAXLEN'),
+                reader=_blocking_reader(app),
+                claim_idle_ms=claim_idle_ms,
+            )
+        app.extensions['click_log'] = click_log
+    return click_log
+
+
+def _blocking_reader(app):
+    """Client for blocking stream reads: no socket timeout, no circuit breaker."""
+    import redis
+    return redis.Redis.from_url(
+        app.config.get('REDIS_URL', 'redis://localhost:6379/0'),
+        decode_responses=True,
+        socket_connect_timeout=1,
+        socket_timeout=None,
+    )
+
+
+def click_event(link_id, seller_id, ip_address, user_agent, duplicate=False):
+    """Log entry fields for one click (string values, as stored in the stream)."""
+    fields = {
+        'link_id': str(link_id),
+        'seller_id': seller_id,
+        'ip_address': ip_address or '',
+        'user_agent': user_agent or '',
+        'clicked_at': datetime.now(timezone.utc).isoformat(),
+    }
+    if duplicate:
+        fields['duplicate'] = '1'
+    return fields
+
+
+def publish_click(click_log, link_id, seller_id, ip_address, user_agent, duplicate=False):
+    """Append one click event to the log. Returns the entry id."""
+    return click_log.append(
+        click_event(link_id, seller_id, ip_address, user_agent, duplicate=duplicate)
+    )
+
+
+def drain_clicks(click_log, consumer, batch_size=500, block_ms=None):
+    """Write one batch of logged clicks to the database.
+
+    Returns the number of clicks counted, duplicates included (0 when the
+    log is empty).  Entries that cannot be written are dead-lettered.  On
+    any other database error the batch is rolled back and left unacked so
+    it is redelivered to this consumer on the next call.
+    """
+    entries = click_log.read(consumer, batch_size, block_ms=block_ms)
+    if not entries:
+        return 0
+
+    parsed = []
+    for entry_id, fields in entries:
+        try:
+            parsed.append((entry_id, fields, _click_row(fields)))
+        except (KeyError, TypeError, ValueError) as exc:
+            _dead_letter(click_log, entry_id, fields, exc)
+    return _write_clicks(click_log, parsed)
+
+
+def _click_row(fields):
+    """``(info, row)`` for one entry: its link and seller, and its Click row
+    (None for a duplicate).  Raises if the fields are malformed."""
+    link_id = int(fields['link_id'])
+    if fields.get('duplicate') == '1':
+        return {'link_id': link_id}, None
+    return {'link_id': link_id, 'seller_id': fields['seller_id']}, {
+        'link_id': link_id,
+        'clicked_at': datetime.fromisoformat(fields['clicked_at']),
+        'ip_address': fields.get('ip_address') or None,
+        'user_agent': fields.get('user_agent', ''),
+    }
+
+
+def _dead_letter(click_log, entry_id, fields, exc):
+    logger.error("Dead-lettering click entry %s: %s", entry_id, exc)
+    click_log.dead_letter(entry_id, fields, f'{type(exc).__name__}: {exc}')
+    CLICKS_DEAD_LETTERED.inc()
+
+
+def _write_clicks(click_log, parsed):
+    """Write and ack ``parsed`` entries, bisecting around rows the DB rejects."""
+    if not parsed:
+        return 0
+    rows = [row for _, _, (_, row) in parsed if row is not None]
+    counts = Counter(info['link_id'] for _, _, (info, _) in parsed)
+    try:
+        click_ids = db.session.execute(
+            insert(Click).returning(Click.id, sort_by_parameter_order=True),
+            rows,
+        ).scalars().all() if rows else []
+
+        for link_id, count in counts.items():
+            db.session.execute(
+                update(Link)
+                .where(Link.id == link_id)
+                .values(click_count=Link.click_count + count)
+            )
+        db.session.commit()
+    except (IntegrityError, DataError) as exc:
+        db.session.rollback()
+        if len(parsed) == 1:
+            entry_id, fields, _ = parsed[0]
+            _dead_letter(click_log, entry_id, fields, exc.orig or exc)
+            return 0
+        middle = len(parsed) // 2
+        return _write_clicks(click_log, parsed[:middle]) + _write_clicks(click_log, parsed[middle:])
+    except Exception:
+        db.session.rollback()
+        raise
+
+    click_log.ack([entry_id for entry_id, _, _ in parsed])
+
+    rewarded = [info for _, _, (info, row) in parsed if row is not None]
+    for click_id, info in zip(click_ids, rewarded):
+        enqueue_reward(click_id, info['seller_id'], info['link_id'])
+
+    return len(parsed)
+
+
+def run_consumer(consumer, batch_size=500, block_ms=5000, stop=None):
+    """Drain the app's click log until ``stop`` (a threading.Event) is set."""
+    click_log = get_click_log()
+    if click_log is None:
+        raise RuntimeError('CLICK_INGEST_MODE is not "stream" or the click log is unavailable')
+
+    while not (stop and stop.is_set()):
+        try:
+            written = drain_clicks(click_log, consumer, batch_size, block_ms=block_ms)
+        except Exception as exc:
+            logger.error("Click batch write failed, will retry: %s", exc)
+            time.sleep(1)
+            continue
+        if written:
+            logger.info("Wrote %d clicks", written)
@@ -7,4 +7,132 @@ class Config:
     )
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     BASE_URL = os.getenv('BASE_URL', 'http://localhost:5000')
+    # Read replicas for read-only endpoints (comma-separated URLs), picked
+    # round_robin or least_connections. A replica more than MAX_LAG seconds
+    # behind (measured every LAG_CHECK seconds) is skipped; with none left,
+    # reads go to the primary.
+    DATABASE_REPLICA_URLS = [
+        url.strip() for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()
+    ]
+    DATABASE_REPLICA_SELECTION = os.getenv('DATABASE_REPLICA_SELECTION', 'round_robin')
+    DATABASE_REPLICA_MAX_LAG_SECONDS = float(os.getenv('DATABASE_REPLICA_MAX_LAG_SECONDS', '5'))
+    DATABASE_REPLICA_LAG_CHECK_SECONDS = float(os.getenv('DATABASE_REPLICA_LAG_CHECK_SECONDS', '5'))
     REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+    # Redis is connected on first use; after a failed attempt the app runs
+    # DB-only for this long before trying again.
+    REDIS_RETRY_SECONDS = float(os.getenv('REDIS_RETRY_SECONDS', '30'))
+    # Per-command socket timeout, and the circuit breaker around the cache:
+    # this many consecutive connection errors/timeouts skip Redis entirely
+    # until a background PING (after the reset period) succeeds.  Blocking
+    # click-stream reads use their own client, without either.
+    REDIS_SOCKET_TIMEOUT = float(os.getenv('REDIS_SOCKET_TIMEOUT', '0.25'))
+    REDIS_BREAKER_FAILURES = int(os.getenv('REDIS_BREAKER_FAILURES', '5'))
+    REDIS_BREAKER_RESET_SECONDS = float(os.getenv('REDIS_BREAKER_RESET_SECONDS', '5'))
+
+    # Short code allocation: key for the code permutation (must be identical
+    # on every worker and never change once codes are issued) and how many
+    # sequence numbers a worker reserves per database round trip.
+    SHORT_CODE_KEY = os.getenv('SHORT_CODE_KEY', 'dev-short-code-key')
+    SHORT_CODE_BLOCK_SIZE = int(os.getenv('SHORT_CODE_BLOCK_SIZE', '1000'))
+
+    # Bearer token for GET /admin/export/<table> (clicks hold visitor IPs
+    # and user agents). Unset disables the HTTP export; `flask export`
+    # always works.
+    EXPORT_API_TOKEN = os.getenv('EXPORT_API_TOKEN', '')
+
+    # Max items accepted by POST /links/batch.
+    LINK_BATCH_MAX_SIZE = int(os.getenv('LINK_BATCH_MAX_SIZE', '10000'))
+
+    # In-process L1 link cache (0 disables). TTL bounds staleness if an
+    # invalidation message is missed.
+    LINK_CACHE_SIZE = int(os.getenv('LINK_CACHE_SIZE', '10000'))
+    LINK_CACHE_MAX_BYTES = int(os.getenv('LINK_CACHE_MAX_BYTES', str(32 * 1024 * 1024)))
+    LINK_CACHE_TTL = int(os.getenv('LINK_CACHE_TTL', '60'))
+
+    # How long GET /state?total=estimate may reuse a cached link count
+    # (non-Postgres databases only; Postgres uses planner statistics).
+    STATE_TOTAL_CACHE_TTL = int(os.getenv('STATE_TOTAL_CACHE_TTL', '30'))
+
+    # Click ingestion: 'sync' writes the Click row inside the redirect request,
+    # 'stream' appends the event to an append-only log drained by a consumer.
+    CLICK_INGEST_MODE = os.getenv('CLICK_INGEST_MODE', 'sync')
+    CLICK_STREAM_BACKEND = os.getenv('CLICK_STREAM_BACKEND', 'redis')
+    CLICK_STREAM_KEY = os.getenv('CLICK_STREAM_KEY', 'clicks:stream')
+    CLICK_STREAM_GROUP = os.getenv('CLICK_STREAM_GROUP', 'click-writers')
+    CLICK_STREAM_MAXLEN = int(os.getenv('CLICK_STREAM_MAXLEN', '1000000'))
+    # Entries a consumer left unacked this long (it died mid-batch) are
+    # claimed by another consumer; keep it above the slowest batch write.
+    CLICK_STREAM_CLAIM_IDLE_MS = int(os.getenv('CLICK_STREAM_CLAIM_IDLE_MS', '60000'))
+    CLICK_BATCH_SIZE = int(os.getenv('CLICK_BATCH_SIZE', '500'))
+
+    # Reward settlement: 'per_click' enqueues one Celery task per click,
+    # 'batch' leaves clicks pending for the periodic batch sweep.
+    REWARD_MODE = os.getenv('REWARD_MODE', 'per_click')
+    REWARD_BATCH_SIZE = int(os.getenv('REWARD_BATCH_SIZE', '200'))
+    # Claimed rewards are credited outside any transaction; a claim not
+    # settled within this many seconds (the worker died) is taken over.
+    # Keep it well above the credit client's worst-case call time.
+    REWARD_CLAIM_TIMEOUT_SECONDS = float(os.getenv('REWARD_CLAIM_TIMEOUT_SECONDS', '300'))
+
+    # Rewards whose credit call failed transiently (or hit the open circuit)
+    # are retried with exponential backoff + jitter, up to REWARD_MAX_ATTEMPTS.
+    REWARD_RETRY_BASE_SECONDS = float(os.getenv('REWARD_RETRY_BASE_SECONDS', '5'))
+    REWARD_RETRY_MAX_SECONDS = float(os.getenv('REWARD_RETRY_MAX_SECONDS', '900'))
+    REWARD_MAX_ATTEMPTS = int(os.getenv('REWARD_MAX_ATTEMPTS', '10'))
+    REWARD_RETRY_BATCH_SIZE = int(os.getenv('REWARD_RETRY_BATCH_SIZE', '100'))
+
+    # Duplicate-click suppression: repeats of (link, IP, user agent) within
+    # the window bump click_count but are not stored or rewarded. 'bloom' is
+    # a per-worker rotating Bloom filter sized by CAPACITY (keys per window)
+    # and ERROR_RATE; 'redis' is exact and shared across workers.
+    CLICK_DEDUP_ENABLED = os.getenv('CLICK_DEDUP_ENABLED', '0').lower() in ('1', 'true', 'yes')
+    CLICK_DEDUP_BACKEND = os.getenv('CLICK_DEDUP_BACKEND', 'bloom')
+    CLICK_DEDUP_WINDOW_SECONDS = int(os.getenv('CLICK_DEDUP_WINDOW_SECONDS', '30'))
+    CLICK_DEDUP_CAPACITY = int(os.getenv('CLICK_DEDUP_CAPACITY', '1000000'))
+    CLICK_DEDUP_ERROR_RATE = float(os.getenv('CLICK_DEDUP_ERROR_RATE', '0.001'))
+
+    # Hourly rollups: rows folded per run, and the widest stats range.
+    ROLLUP_BATCH_SIZE = int(os.getenv('ROLLUP_BATCH_SIZE', '10000'))
+    STATS_MAX_BUCKETS = int(os.getenv('STATS_MAX_BUCKETS', '2208'))  # 92 days of hours
+
+    # clicks partition maintenance (Postgres): partition size, how many
+    # future partitions to keep ready, how many to keep online before they
+    # are archived to CLICK_ARCHIVE_DIR and dropped.
+    CLICK_PARTITION_INTERVAL = os.getenv('CLICK_PARTITION_INTERVAL', 'month')
+    CLICK_PARTITIONS_AHEAD = int(os.getenv('CLICK_PARTITIONS_AHEAD', '3'))
+    CLICK_RETENTION_PERIODS = int(os.getenv('CLICK_RETENTION_PERIODS', '12'))
+    CLICK_ARCHIVE_DIR = os.getenv('CLICK_ARCHIVE_DIR', 'archive/clicks')
+
+    # Preload the hottest links into Redis from a background thread at
+    # startup ('click_count' = lifetime clicks, 'recent' = last 24h rollups).
+    CACHE_WARMUP_ON_START = os.getenv('CACHE_WARMUP_ON_START', '0').lower() in ('1', 'true', 'yes')
+    CACHE_WARMUP_TOP_N = int(os.getenv('CACHE_WARMUP_TOP_N', '1000'))
+    CACHE_WARMUP_SOURCE = os.getenv('CACHE_WARMUP_SOURCE', 'click_count')
+
+    # Heavy-hitter tracking on the redirect path (per worker, fixed memory):
+    # the top-K codes seen at least HOT_LINK_MIN_HITS times per decay window
+    # are pinned in Redis and refreshed from the DB every REFRESH seconds.
+    # Each refresh extends a pinned hash's PIN_TTL, so pins left by a dead
+    # worker still expire.
+    HOT_LINK_TOP_K = int(os.getenv('HOT_LINK_TOP_K', '100'))
+    HOT_LINK_SKETCH_WIDTH = int(os.getenv('HOT_LINK_SKETCH_WIDTH', '2048'))
+    HOT_LINK_SKETCH_DEPTH = int(os.getenv('HOT_LINK_SKETCH_DEPTH', '4'))
+    HOT_LINK_MIN_HITS = int(os.getenv('HOT_LINK_MIN_HITS', '20'))
+    HOT_LINK_DECAY_SECONDS = int(os.getenv('HOT_LINK_DECAY_SECONDS', '60'))
+    HOT_LINK_REFRESH_SECONDS = int(os.getenv('HOT_LINK_REFRESH_SECONDS', '30'))
+    HOT_LINK_PIN_TTL = int(os.getenv('HOT_LINK_PIN_TTL', '86400'))
+
+    # GET /metrics. With several worker processes (gunicorn, Celery), point
+    # METRICS_MULTIPROC_DIR at a directory shared by all of them on the host;
+    # each process writes a snapshot there every METRICS_FLUSH_SECONDS.
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1').lower() in ('1', 'true', 'yes')
+    METRICS_MULTIPROC_DIR = os.getenv('METRICS_MULTIPROC_DIR', '')
+    METRICS_FLUSH_SECONDS = float(os.getenv('METRICS_FLUSH_SECONDS', '5'))
+
+    # Opt-in per-request breakdown (SQL / Redis / to_dict time) reported as
+    # a Server-Timing header, a JSON log line or both; and cProfile capture
+    # of one request in REQUEST_PROFILE_SAMPLE (0 disables).
+    REQUEST_TIMING_ENABLED = os.getenv('REQUEST_TIMING_ENABLED', '0').lower() in ('1', 'true', 'yes')
+    REQUEST_TIMING_OUTPUT = os.getenv('REQUEST_TIMING_OUTPUT', 'header')
+    REQUEST_PROFILE_SAMPLE = int(os.getenv('REQUEST_PROFILE_SAMPLE', '0'))
+    REQUEST_PROFILE_DIR = os.getenv('REQUEST_PROFILE_DIR', 'profiles')
@@ -0,0 +1,246 @@
+"""HTTP client for the Bedrock credit service.
+
+One :class:`CreditClient` per worker process holds a keep-alive
+``requests.Session`` with a bounded connection pool, so reward tasks reuse
+TCP/TLS connections instead of opening one per credit.  ``credit_many``
+keeps up to ``concurrency`` credit calls in flight over that pool.
+
+Configuration comes from the environment (the Celery worker reads it the
+same way the web app does)::
+
+    BEDROCK_CREDIT_URL        single-credit endpoint
+    BEDROCK_CREDIT_BATCH_URL  optional batched endpoint
+    BEDROCK_BEARER_TOKEN      bearer token for both
+    CREDIT_POOL_SIZE          max pooled connections per process (10)
+    CREDIT_CONCURRENCY        max in-flight calls in credit_many (10)
+    CREDIT_TIMEOUT            per-call timeout in seconds (5)
+    CREDIT_BREAKER_FAILURES   consecutive failures that open the circuit (5)
+    CREDIT_BREAKER_RESET_SECONDS  how long the circuit stays open (30)
+
+Outcomes are ``completed``, ``failed`` (the service rejected the credit;
+permanent), ``retry`` (timeout, connection error or 5xx/429; the caller
+schedules another attempt) or ``rejected`` (the circuit is open and the
+call was never made; the caller reschedules without counting an
+attempt).  While the circuit is open calls return ``rejected``
+immediately instead of tying a worker up for the full timeout.
+
+Without a URL and token every call is a local mock that sleeps 50ms.
+"""
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from fiverr.circuit import CircuitBreaker
+from fiverr.metrics import observe_circuit_state
+
+logger = logging.getLogger(__name__)
+
+MOCK_LATENCY = 0.05
+
+COMPLETED = 'completed'
+FAILED = 'failed'
+RETRY = 'retry'
+REJECTED = 'rejected'
+
+
+def _classify(status_code):
+    """Outcome for an HTTP status, and whether it counts against the breaker."""
+    if 200 <= status_code < 300:
+        return COMPLETED, False
+    if status_code == 429 or status_code >= 500:
+        return RETRY, True
+    return FAILED, False
+
+
+def _transaction_id(payload):
+    return payload.get('transaction_id') or payload.get('transactionId')
+
+
+class CreditClient:
+    """Thread-safe, pooled client; outcomes are ``(status, transaction_id)``."""
+
+    def __init__(self, url=None, batch_url=None, token=None, pool_size=10,
+                 concurrency=10, timeout=5.0, breaker=None):
+        self.url = url
+        self.batch_url = batch_url
+        self.token = token
+        self.pool_size = pool_size
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.breaker = breaker or CircuitBreaker('credit')
+        self._session = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        return cls(
+            url=os.getenv('BEDROCK_CREDIT_URL'),
+            batch_url=os.getenv('BEDROCK_CREDIT_BATCH_URL'),
+            token=os.getenv('BEDROCK_BEARER_TOKEN'),
+            pool_size=int(os.getenv('CREDIT_POOL_SIZE', '10')),
+            concurrency=int(os.getenv('CREDIT_CONCURRENCY', '10')),
+            timeout=float(os.getenv('CREDIT_TIMEOUT', '5')),
+            breaker=CircuitBreaker(
+                'credit',
+                failure_threshold=int(os.getenv('CREDIT_BREAKER_FAILURES', '5')),
+                reset_timeout=float(os.getenv('CREDIT_BREAKER_RESET_SECONDS', '30')),
+                on_state_change=observe_circuit_state,
+            ),
+        )
+
+    @property
+    def session(self):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    import requests
+                    from requests.adapters import HTTPAdapter
+
+                    session = requests.Session()
+                    adapter = HTTPAdapter(
+                        pool_connections=2, pool_maxsize=self.pool_size, pool_block=True,
+                    )
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    session.headers.update({
+                        'Authorization': f'Bearer {self.token}',
+                        'Content-Type': 'application/json',
+                    })
+                    self._session = session
+        return self._session
+
+    def close(self):
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+
+    def credit(self, click_id, seller_id, link_id, amount):
+        """Credit one click. Returns ``(status, transaction_id)``."""
+        if not (self.url and self.token):
+            time.sleep(MOCK_LATENCY)
+            return COMPLETED, None
+        if not self.breaker.allow():
+            return REJECTED, None
+
+        # click_id doubles as the idempotency key, so a retried credit whose
+        # first attempt did land is not paid twice.
+        payload = {
+            'seller_id': seller_id,
+            'amount': float(amount),
+            'link_id': link_id,
+            'click_id': click_id,
+        }
+        try:
+            resp = self.session.post(self.url, json=payload, timeout=self.timeout)
+        except Exception as exc:
+            logger.warning("Bedrock call failed: %s", exc)
+            self.breaker.record_failure()
+            return RETRY, None
+
+        status, transient = _classify(resp.status_code)
+        self._record(transient)
+        if status != COMPLETED:
+            return status, None
+        try:
+            return COMPLETED, _transaction_id(resp.json())
+        except ValueError:
+            return COMPLETED, None
+
+    def _record(self, transient_failure):
+        if transient_failure:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+
+    def credit_many(self, items, concurrency=None):
+        """Credit each item with up to ``concurrency`` calls in flight.
+
+        Returns one outcome per item, in order.
+        """
+        concurrency = min(concurrency or self.concurrency, self.pool_size, len(items))
+        if concurrency <= 1:
+            return [self._credit_item(item) for item in items]
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            return list(pool.map(self._credit_item, items))
+
+    def _credit_item(self, item):
+        return self.credit(item['click_id'], item['seller_id'], item['link_id'], item['amount'])
+
+    def credit_batch(self, items):
+        """Credit a batch of clicks. Returns one outcome per item, in order.
+
+        Uses the batched endpoint when configured: one request carrying
+        every credit, answered with a ``results`` list in the same order.
+        Otherwise falls back to concurrent single calls.
+        """
+        if not self.url and not self.batch_url:
+            # local mock latency, paid once for the whole batch
+            time.sleep(MOCK_LATENCY)
+            return [(COMPLETED, None)] * len(items)
+
+        if not (self.batch_url and self.token):
+            return self.credit_many(items)
+        if not self.breaker.allow():
+            return [(REJECTED, None)] * len(items)
+
+        payload = {'credits': [
+            {
+                'seller_id': item['seller_id'],
+                'amount': float(item['amount']),
+                'link_id': item['link_id'],
+                'click_id': item['click_id'],
+            }
+            for item in items
+        ]}
+        try:
+            resp = self.session.post(self.batch_url, json=payload, timeout=self.timeout)
+            status, transient = _classify(resp.status_code)
+            if status != COMPLETED:
+                self._record(transient)
+                return [(status, None)] * len(items)
+            results = resp.json().get('results') or []
+        except Exception as exc:
+            logger.warning("Bedrock batch call failed: %s", exc)
+            self.breaker.record_failure()
+            return [(RETRY, None)] * len(items)
+
+        if len(results) != len(items):
+            logger.warning("Bedrock batch returned %d results for %d credits",
+                           len(results), len(items))
+            self.breaker.record_failure()
+            return [(RETRY, None)] * len(items)
+        self.breaker.record_success()
+        return [
+            (
+                COMPLETED if result.get('status', COMPLETED) == COMPLETED else FAILED,
+                _transaction_id(result),
+            )
+            for result in results
+        ]
+
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_credit_client():
+    """This process's shared client (recreated in forked children)."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = CreditClient.from_env()
+    return _client
+
+
+def _reset_after_fork():
+    # Pooled sockets must not be shared between parent and child.
+    global _client, _client_lock
+    _client = None
+    _client_lock = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
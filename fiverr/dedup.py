@@ -0,0 +1,231 @@
+"""Windowed duplicate-click suppression.
+
+A refresh storm from one visitor should not turn into a stream of Click
+rows, reward tasks and credit calls.  Each redirect is keyed on
+``(link_id, client IP, user agent)``; a key seen again within
+``CLICK_DEDUP_WINDOW_SECONDS`` is a duplicate.  Duplicates still bump the
+link's ``click_count`` (one atomic UPDATE) but get no Click row and no
+reward.
+
+Two backends:
+
+* ``bloom`` (default): a per-worker :class:`RotatingBloomFilter`.  Memory
+  is fixed by ``CLICK_DEDUP_CAPACITY`` and ``CLICK_DEDUP_ERROR_RATE``;
+  nothing leaves the process, so a visitor whose requests land on
+  different workers may be rewarded once per worker.
+* ``redis``: ``SET click:dedup:<digest> 1 NX EX <window>``, exact and
+  shared by all workers at one round trip per redirect.  Redis errors
+  fail open (the click is treated as new); until Redis is connected the
+  Bloom filter is used.  :class:`AsyncRedisClickDeduper` and
+  :func:`is_duplicate_click_async` do the same for the ASGI service.
+
+A false positive means a genuine first click is counted but not
+rewarded, so keep the error rate low.
+"""
+import hashlib
+import inspect
+import logging
+import math
+import threading
+import time
+
+from fiverr.circuit import CircuitOpenError
+from fiverr.metrics import DEDUP_EARLY_ROTATIONS, DUPLICATE_CLICKS, SUPPRESSED_REWARD_CREDITS
+from fiverr.rewards import REWARD_AMOUNT
+
+logger = logging.getLogger(__name__)
+
+REDIS_KEY_PREFIX = 'click:dedup:'
+
+
+def click_key(link_id, ip_address, user_agent):
+    """16-byte digest identifying one visitor's click on one link."""
+    raw = f'{link_id}\x00{ip_address or ""}\x00{user_agent or ""}'.encode('utf-8', 'replace')
+    return hashlib.blake2b(raw, digest_size=16).digest()
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over 16-byte digests."""
+
+    def __init__(self, capacity, error_rate):
+        bits = math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.size = max(8, bits)
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, digest):
+        # Double hashing: k positions from the two halves of the digest.
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def __contains__(self, digest):
+        bits = self._bits
+        return all(bits[p >> 3] & (1 << (p & 7)) for p in self._positions(digest))
+
+    def add(self, digest):
+        bits = self._bits
+        for p in self._positions(digest):
+            bits[p >> 3] |= 1 << (p & 7)
+
+    @property
+    def memory_bytes(self):
+        return len(self._bits)
+
+
+class RotatingBloomFilter:
+    """Two Bloom filter generations that rotate every ``window_seconds``.
+
+    A key is checked against both generations and added to the current
+    one, so it is remembered for at least one window and at most two.
+    Each generation is sized for ``capacity`` keys per window at half the
+    target ``error_rate`` (a lookup consults two filters).  A generation
+    that fills up before its window ends is rotated early, which keeps the
+    error rate but shortens the window under that load.
+    """
+
+    def __init__(self, window_seconds=30, capacity=1_000_000, error_rate=0.001,
+                 clock=time.monotonic):
+        self.window_seconds = window_seconds
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._current = BloomFilter(capacity, error_rate / 2)
+        self._previous = BloomFilter(capacity, error_rate / 2)
+        self._rotated_at = clock()
+        self._added = 0
+
+    def _maybe_rotate(self):
+        elapsed = self._clock() - self._rotated_at
+        if elapsed < self.window_seconds:
+            if self._added < self.capacity:
+                return
+            logger.warning("Click dedup filter reached %d keys after %.1fs, rotating early",
+                           self.capacity, elapsed)
+            DEDUP_EARLY_ROTATIONS.inc()
+        if elapsed >= 2 * self.window_seconds:
+            # Idle for two windows: nothing in either generation is recent.
+            self._previous = BloomFilter(self.capacity, self.error_rate / 2)
+        else:
+            self._previous = self._current
+        self._current = BloomFilter(self.capacity, self.error_rate / 2)
+        self._rotated_at = self._clock()
+        self._added = 0
+
+    def seen(self, digest):
+        """Whether ``digest`` was seen within the window; records it either way."""
+        with self._lock:
+            self._maybe_rotate()
+            if digest in self._current:
+                return True
+            duplicate = digest in self._previous
+            self._current.add(digest)
+            self._added += 1
+            return duplicate
+
+    def stats(self):
+        with self._lock:
+            return {
+                'backend': 'bloom',
+                'window_seconds': self.window_seconds,
+                'capacity': self.capacity,
+                'error_rate': self.error_rate,
+                'hashes': self._current.hashes,
+                'memory_bytes': self._current.memory_bytes + self._previous.memory_bytes,
+                'keys_in_window': self._added,
+            }
+
+
+class RedisClickDeduper:
+    """Shared dedup window in Redis (one ``SET NX EX`` per click).
+
+    Until a client is attached (Redis connects lazily), and while the Redis
+    circuit is open, clicks are checked against ``fallback``, if given.
+    """
+
+    def __init__(self, client, window_seconds=30, fallback=None):
+        self.client = client
+        self.window_seconds = window_seconds
+        self.fallback = fallback
+
+    def seen(self, digest):
+        if self.client is None:
+            return self._fallback_seen(digest)
+        try:
+            created = self.client.set(
+                REDIS_KEY_PREFIX + digest.hex(), 1, nx=True, ex=self.window_seconds
+            )
+        except CircuitOpenError:
+            return self._fallback_seen(digest)
+        except Exception as exc:
+            logger.warning("Click dedup check failed, treating click as new: %s", exc)
+            return False
+        return not created
+
+    def _fallback_seen(self, digest):
+        return self.fallback.seen(digest) if self.fallback is not None else False
+
+    def stats(self):
+        return {'backend': 'redis', 'window_seconds': self.window_seconds,
+                'connected': self.client is not None}
+
+
+class AsyncRedisClickDeduper(RedisClickDeduper):
+    """:class:`RedisClickDeduper` over a ``redis.asyncio`` client."""
+
+    async def seen(self, digest):
+        if self.client is None:
+            return self._fallback_seen(digest)
+        try:
+            created = await self.client.set(
+                REDIS_KEY_PREFIX + digest.hex(), 1, nx=True, ex=self.window_seconds
+            )
+        except CircuitOpenError:
+            return self._fallback_seen(digest)
+        except Exception as exc:
+            logger.warning("Click dedup check failed, treating click as new: %s", exc)
+            return False
+        return not created
+
+
+def init_click_dedup(app):
+    """Create the app's dedup filter when ``CLICK_DEDUP_ENABLED``."""
+    from fiverr import on_redis_connect
+
+    if not app.config.get('CLICK_DEDUP_ENABLED'):
+        return None
+    window = app.config['CLICK_DEDUP_WINDOW_SECONDS']
+    dedup = RotatingBloomFilter(
+        window_seconds=window,
+        capacity=app.config['CLICK_DEDUP_CAPACITY'],
+        error_rate=app.config['CLICK_DEDUP_ERROR_RATE'],
+    )
+    if app.config.get('CLICK_DEDUP_BACKEND') == 'redis':
+        dedup = RedisClickDeduper(None, window, fallback=dedup)
+        on_redis_connect(app, lambda client: setattr(dedup, 'client', client))
+    app.extensions['click_dedup'] = dedup
+    return dedup
+
+
+def _count_duplicate():
+    DUPLICATE_CLICKS.inc()
+    SUPPRESSED_REWARD_CREDITS.inc(amount=REWARD_AMOUNT)
+    return True
+
+
+def is_duplicate_click(dedup, link_id, ip_address, user_agent):
+    """Check one click against ``dedup`` and count it when it is a repeat."""
+    if dedup is None or not dedup.seen(click_key(link_id, ip_address, user_agent)):
+        return False
+    return _count_duplicate()
+
+
+async def is_duplicate_click_async(dedup, link_id, ip_address, user_agent):
+    """:func:`is_duplicate_click` for a Bloom filter or :class:`AsyncRedisClickDeduper`."""
+    if dedup is None:
+        return False
+    seen = dedup.seen(click_key(link_id, ip_address, user_agent))
+    if inspect.isawaitable(seen):
+        seen = await seen
+    return _count_duplicate() if seen else False
@@ -0,0 +1,205 @@
+"""Heavy-hitter detection for the redirect path.
+
+Every resolved redirect feeds its short code to a per-worker
+:class:`HeavyHitterTracker`: a count-min sketch estimates per-code counts
+in fixed memory, and a bounded top-k table keeps the codes with the
+largest estimates.  Counts are halved every ``decay_seconds`` so the
+ranking follows current traffic rather than all-time totals.
+
+Hot codes are pinned in Redis and refreshed ahead of time from the
+database by a background thread, so a viral link never takes a cache
+miss.  A pinned hash gets the long ``HOT_LINK_PIN_TTL``, which every
+refresh extends, so pins left behind by a dead worker still expire.
+Codes that drop out of the hot set get the normal TTL back.
+"""
+import logging
+import threading
+import time
+from array import array
+
+from sqlalchemy import select
+
+from fiverr import db, get_redis
+from fiverr.cache import REDIS_LINK_TTL, LinkRecord, link_cache_key, store_link
+from fiverr.models import Link
+
+logger = logging.getLogger(__name__)
+
+
+class CountMinSketch:
+    """Fixed-size frequency sketch; estimates never undercount."""
+
+    def __init__(self, width=2048, depth=4):
+        self.width = width
+        self.depth = depth
+        self._rows = [array('Q', bytes(8 * width)) for _ in range(depth)]
+
+    def _slots(self, key):
+        # Double hashing: depth independent-enough slots from one 64-bit hash.
+        h = hash(key) & 0xFFFFFFFFFFFFFFFF
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) | 1
+        return [(h1 + row * h2) % self.width for row in range(self.depth)]
+
+    def add(self, key, count=1):
+        """Count ``key`` and return its new estimate.
+
+        Conservative update: only counters below the new estimate are
+        raised, which keeps collisions from inflating other keys.
+        """
+        slots = self._slots(key)
+        estimate = min(row[slot] for row, slot in zip(self._rows, slots)) + count
+        for row, slot in zip(self._rows, slots):
+            if row[slot] < estimate:
+                row[slot] = estimate
+        return estimate
+
+    def estimate(self, key):
+        return min(row[slot] for row, slot in zip(self._rows, self._slots(key)))
+
+    def decay(self):
+        """Halve every counter."""
+        for row in self._rows:
+            for i in range(self.width):
+                row[i] >>= 1
+
+    @property
+    def memory_bytes(self):
+        return self.width * self.depth * 8
+
+
+class HeavyHitterTracker:
+    """Thread-safe top-k of short codes over a count-min sketch."""
+
+    def __init__(self, k=100, width=2048, depth=4, min_hits=20, decay_seconds=60,
+                 clock=time.monotonic):
+        self.k = k
+        self.min_hits = min_hits
+        self.decay_seconds = decay_seconds
+        self.sketch = CountMinSketch(width, depth)
+        self._clock = clock
+        self._top = {}
+        self._floor = 0  # lower bound of the smallest estimate in _top
+        self._next_decay = clock() + decay_seconds
+        self._lock = threading.Lock()
+
+    def observe(self, short_code):
+        with self._lock:
+            if self.decay_seconds and self._clock() >= self._next_decay:
+                self._decay()
+            estimate = self.sketch.add(short_code)
+            if short_code in self._top or len(self._top) < self.k:
+                self._top[short_code] = estimate
+            elif estimate > self._floor:
+                coldest = min(self._top, key=self._top.get)
+                if estimate > self._top[coldest]:
+                    del self._top[coldest]
+                    self._top[short_code] = estimate
+                self._floor = min(self._top.values())
+            return estimate
+
+    def _decay(self):
+        self.sketch.decay()
+        self._top = {code: count >> 1 for code, count in self._top.items() if count > 1}
+        self._floor >>= 1
+        self._next_decay = self._clock() + self.decay_seconds
+
+    def top(self, n=None):
+        """``[(short_code, estimated_hits)]``, hottest first."""
+        with self._lock:
+            ranked = sorted(self._top.items(), key=lambda item: item[1], reverse=True)
+        return ranked if n is None else ranked[:n]
+
+    def hot_codes(self):
+        """Codes currently hot enough to pin."""
+        return {code for code, count in self.top() if count >= self.min_hits}
+
+    def stats(self):
+        return {
+            'k': self.k,
+            'min_hits': self.min_hits,
+            'decay_seconds': self.decay_seconds,
+            'sketch_width': self.sketch.width,
+            'sketch_depth': self.sketch.depth,
+            'sketch_bytes': self.sketch.memory_bytes,
+        }
+
+
+def refresh_hot_links(app, tracker, pinned):
+    """Pin and refresh the tracker's hot codes; unpin codes that cooled off.
+
+    ``pinned`` is the set of codes pinned by the previous run and is
+    updated in place.  Must run inside an app context.  Returns
+    ``(refreshed, unpinned)`` counts.
+    """
+    hot = tracker.hot_codes()
+    pin_ttl = app.config.get('HOT_LINK_PIN_TTL', 86400)
+    cooled = pinned - hot
+    redis_client = get_redis(app)
+    local_cache = app.extensions.get('link_cache')
+
+    records = {}
+    if hot:
+        rows = db.session.execute(
+            select(Link.short_code, Link.id, Link.original_url, Link.seller_id)
+            .where(Link.short_code.in_(hot))
+        ).all()
+        records = {code: LinkRecord(link_id, url, seller_id)
+                   for code, link_id, url, seller_id in rows}
+        db.session.commit()
+
+    # Re-setting the L1 entry restarts its TTL, so hot codes never expire there.
+    if local_cache is not None:
+        for code, record in records.items():
+            local_cache.set(code, record)
+
+    if redis_client:
+        pipe = redis_client.pipeline(transaction=False)
+        for code in hot:
+            if code in records:
+                store_link(pipe, code, records[code], ttl=pin_ttl)
+            else:
+                pipe.delete(link_cache_key(code))
+        for code in cooled:
+            pipe.expire(link_cache_key(code), REDIS_LINK_TTL)
+        pipe.execute()
+
+    pinned.clear()
+    pinned.update(records)
+    return len(records), len(cooled)
+
+
+def init_hot_links(app):
+    """Create the app's tracker (None when HOT_LINK_TOP_K is 0)."""
+    top_k = app.config.get('HOT_LINK_TOP_K', 0)
+    if top_k <= 0:
+        app.extensions['hot_links'] = None
+        return None
+    tracker = HeavyHitterTracker(
+        k=top_k,
+        width=app.config['HOT_LINK_SKETCH_WIDTH'],
+        depth=app.config['HOT_LINK_SKETCH_DEPTH'],
+        min_hits=app.config['HOT_LINK_MIN_HITS'],
+        decay_seconds=app.config['HOT_LINK_DECAY_SECONDS'],
+    )
+    app.extensions['hot_links'] = tracker
+    app.extensions['hot_links_pinned'] = set()
+    return tracker
+
+
+def start_hot_link_refresher(app, interval):
+    """Run :func:`refresh_hot_links` every ``interval`` seconds (daemon thread)."""
+    tracker = app.extensions['hot_links']
+    pinned = app.extensions['hot_links_pinned']
+
+    def run():
+        while True:
+            time.sleep(interval)
+            try:
+                with app.app_context():
+                    refresh_hot_links(app, tracker, pinned)
+            except Exception as exc:
+                logger.warning("Hot link refresh failed: %s", exc)
+
+    thread = threading.Thread(target=run, name='hot-link-refresher', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,239 @@
+"""Bulk import of ``(seller_id, original_url)`` pairs from CSV or NDJSON.
+
+The input is streamed and handled in batches:
+
+1. each record is validated with :class:`CreateLinkRequest` (the same
+   rules as ``POST /link``); invalid records go to the rejects file with
+   their line number and error, and the load carries on;
+2. short codes for the batch come from one ``allocate_many`` call;
+3. the batch is merged into ``links`` with ``ON CONFLICT (seller_id,
+   original_url) DO NOTHING``, so pairs that already exist keep their
+   code.
+
+On Postgres the batch is ``COPY``-ed into a temporary staging table and
+merged with one ``INSERT ... SELECT``; elsewhere (SQLite) it is a single
+executemany of the same conflict-ignoring INSERT.  Every batch commits on
+its own, so a re-run after a crash simply skips the pairs already loaded.
+
+CSV input needs a header row with ``seller_id`` and ``original_url``
+columns; NDJSON has one object per line.  ``.gz`` files are read
+transparently.
+"""
+import csv
+import gzip
+import io
+import json
+import time
+from datetime import datetime, timezone
+
+from pydantic import ValidationError
+from sqlalchemy import text
+
+from fiverr import db
+from fiverr.models import Link
+from fiverr.schemas import CreateLinkRequest
+from fiverr.shortcodes import get_allocator
+from fiverr.utils import dialect_insert
+
+FORMATS = ('csv', 'ndjson')
+DEFAULT_BATCH_SIZE = 10000
+
+SELLER_ID_MAX_LENGTH = Link.__table__.c.seller_id.type.length
+
+_STAGING_TABLE = 'links_import_staging'
+
+
+def detect_format(path):
+    name = path[:-3] if path.endswith('.gz') else path
+    return 'csv' if name.endswith('.csv') else 'ndjson'
+
+
+def _open_text(path):
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rt', encoding='utf-8', newline='')
+    return open(path, 'r', encoding='utf-8', newline='')
+
+
+def read_records(stream, fmt):
+    """Yield ``(line_number, record, error)`` for each input record.
+
+    ``record`` is a dict (or the raw line when it cannot be parsed, in
+    which case ``error`` says why).
+    """
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        missing = {'seller_id', 'original_url'} - set(reader.fieldnames or ())
+        if missing:
+            raise ValueError(f'CSV header is missing: {", ".join(sorted(missing))}')
+        for record in reader:
+            yield reader.line_num, record, None
+        return
+
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as exc:
+            yield line_number, line.rstrip('\n'), f'Invalid JSON: {exc}'
+            continue
+        if not isinstance(record, dict):
+            yield line_number, record, 'Record must be an object'
+            continue
+        yield line_number, record, None
+
+
+def validate_record(record):
+    """Return ``((seller_id, original_url), None)`` or ``(None, error)``."""
+    try:
+        body = CreateLinkRequest(
+            seller_id=record.get('seller_id'), original_url=record.get('original_url'),
+        )
+    except ValidationError as ve:
+        error = ve.errors()[0]
+        field = '.'.join(str(part) for part in error['loc'])
+        return None, f'{field}: {error["msg"]}' if field else error['msg']
+
+    seller_id, original_url = body.seller_id, str(body.original_url)
+    # The database would reject these for the whole batch, not just the row.
+    if len(seller_id) > SELLER_ID_MAX_LENGTH:
+        return None, f'seller_id: longer than {SELLER_ID_MAX_LENGTH} characters'
+    if '\x00' in seller_id or '\x00' in original_url:
+        return None, 'NUL characters are not allowed'
+    return (seller_id, original_url), None
+
+
+def _merge_sqlite(rows):
+    """Conflict-ignoring executemany; returns the number of links created."""
+    stmt = dialect_insert(Link.__table__).on_conflict_do_nothing(
+        index_elements=['seller_id', 'original_url']
+    )
+    return db.session.connection().execute(stmt, rows).rowcount
+
+
+def _merge_postgres(rows):
+    """COPY into a temp staging table, then one INSERT ... SELECT merge."""
+    connection = db.session.connection()
+    connection.execute(text(
+        f'CREATE TEMP TABLE {_STAGING_TABLE} '
+        '(seller_id VARCHAR(255), original_url TEXT, short_code VARCHAR(10)) ON COMMIT DROP'
+    ))
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows((row['seller_id'], row['original_url'], row['short_code']) for row in rows)
+    buffer.seek(0)
+    cursor = connection.connection.dbapi_connection.cursor()
+    try:
+        cursor.copy_expert(
+            f'COPY {_STAGING_TABLE} (seller_id, original_url, short_code) FROM STDIN WITH (FORMAT csv)',
+            buffer,
+        )
+    finally:
+        cursor.close()
+
+    now = datetime.now(timezone.utc)
+    return connection.execute(text(
+        'INSERT INTO links (seller_id, original_url, short_code, click_count, credits_earned, '
+        'created_at, updated_at) '
+        f'SELECT seller_id, original_url, short_code, 0, 0, :now, :now FROM {_STAGING_TABLE} '
+        'ON CONFLICT (seller_id, original_url) DO NOTHING'
+    ), {'now': now}).rowcount
+
+
+def merge_links(rows):
+    """Insert ``rows`` (seller_id, original_url, short_code), skipping existing pairs.
+
+    Returns the number of links created.  Does not commit.
+    """
+    if not rows:
+        return 0
+    if db.engine.dialect.name == 'postgresql':
+        return _merge_postgres(rows)
+    return _merge_sqlite(rows)
+
+
+class _Rejects:
+    """Rejects side file (NDJSON), created on the first rejected record."""
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = None
+
+    def write(self, line_number, record, error):
+        self.count += 1
+        if self.path is None:
+            return
+        if self._file is None:
+            self._file = open(self.path, 'w', encoding='utf-8')
+        self._file.write(json.dumps(
+            {'line': line_number, 'error': error, 'record': record}, ensure_ascii=False,
+        ) + '\n')
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+
+
+def import_links(path, fmt=None, batch_size=DEFAULT_BATCH_SIZE, rejects_path=None,
+                 progress=None):
+    """Load links from ``path``. Returns counts, elapsed time and rows/second.
+
+    ``progress`` is called with the running totals after every batch.
+    """
+    fmt = fmt or detect_format(path)
+    if fmt not in FORMATS:
+        raise ValueError(f'Unknown format {fmt!r} (choose from {", ".join(FORMATS)})')
+
+    allocator = get_allocator()
+    rejects = _Rejects(rejects_path)
+    totals = {'read': 0, 'created': 0, 'existing': 0, 'rejected': 0}
+    start = time.perf_counter()
+
+    def flush(pairs):
+        # Repeats inside the batch share one code and count as 'existing'.
+        unique_pairs = list(dict.fromkeys(pairs))
+        codes = allocator.allocate_many(len(unique_pairs))
+        try:
+            created = merge_links([
+                {'seller_id': seller_id, 'original_url': original_url, 'short_code': code}
+                for (seller_id, original_url), code in zip(unique_pairs, codes)
+            ])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        totals['created'] += created
+        totals['existing'] += len(pairs) - created
+        if progress:
+            progress(dict(totals, elapsed_seconds=time.perf_counter() - start))
+
+    try:
+        with _open_text(path) as stream:
+            pairs = []
+            for line_number, record, error in read_records(stream, fmt):
+                totals['read'] += 1
+                pair = None
+                if error is None:
+                    pair, error = validate_record(record)
+                if error is not None:
+                    rejects.write(line_number, record, error)
+                    totals['rejected'] += 1
+                    continue
+                pairs.append(pair)
+                if len(pairs) >= batch_size:
+                    flush(pairs)
+                    pairs = []
+            if pairs:
+                flush(pairs)
+    finally:
+        rejects.close()
+
+    elapsed = time.perf_counter() - start
+    return dict(
+        totals,
+        elapsed_seconds=elapsed,
+        rows_per_second=totals['read'] / elapsed if elapsed > 0 else 0.0,
+        rejects_path=rejects_path if rejects.count else None,
+    )
@@ -0,0 +1,177 @@
+"""Opt-in per-request timing breakdown and sampled profiling.
+
+With ``REQUEST_TIMING_ENABLED`` every request records
+
+* the number and total time of SQL statements (engine cursor events),
+* the number and total time of Redis commands,
+* time spent serializing models in ``to_dict``,
+
+and reports them as a ``Server-Timing`` header, a structured log line, or
+both (``REQUEST_TIMING_OUTPUT``).  With ``REQUEST_PROFILE_SAMPLE = N``
+one request in N runs under ``cProfile`` and its stats are dumped to
+``REQUEST_PROFILE_DIR`` for ``pstats`` / snakeviz.
+
+When neither is configured :func:`init_app` is never called and nothing
+is hooked, so the cost is zero.
+"""
+import cProfile
+import functools
+import itertools
+import json
+import logging
+import os
+import time
+from contextvars import ContextVar
+
+from flask import g, request
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('request_timings', default=None)
+
+
+class RequestTimings:
+    __slots__ = ('start', 'counts', 'seconds')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.counts = {'sql': 0, 'redis': 0, 'serialize': 0}
+        self.seconds = {'sql': 0.0, 'redis': 0.0, 'serialize': 0.0}
+
+    def add(self, kind, elapsed):
+        self.counts[kind] += 1
+        self.seconds[kind] += elapsed
+
+    def server_timing(self, total):
+        parts = [
+            f'{kind};dur={self.seconds[kind] * 1000:.2f};desc="{self.counts[kind]} calls"'
+            for kind in ('sql', 'redis', 'serialize')
+        ]
+        parts.append(f'total;dur={total * 1000:.2f}')
+        return ', '.join(parts)
+
+    def as_log(self, total):
+        record = {'total_ms': round(total * 1000, 3)}
+        for kind in ('sql', 'redis', 'serialize'):
+            record[f'{kind}_count'] = self.counts[kind]
+            record[f'{kind}_ms'] = round(self.seconds[kind] * 1000, 3)
+        return record
+
+
+def _timed(func, kind):
+    """Wrap ``func`` so calls made during an instrumented request are timed."""
+    if getattr(func, '_request_timed', False):
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        timings = _current.get()
+        if timings is None:
+            return func(*args, **kwargs)
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timings.add(kind, time.perf_counter() - start)
+
+    wrapper._request_timed = True
+    return wrapper
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _current.get() is not None:
+        conn.info.setdefault('request_timing_start', []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    timings = _current.get()
+    starts = conn.info.get('request_timing_start')
+    if timings is not None and starts:
+        timings.add('sql', time.perf_counter() - starts.pop())
+
+
+def instrument_engine(engine):
+    if not event.contains(engine, 'before_cursor_execute', _before_cursor_execute):
+        event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+        event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def init_app(app):
+    """Hook timing and/or sampled profiling into ``app``."""
+    from fiverr import db, on_redis_connect
+    from fiverr.models import Link
+
+    timing_enabled = app.config.get('REQUEST_TIMING_ENABLED', False)
+    output = app.config.get('REQUEST_TIMING_OUTPUT', 'header')
+    sample = app.config.get('REQUEST_PROFILE_SAMPLE', 0)
+    profile_dir = app.config.get('REQUEST_PROFILE_DIR', 'profiles')
+    requests_seen = itertools.count()
+
+    if timing_enabled:
+        with app.app_context():
+            instrument_engine(db.engine)
+        def time_redis(client):
+            client.execute_command = _timed(client.execute_command, 'redis')
+        on_redis_connect(app, time_redis)
+        Link.to_dict = _timed(Link.to_dict, 'serialize')
+
+    @app.before_request
+    def start_instrumentation():
+        if timing_enabled:
+            g._request_timings_token = _current.set(RequestTimings())
+        if sample and next(requests_seen) % sample == 0:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                return  # another request in this process is being profiled
+            g._request_profiler = profiler
+
+    @app.after_request
+    def finish_instrumentation(response):
+        profiler = g.pop('_request_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            _dump_profile(profiler, profile_dir)
+
+        token = g.pop('_request_timings_token', None)
+        if token is not None:
+            timings = token.var.get()
+            _current.reset(token)
+            total = time.perf_counter() - timings.start
+            if output in ('header', 'both'):
+                response.headers['Server-Timing'] = timings.server_timing(total)
+            if output in ('log', 'both'):
+                logger.info(json.dumps({
+                    'event': 'request_timing',
+                    'method': request.method,
+                    'route': request.url_rule.rule if request.url_rule else None,
+                    'status': response.status_code,
+                    **timings.as_log(total),
+                }))
+        return response
+
+    @app.teardown_request
+    def abandon_instrumentation(error):
+        # after_request is skipped for some failures; never leak state.
+        profiler = g.pop('_request_profiler', None)
+        if profiler is not None:
+            profiler.disable()
+        token = g.pop('_request_timings_token', None)
+        if token is not None:
+            _current.reset(token)
+
+
+def _dump_profile(profiler, profile_dir):
+    endpoint = (request.endpoint or 'unmatched').replace('.', '-')
+    path = os.path.join(
+        profile_dir,
+        f'{time.strftime("%Y%m%dT%H%M%S")}-{request.method}-{endpoint}-{os.getpid()}-'
+        f'{time.perf_counter_ns() % 1000000}.prof',
+    )
+    try:
+        os.makedirs(profile_dir, exist_ok=True)
+        profiler.dump_stats(path)
+    except OSError as exc:
+        logger.warning("Could not write request profile %s: %s", path, exc)
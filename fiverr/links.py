@@ -0,0 +1,61 @@
+"""Set-based link persistence shared by the batch and import paths."""
+from sqlalchemy import select, tuple_
+
+from fiverr import db
+from fiverr.models import Link
+from fiverr.utils import dialect_insert
+
+# Pairs per IN (...) lookup; keeps bound parameters well under the
+# SQLite and Postgres limits.
+LOOKUP_CHUNK = 500
+
+
+def insert_links_ignoring_duplicates(rows):
+    """Insert ``rows`` (dicts with seller_id, original_url, short_code).
+
+    Rows whose ``(seller_id, original_url)`` already exists are skipped by
+    ``ON CONFLICT DO NOTHING``, so concurrent writers never hit
+    ``uq_seller_url``.  Does not commit.
+    """
+    if not rows:
+        return
+    stmt = dialect_insert(Link).on_conflict_do_nothing(
+        index_elements=['seller_id', 'original_url']
+    )
+    db.session.execute(stmt, rows)
+
+
+def links_by_pair(pairs):
+    """Return ``{(seller_id, original_url): Link}`` for the given pairs."""
+    pairs = list(pairs)
+    found = {}
+    for i in range(0, len(pairs), LOOKUP_CHUNK):
+        chunk = pairs[i:i + LOOKUP_CHUNK]
+        for link in db.session.execute(
+            select(Link).where(tuple_(Link.seller_id, Link.original_url).in_(chunk))
+        ).scalars():
+            found[(link.seller_id, link.original_url)] = link
+    return found
+
+
+def upsert_link(seller_id, original_url, short_code):
+    """Insert a link, or return the existing one for the same pair, atomically.
+
+    One ``INSERT ... ON CONFLICT (seller_id, original_url) DO UPDATE ...
+    RETURNING`` statement: the no-op update makes RETURNING yield the
+    existing row on conflict, so racing duplicate creates all get a row and
+    none hits ``uq_seller_url``.  The returned link was created by this
+    call iff its ``short_code`` equals the one passed in.  Does not commit.
+    """
+    stmt = dialect_insert(Link).values(
+        seller_id=seller_id,
+        original_url=original_url,
+        short_code=short_code,
+        click_count=0,
+        credits_earned=0,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['seller_id', 'original_url'],
+        set_={'seller_id': stmt.excluded.seller_id},
+    ).returning(Link)
+    return db.session.execute(stmt).scalar_one()
@@ -0,0 +1,471 @@
+"""Prometheus text-format metrics without a client library.
+
+Each metric keeps one shard per thread: recording a sample only touches
+the calling thread's own dict, so the hot path takes no lock.  Shards of
+threads that have exited are folded into a retired total when metrics
+are collected, so thread churn never loses counts or grows memory.
+
+With ``METRICS_MULTIPROC_DIR`` set, every process (web workers and Celery
+workers alike) periodically writes a JSON snapshot of its totals to that
+directory, and ``GET /metrics`` sums all snapshots with its own live
+values.  Forked children start from empty shards so nothing is counted
+twice.  Snapshots are named ``metrics-<pid>-<run>.json``; once their
+process is gone (or its pid belongs to a newer run) the scrape folds
+their counters and histograms into ``metrics-dead.json`` and deletes
+them, so gauges only count live processes and restarts never reset or
+inflate a series.
+"""
+import atexit
+import bisect
+import fcntl
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LAG_BUCKETS = (0.1, 0.5, 1.0, 5.0, 15.0, 60.0, 300.0, 900.0, 3600.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_SNAPSHOT_NAME = re.compile(r'^metrics-(\d+)-([0-9a-f]+)\.json$')
+_TOMBSTONE = 'metrics-dead.json'
+_LOCK = 'metrics.lock'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, registry, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._reset()
+        registry.register(self)
+
+    def _reset(self):
+        self._local = threading.local()
+        self._shards = {}
+        self._retired = {}
+
+    def _shard(self):
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            ident = threading.get_ident()
+            shard = self._local.shard = {}
+            with self._lock:
+                # A dead thread's ident can be reused before it was retired.
+                stale = self._shards.get(ident)
+                if stale is not None:
+                    self._merge(self._retired, stale.copy())
+                self._shards[ident] = shard
+        return shard
+
+    def collect(self):
+        """``{label_values: value}`` summed over every thread's shard."""
+        alive = {thread.ident for thread in threading.enumerate()}
+        with self._lock:
+            for ident in [i for i in self._shards if i not in alive]:
+                self._merge(self._retired, self._shards.pop(ident).copy())
+            totals = {}
+            self._merge(totals, self._retired)
+            for shard in self._shards.values():
+                self._merge(totals, shard.copy())
+        return totals
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, labels=(), amount=1):
+        shard = self._shard()
+        shard[labels] = shard.get(labels, 0) + amount
+
+    @staticmethod
+    def _merge(into, values):
+        for labels, value in values.items():
+            into[labels] = into.get(labels, 0) + value
+
+
+class Gauge(_Metric):
+    """Last value set in this process; values from several processes are summed."""
+    kind = 'gauge'
+
+    def _reset(self):
+        super()._reset()
+        self._values = {}
+
+    def set(self, value, labels=()):
+        with self._lock:
+            self._values[labels] = value
+
+    def collect(self):
+        with self._lock:
+            return dict(self._values)
+
+    _merge = staticmethod(Counter._merge)
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, registry, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        super().__init__(registry, name, documentation, labelnames)
+
+    def observe(self, value, labels=()):
+        shard = self._shard()
+        state = shard.get(labels)
+        if state is None:
+            # Per-bucket (non-cumulative) counts incl. +Inf, then sum.
+            state = shard[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        state[bisect.bisect_left(self.buckets, value)] += 1
+        state[-1] += value
+
+    @staticmethod
+    def _merge(into, values):
+        for labels, state in values.items():
+            current = into.get(labels)
+            if current is None:
+                into[labels] = list(state)
+            else:
+                for i, value in enumerate(state):
+                    current[i] += value
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self.multiproc_dir = None
+        self.flush_interval = 5.0
+        self._next_flush = 0.0
+        self._run = uuid.uuid4().hex[:12]
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def register(self, metric):
+        self._metrics.append(metric)
+
+    def _after_fork(self):
+        for metric in self._metrics:
+            metric._reset()
+        self._next_flush = 0.0
+        self._run = uuid.uuid4().hex[:12]
+
+    def configure(self, multiproc_dir=None, flush_interval=5.0):
+        self.multiproc_dir = multiproc_dir or None
+        self.flush_interval = flush_interval
+        if self.multiproc_dir:
+            os.makedirs(self.multiproc_dir, exist_ok=True)
+            atexit.register(self.flush)
+
+    def collect(self):
+        return {metric.name: metric.collect() for metric in self._metrics}
+
+    # -- Multi-process ---------------------------------------------------------
+
+    def _snapshot_path(self):
+        return os.path.join(self.multiproc_dir, f'metrics-{os.getpid()}-{self._run}.json')
+
+    def flush(self):
+        """Write this process's totals to the shared directory."""
+        if not self.multiproc_dir:
+            return
+        snapshot = {
+            name: [[list(labels), value] for labels, value in values.items()]
+            for name, values in self.collect().items()
+        }
+        path = self._snapshot_path()
+        tmp_path = f'{path}.tmp'
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(snapshot, f)
+            os.replace(tmp_path, path)
+        except OSError as exc:
+            logger.warning("Metrics snapshot write failed: %s", exc)
+
+    def maybe_flush(self):
+        """Flush at most once per ``flush_interval`` (cheap when not due)."""
+        if self.multiproc_dir and time.monotonic() >= self._next_flush:
+            self._next_flush = time.monotonic() + self.flush_interval
+            self.flush()
+
+    def collect_all(self):
+        """This process's live totals plus every other process's snapshot."""
+        merged = self.collect()
+        if not self.multiproc_dir:
+            return merged
+        live, dead = self._scan_snapshots()
+        if dead:
+            self._bury(dead)
+        by_name = {metric.name: metric for metric in self._metrics}
+        for filename in live + [_TOMBSTONE]:
+            snapshot = self._read_snapshot(filename)
+            for name, values in (snapshot or {}).items():
+                if name in by_name:
+                    by_name[name]._merge(merged[name], values)
+        return merged
+
+    def _scan_snapshots(self):
+        """``(live, dead)`` snapshot file names of other processes.
+
+        A pid hosts one process at a time: of several snapshots for a live
+        pid only the newest (or this process's own) is live.
+        """
+        own = os.path.basename(self._snapshot_path())
+        by_pid = {}
+        for filename in os.listdir(self.multiproc_dir):
+            match = _SNAPSHOT_NAME.match(filename)
+            if match:
+                by_pid.setdefault(int(match.group(1)), []).append(filename)
+        live, dead = [], []
+        for pid, filenames in by_pid.items():
+            if pid == os.getpid():
+                dead.extend(f for f in filenames if f != own)
+            elif not _pid_alive(pid):
+                dead.extend(filenames)
+            else:
+                filenames.sort(key=self._mtime)
+                dead.extend(filenames[:-1])
+                live.append(filenames[-1])
+        return live, dead
+
+    def _mtime(self, filename):
+        try:
+            return os.stat(os.path.join(self.multiproc_dir, filename)).st_mtime
+        except OSError:
+            return 0.0
+
+    def _read_snapshot(self, filename):
+        """``{name: {labels: value}}`` from a snapshot file, or None."""
+        try:
+            with open(os.path.join(self.multiproc_dir, filename)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            return None  # missing, or being replaced; the next scrape picks it up
+        return {
+            name: {tuple(labels): value for labels, value in samples}
+            for name, samples in snapshot.items()
+        }
+
+    def _bury(self, filenames):
+        """Fold dead processes' counters and histograms into the tombstone."""
+        by_name = {metric.name: metric for metric in self._metrics}
+        with open(os.path.join(self.multiproc_dir, _LOCK), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            totals = self._read_snapshot(_TOMBSTONE) or {}
+            buried = []
+            for filename in filenames:
+                snapshot = self._read_snapshot(filename)
+                if snapshot is None:
+                    continue  # another scrape buried it first
+                for name, values in snapshot.items():
+                    metric = by_name.get(name)
+                    if metric is not None and metric.kind != 'gauge':
+                        metric._merge(totals.setdefault(name, {}), values)
+                buried.append(filename)
+            if not buried:
+                return
+            path = os.path.join(self.multiproc_dir, _TOMBSTONE)
+            try:
+                with open(f'{path}.tmp', 'w') as f:
+                    json.dump({
+                        name: [[list(labels), value] for labels, value in values.items()]
+                        for name, values in totals.items()
+                    }, f)
+                os.replace(f'{path}.tmp', path)
+                for filename in buried:
+                    os.remove(os.path.join(self.multiproc_dir, filename))
+            except OSError as exc:
+                logger.warning("Metrics tombstone write failed: %s", exc)
+
+    # -- Exposition ------------------------------------------------------------
+
+    def render(self):
+        """Prometheus text exposition of every metric."""
+        values = self.collect_all()
+        lines = []
+        for metric in self._metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for labels, value in sorted(values[metric.name].items()):
+                pairs = list(zip(metric.labelnames, labels))
+                if metric.kind in ('counter', 'gauge'):
+                    lines.append(f'{metric.name}{_labels(pairs)} {_number(value)}')
+                    continue
+                cumulative = 0
+                for bound, count in zip(metric.buckets + (float('inf'),), value[:-1]):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else _number(bound)
+                    lines.append(
+                        f'{metric.name}_bucket{_labels(pairs + [("le", le)])} {_number(cumulative)}'
+                    )
+                lines.append(f'{metric.name}_sum{_labels(pairs)} {_number(value[-1])}')
+                lines.append(f'{metric.name}_count{_labels(pairs)} {_number(cumulative)}')
+        return '\n'.join(lines) + '\n'
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # exists, owned by another user
+    return True
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    escaped = (
+        (name, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in pairs
+    )
+    return '{' + ','.join(f'{name}="{value}"' for name, value in escaped) + '}'
+
+
+def _number(value):
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+REGISTRY = Registry()
+
+HTTP_REQUEST_DURATION = Histogram(
+    REGISTRY, 'http_request_duration_seconds', 'Request latency by route.',
+    ('method', 'route'),
+)
+HTTP_REQUESTS = Counter(
+    REGISTRY, 'http_requests_total', 'Requests by route and status code.',
+    ('method', 'route', 'status'),
+)
+LINK_CACHE_LOOKUPS = Counter(
+    REGISTRY, 'link_cache_lookups_total', 'Redirect link lookups by cache tier and result.',
+    ('tier', 'result'),
+)
+DB_POOL_CHECKOUT = Histogram(
+    REGISTRY, 'db_pool_checkout_seconds', 'Time spent waiting for a pooled DB connection.',
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0),
+)
+REWARD_OUTCOMES = Counter(
+    REGISTRY, 'reward_tasks_total', 'Reward settlements by outcome.', ('outcome',),
+)
+CLICK_TO_REWARD_LAG = Histogram(
+    REGISTRY, 'click_to_reward_lag_seconds', 'Time from click to reward settlement.',
+    buckets=LAG_BUCKETS,
+)
+DUPLICATE_CLICKS = Counter(
+    REGISTRY, 'duplicate_clicks_total', 'Repeat clicks inside the dedup window (not rewarded).',
+)
+SUPPRESSED_REWARD_CREDITS = Counter(
+    REGISTRY, 'suppressed_reward_credits_total', 'Reward credits not paid out for duplicate clicks.',
+)
+DEDUP_EARLY_ROTATIONS = Counter(
+    REGISTRY, 'click_dedup_early_rotations_total',
+    'Bloom filter generations rotated before their window because they hit CLICK_DEDUP_CAPACITY.',
+)
+CLICKS_DEAD_LETTERED = Counter(
+    REGISTRY, 'click_stream_dead_letters_total',
+    'Click log entries that could not be written and were moved to the dead-letter log.',
+)
+
+DB_READ_ROUTING = Counter(
+    REGISTRY, 'db_read_routing_total',
+    'Read-only blocks by the database serving them (a replica or the primary fallback).',
+    ('target',),
+)
+
+CIRCUIT_STATE = Gauge(
+    REGISTRY, 'circuit_breaker_state',
+    'Processes whose circuit breaker is in each state (1 per process).', ('breaker', 'state'),
+)
+CIRCUIT_TRANSITIONS = Counter(
+    REGISTRY, 'circuit_breaker_transitions_total', 'Circuit breaker state changes.',
+    ('breaker', 'state'),
+)
+
+_CIRCUIT_STATES = ('closed', 'open', 'half_open')
+
+
+def observe_circuit_state(breaker, previous, state):
+    """``on_state_change`` callback for :class:`~fiverr.circuit.CircuitBreaker`."""
+    for candidate in _CIRCUIT_STATES:
+        CIRCUIT_STATE.set(1 if candidate == state else 0, (breaker.name, candidate))
+    if previous is not None:
+        CIRCUIT_TRANSITIONS.inc((breaker.name, state))
+
+
+def observe_reward(outcome, clicked_at=None):
+    """Count one reward outcome and, when known, its click-to-reward lag."""
+    REWARD_OUTCOMES.inc((outcome,))
+    if clicked_at is not None:
+        if isinstance(clicked_at, str):
+            clicked_at = datetime.fromisoformat(clicked_at)
+        if clicked_at.tzinfo is None:
+            clicked_at = clicked_at.replace(tzinfo=timezone.utc)
+        CLICK_TO_REWARD_LAG.observe(
+            max((datetime.now(timezone.utc) - clicked_at).total_seconds(), 0.0)
+        )
+    REGISTRY.maybe_flush()
+
+
+def instrument_engine(engine):
+    """Time every pool checkout made through ``engine``.
+
+    Wraps ``engine.raw_connection`` (which every ``Connection`` goes
+    through) rather than the pool, so the timing survives pool recreation
+    on ``engine.dispose()``.
+    """
+    if getattr(engine, '_checkout_timed', False):
+        return
+    raw_connection = engine.raw_connection
+
+    def timed_raw_connection(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return raw_connection(*args, **kwargs)
+        finally:
+            DB_POOL_CHECKOUT.observe(time.perf_counter() - start)
+
+    engine.raw_connection = timed_raw_connection
+    engine._checkout_timed = True
+
+
+def configure(app):
+    """Apply the app's multi-process settings (enough for worker processes)."""
+    REGISTRY.configure(
+        app.config.get('METRICS_MULTIPROC_DIR'),
+        app.config.get('METRICS_FLUSH_SECONDS', 5.0),
+    )
+
+
+def init_app(app):
+    """Time every request and instrument the app's database engine."""
+    from flask import g, request
+    from fiverr import db
+
+    configure(app)
+    with app.app_context():
+        instrument_engine(db.engine)
+
+    @app.before_request
+    def start_timer():
+        g._metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('_metrics_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            HTTP_REQUEST_DURATION.observe(time.perf_counter() - start, (request.method, route))
+            HTTP_REQUESTS.inc((request.method, route, str(response.status_code)))
+            REGISTRY.maybe_flush()
+        return response
@@ -1,8 +1,63 @@
 from datetime import datetime, timezone
 from flask import current_app
+from sqlalchemy import BigInteger, PrimaryKeyConstraint
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.functions import FunctionElement
 from fiverr import db
 
 
+class current_txid(FunctionElement):
+    """Id of the inserting transaction: ``txid_current()`` on Postgres, 0 elsewhere.
+
+    Used as a server default so incremental jobs can tell which rows were
+    written by transactions that have finished (see :mod:`fiverr.rollups`).
+    SQLite runs one writer at a time, so there ids alone are enough.
+    """
+    type = BigInteger()
+    inherit_cache = True
+
+
+@compiles(current_txid)
+def _compile_current_txid(element, compiler, **kw):
+    return '0'
+
+
+@compiles(current_txid, 'postgresql')
+def _compile_current_txid_postgresql(element, compiler, **kw):
+    return 'txid_current()'
+
+
+CLICK_ID_SEQUENCE = db.Sequence('clicks_id_seq', metadata=db.metadata)
+
+
+class next_click_id(FunctionElement):
+    """Server default for ``clicks.id``: the shared sequence on Postgres.
+
+    Elsewhere it is NULL, which SQLite turns into the next rowid.
+    """
+    type = db.Integer()
+    inherit_cache = True
+
+
+@compiles(next_click_id)
+def _compile_next_click_id(element, compiler, **kw):
+    return 'NULL'
+
+
+@compiles(next_click_id, 'postgresql')
+def _compile_next_click_id_postgresql(element, compiler, **kw):
+    return f"nextval('{CLICK_ID_SEQUENCE.name}')"
+
+
+@compiles(PrimaryKeyConstraint, 'sqlite')
+def _compile_sqlite_primary_key(constraint, compiler, **kw):
+    # SQLite cannot partition clicks, so its key stays ``id`` alone: only a
+    # single INTEGER PRIMARY KEY is a rowid alias that assigns ids.
+    if constraint.table.name == 'clicks':
+        return 'PRIMARY KEY (id)'
+    return compiler.visit_primary_key_constraint(constraint, **kw)
+
+
 class Link(db.Model):
     __tablename__ = 'links'
 
@@ -17,6 +72,8 @@ class Link(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint('seller_id', 'original_url', name='uq_seller_url'),
+        # Serves ORDER BY created_at DESC, id DESC and keyset seeks in GET /state.
+        db.Index('idx_links_created_at', 'created_at', 'id'),
     )
 
     def to_dict(self):
@@ -36,12 +93,38 @@ class Link(db.Model):
 class Click(db.Model):
     __tablename__ = 'clicks'
 
-    id = db.Column(db.Integer, primary_key=True)
+    # On Postgres clicks is range partitioned on clicked_at (migration
+    # a41d0e6c93b2), so the key has to include it; ids stay unique through
+    # the sequence and identify a click on their own.
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False,
+                   server_default=next_click_id())
     link_id = db.Column(db.Integer, db.ForeignKey('links.id'), nullable=False, index=True)
-    clicked_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc), index=True)
+    clicked_at = db.Column(db.DateTime, primary_key=True, nullable=False,
+                           default=lambda: datetime.now(timezone.utc), index=True)
     ip_address = db.Column(db.String(45))
     user_agent = db.Column(db.Text)
     reward_status = db.Column(db.String(20), default='pending')
+    # Set while a batch sweep holds the click 'settling' (see
+    # fiverr.rewards.claim_pending_rewards).
+    reward_claimed_at = db.Column(db.DateTime)
+    txid = db.Column(db.BigInteger, nullable=False, server_default=current_txid())
+
+    __table_args__ = (
+        db.Index('ix_clicks_txid_id', 'txid', 'id'),
+        # Partial index so the batch reward sweep finds pending clicks
+        # without scanning the whole table.
+        db.Index(
+            'ix_clicks_reward_pending', 'id',
+            postgresql_where=db.text("reward_status = 'pending'"),
+            sqlite_where=db.text("reward_status = 'pending'"),
+        ),
+        db.Index(
+            'ix_clicks_reward_settling', 'reward_claimed_at',
+            postgresql_where=db.text("reward_status = 'settling'"),
+            sqlite_where=db.text("reward_status = 'settling'"),
+        ),
+    )
+    __mapper_args__ = {'primary_key': [id]}
 
 
 class Reward(db.Model):
@@ -50,9 +133,52 @@ class Reward(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     seller_id = db.Column(db.String(255), nullable=False, index=True)
     link_id = db.Column(db.Integer, db.ForeignKey('links.id'), nullable=False)
-    click_id = db.Column(db.Integer, db.ForeignKey('clicks.id'))
+    # No FK: a foreign key into partitioned clicks would need (id, clicked_at).
+    click_id = db.Column(db.Integer)
     amount = db.Column(db.Numeric(10, 2), nullable=False)
     status = db.Column(db.String(20), default='pending', index=True)
     aws_transaction_id = db.Column(db.String(255))
     created_at = db.Column(db.DateTime, nullable=False, default=lambda: datetime.now(timezone.utc))
     completed_at = db.Column(db.DateTime)
+    # Retry schedule: rewards in status 'retrying' are attempted again at
+    # next_attempt_at by the retry sweep.
+    attempts = db.Column(db.Integer, nullable=False, default=1, server_default='1')
+    next_attempt_at = db.Column(db.DateTime)
+    last_error = db.Column(db.String(255))
+    txid = db.Column(db.BigInteger, nullable=False, server_default=current_txid())
+
+    __table_args__ = (
+        db.Index('ix_rewards_txid_id', 'txid', 'id'),
+        db.Index(
+            'ix_rewards_retry_due', 'next_attempt_at',
+            postgresql_where=db.text("status = 'retrying'"),
+            sqlite_where=db.text("status = 'retrying'"),
+        ),
+    )
+
+
+class CodeSequence(db.Model):
+    """Named counters from which workers reserve blocks of short-code numbers."""
+    __tablename__ = 'code_sequences'
+
+    name = db.Column(db.String(50), primary_key=True)
+    next_value = db.Column(db.BigInteger, nullable=False, default=0)
+
+
+class ClickRollup(db.Model):
+    """Clicks and rewarded credits per link per hour (UTC)."""
+    __tablename__ = 'click_rollups'
+
+    link_id = db.Column(db.Integer, db.ForeignKey('links.id'), primary_key=True)
+    hour = db.Column(db.DateTime, primary_key=True)
+    clicks = db.Column(db.Integer, nullable=False, default=0)
+    credits = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
+
+class RollupCheckpoint(db.Model):
+    """High-water marks (last processed ``(txid, id)``) for incremental aggregation jobs."""
+    __tablename__ = 'rollup_checkpoints'
+
+    name = db.Column(db.String(50), primary_key=True)
+    last_id = db.Column(db.BigInteger, nullable=False, default=0)
+    last_txid = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
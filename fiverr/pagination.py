@@ -0,0 +1,82 @@
+"""Keyset (cursor) pagination helpers for ``GET /state``.
+
+A cursor is an opaque, URL-safe token for the ``(created_at, id)`` of the
+last row on a page.  The next page is ``WHERE (created_at, id) < cursor``
+in ``created_at DESC, id DESC`` order, which walks ``idx_links_created_at``
+and costs the same at any depth.
+"""
+import base64
+import json
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import func, select, text, tuple_
+
+from fiverr import db, get_redis
+from fiverr.models import Link
+
+TOTAL_CACHE_KEY = 'state:links_total'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(created_at, link_id):
+    raw = json.dumps([created_at.isoformat(), link_id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        created_at, link_id = json.loads(base64.urlsafe_b64decode(padded))
+        return datetime.fromisoformat(created_at), int(link_id)
+    except Exception as exc:
+        raise InvalidCursor('Invalid cursor') from exc
+
+
+def exact_total():
+    return db.session.execute(select(func.count()).select_from(Link)).scalar_one()
+
+
+def estimated_total():
+    """Cheap link count: planner statistics on Postgres, else a cached COUNT.
+
+    The cached count lives in Redis (shared by all workers) for
+    ``STATE_TOTAL_CACHE_TTL`` seconds; without Redis it is computed exactly.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        estimate = db.session.execute(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'links'::regclass")
+        ).scalar()
+        # -1 means the table has never been analyzed.
+        if estimate is not None and estimate >= 0:
+            return int(estimate)
+
+    redis_client = get_redis()
+    if redis_client:
+        try:
+            cached = redis_client.get(TOTAL_CACHE_KEY)
+            if cached is not None:
+                return int(cached)
+            total = exact_total()
+            redis_client.set(TOTAL_CACHE_KEY, total, ex=current_app.config['STATE_TOTAL_CACHE_TTL'])
+            return total
+        except Exception:
+            pass
+    return exact_total()
+
+
+def keyset_page(limit, cursor=None):
+    """Return ``(links, next_cursor)`` for the page after ``cursor``."""
+    query = select(Link).order_by(Link.created_at.desc(), Link.id.desc())
+    if cursor:
+        created_at, link_id = decode_cursor(cursor)
+        query = query.where(tuple_(Link.created_at, Link.id) < tuple_(created_at, link_id))
+
+    links = db.session.execute(query.limit(limit + 1)).scalars().all()
+    if len(links) <= limit:
+        return links, None
+    links = links[:limit]
+    return links, encode_cursor(links[-1].created_at, links[-1].id)
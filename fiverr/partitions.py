@@ -0,0 +1,301 @@
+"""Time partitioning, retention and cold archival for ``clicks``.
+
+On Postgres (after migration ``a41d0e6c93b2``) ``clicks`` is range
+partitioned on ``clicked_at`` with one child table per month or day,
+named ``clicks_pYYYY_MM`` / ``clicks_pYYYY_MM_DD``.  The maintenance job
+
+* creates partitions ahead of time so inserts never hit a missing range;
+* detaches partitions older than the retention window, streams their rows
+  to a compressed archive file and drops them.
+
+Rows outside every range (a late stream click for an archived month, or
+one ahead of the partitions created so far) land in ``clicks_default``
+instead of failing the insert.  When a partition is created for a range
+the default partition holds rows for, those rows are moved into it.  A
+partition whose archive failed after the detach is left as a plain
+``clicks_p*`` table; the next run archives and drops it.
+
+Archives are NDJSON split into independently gzipped chunks, plus a small
+``.idx`` file recording each chunk's id range and byte offset, so a single
+archived click can be read back without decompressing the whole file.
+
+On other databases (SQLite in tests) partition maintenance is a no-op.
+"""
+import gzip
+import json
+import logging
+import os
+from datetime import date, datetime, timezone
+
+from sqlalchemy import select, text
+
+from fiverr import db
+from fiverr.models import RollupCheckpoint
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_CHUNK_ROWS = 10000
+ARCHIVE_COLUMNS = ('id', 'link_id', 'clicked_at', 'ip_address', 'user_agent', 'reward_status')
+DEFAULT_PARTITION = 'clicks_default'
+
+
+# -- Partition ranges ----------------------------------------------------------
+
+def period_start(day, interval):
+    return day if interval == 'day' else day.replace(day=1)
+
+
+def next_period(start, interval):
+    if interval == 'day':
+        return date.fromordinal(start.toordinal() + 1)
+    return date(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+
+def shift_periods(start, interval, count):
+    """Move ``count`` periods back (negative) or forward from a period start."""
+    if interval == 'day':
+        return date.fromordinal(start.toordinal() + count)
+    months = start.year * 12 + start.month - 1 + count
+    return date(months // 12, months % 12 + 1, 1)
+
+
+def partition_name(start, interval):
+    if interval == 'day':
+        return f'clicks_p{start:%Y_%m_%d}'
+    return f'clicks_p{start:%Y_%m}'
+
+
+def parse_partition_name(name):
+    """Return ``(start, interval)`` for a partition name, or None."""
+    suffix = name[len('clicks_p'):] if name.startswith('clicks_p') else ''
+    for fmt, interval in (('%Y_%m_%d', 'day'), ('%Y_%m', 'month')):
+        try:
+            return datetime.strptime(suffix, fmt).date(), interval
+        except ValueError:
+            continue
+    return None
+
+
+# -- Postgres maintenance ------------------------------------------------------
+
+def is_partitioned():
+    if db.engine.dialect.name != 'postgresql':
+        return False
+    return bool(db.session.execute(text(
+        "SELECT 1 FROM pg_partitioned_table WHERE partrelid = 'clicks'::regclass"
+    )).scalar())
+
+
+def list_partitions():
+    """Names of the partitions currently attached to ``clicks``."""
+    return [row[0] for row in db.session.execute(text(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid "
+        "WHERE i.inhparent = 'clicks'::regclass ORDER BY c.relname"
+    ))]
+
+
+def list_detached_partitions():
+    """``clicks_p*`` tables no longer attached to ``clicks`` (failed archive runs)."""
+    return [row[0] for row in db.session.execute(text(
+        "SELECT c.relname FROM pg_class c "
+        "WHERE c.relkind = 'r' AND c.relname LIKE 'clicks\\_p%' "
+        "AND c.relnamespace = current_schema()::regnamespace "
+        "AND NOT EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhrelid = c.oid) "
+        "ORDER BY c.relname"
+    )) if parse_partition_name(row[0]) is not None]
+
+
+def ensure_default_partition():
+    db.session.execute(text(
+        f'CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF clicks DEFAULT'
+    ))
+
+
+def create_partition(start, interval):
+    """Create the partition for ``[start, next period)``.
+
+    Rows for the range already sitting in the default partition would make
+    a plain ``PARTITION OF`` fail, so the table is then built detached,
+    filled from the default partition and attached.
+    """
+    end = next_period(start, interval)
+    name = partition_name(start, interval)
+    bounds = f"FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+    in_range = f"clicked_at >= '{start.isoformat()}' AND clicked_at < '{end.isoformat()}'"
+    stranded = db.session.execute(text(
+        f'SELECT 1 FROM {DEFAULT_PARTITION} WHERE {in_range} LIMIT 1'
+    )).scalar() is not None
+    if not stranded:
+        db.session.execute(text(f'CREATE TABLE IF NOT EXISTS {name} PARTITION OF clicks FOR VALUES {bounds}'))
+        return name
+
+    db.session.execute(text(f'CREATE TABLE {name} (LIKE clicks INCLUDING DEFAULTS)'))
+    moved = db.session.execute(text(
+        f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE {in_range} RETURNING *) '
+        f'INSERT INTO {name} SELECT * FROM moved'
+    )).rowcount
+    db.session.execute(text(f'ALTER TABLE clicks ATTACH PARTITION {name} FOR VALUES {bounds}'))
+    logger.info("Moved %d clicks from %s into new partition %s", moved, DEFAULT_PARTITION, name)
+    return name
+
+
+def ensure_future_partitions(interval='month', ahead=3, today=None):
+    """Create the current partition and ``ahead`` future ones.
+
+    Returns the names of partitions created by this call.
+    """
+    if not is_partitioned():
+        return []
+    ensure_default_partition()
+    existing = [parse_partition_name(name) for name in list_partitions()]
+    ranges = [(s, next_period(s, i)) for s, i in filter(None, existing)]
+
+    start = period_start(today or datetime.now(timezone.utc).date(), interval)
+    names = []
+    for _ in range(ahead + 1):
+        end = next_period(start, interval)
+        # Skip periods already covered, e.g. by monthly partitions after
+        # switching to daily ones.
+        if not any(lo < end and start < hi for lo, hi in ranges):
+            names.append(create_partition(start, interval))
+        start = end
+    db.session.commit()
+    return names
+
+
+def _has_rows_not_rolled_up(name):
+    """Whether partition ``name`` holds clicks past the rollup high-water mark."""
+    mark = db.session.execute(
+        select(RollupCheckpoint.last_txid, RollupCheckpoint.last_id)
+        .where(RollupCheckpoint.name == 'clicks')
+    ).first() or (0, 0)
+    return db.session.execute(
+        text(f'SELECT 1 FROM {name} WHERE (txid, id) > (:txid, :id) LIMIT 1'),
+        {'txid': mark[0], 'id': mark[1]},
+    ).scalar() is not None
+
+
+def _archive_detached(name, archive_dir):
+    """Stream detached partition ``name`` to its archive file, then drop it."""
+    path = os.path.join(archive_dir, f'{name}.ndjson.gz')
+    result = db.session.execute(
+        text(f'SELECT {", ".join(ARCHIVE_COLUMNS)} FROM {name} ORDER BY id')
+        .execution_options(yield_per=ARCHIVE_CHUNK_ROWS)
+    )
+    rows = write_archive(path, result)
+    db.session.execute(text(f'DROP TABLE {name}'))
+    db.session.commit()
+    logger.info("Archived %d clicks from %s to %s", rows, name, path)
+    return name, path, rows
+
+
+def archive_expired_partitions(archive_dir, interval='month', retention=12, today=None):
+    """Detach, archive and drop partitions older than ``retention`` periods.
+
+    A partition is only archived once the hourly rollup job has consumed
+    every click in it, so analytics never lose data.  Partitions left
+    detached by an earlier run that failed to archive are finished first.
+    Returns a list of ``(partition, archive_path, rows)``.
+    """
+    if not is_partitioned():
+        return []
+
+    archived = []
+    for name in list_detached_partitions():
+        logger.warning("Archiving %s, left detached by an earlier run", name)
+        archived.append(_archive_detached(name, archive_dir))
+
+    cutoff = shift_periods(
+        period_start(today or datetime.now(timezone.utc).date(), interval), interval, -retention
+    )
+    for name in list_partitions():
+        parsed = parse_partition_name(name)
+        if parsed is None or next_period(parsed[0], parsed[1]) > cutoff:
+            continue
+
+        if _has_rows_not_rolled_up(name):
+            logger.warning("Not archiving %s: clicks not rolled up yet", name)
+            continue
+
+        # Detach in its own short transaction: holding the lock on clicks
+        # while the archive is written would block every insert.
+        db.session.execute(text(f'ALTER TABLE clicks DETACH PARTITION {name}'))
+        db.session.commit()
+        archived.append(_archive_detached(name, archive_dir))
+    return archived
+
+
+# -- Archive files -------------------------------------------------------------
+
+def _serialize(row):
+    record = dict(zip(ARCHIVE_COLUMNS, row))
+    if isinstance(record['clicked_at'], datetime):
+        record['clicked_at'] = record['clicked_at'].isoformat()
+    return json.dumps(record, separators=(',', ':'))
+
+
+def write_archive(path, rows, chunk_rows=ARCHIVE_CHUNK_ROWS):
+    """Write rows (tuples in ARCHIVE_COLUMNS order, ascending id) to ``path``.
+
+    Each chunk is a separate gzip member, so readers can seek straight to
+    one.  The offset index goes to ``path + '.idx'``.  Returns rows written.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    index = []
+    total = 0
+    chunk = []
+
+    with open(tmp_path, 'wb') as out:
+        def flush():
+            data = gzip.compress(('\n'.join(_serialize(r) for r in chunk) + '\n').encode())
+            index.append({
+                'first_id': chunk[0][0],
+                'last_id': chunk[-1][0],
+                'offset': out.tell(),
+                'length': len(data),
+                'rows': len(chunk),
+            })
+            out.write(data)
+
+        for row in rows:
+            chunk.append(tuple(row))
+            if len(chunk) >= chunk_rows:
+                flush()
+                total += len(chunk)
+                chunk = []
+        if chunk:
+            flush()
+            total += len(chunk)
+
+    with open(path + '.idx', 'w') as idx:
+        for entry in index:
+            idx.write(json.dumps(entry) + '\n')
+    os.replace(tmp_path, path)
+    return total
+
+
+def lookup_archived_click(path, click_id):
+    """Return one archived click as a dict, or None. Decompresses one chunk."""
+    with open(path + '.idx') as idx:
+        entries = [json.loads(line) for line in idx if line.strip()]
+    for entry in entries:
+        if entry['first_id'] <= click_id <= entry['last_id']:
+            with open(path, 'rb') as archive:
+                archive.seek(entry['offset'])
+                data = gzip.decompress(archive.read(entry['length']))
+            for line in data.decode().splitlines():
+                record = json.loads(line)
+                if record['id'] == click_id:
+                    return record
+            return None
+    return None
+
+
+def read_archive(path):
+    """Yield every archived click (gzip reads concatenated members in order)."""
+    with gzip.open(path, 'rt') as archive:
+        for line in archive:
+            if line.strip():
+                yield json.loads(line)
@@ -0,0 +1,169 @@
+"""Circuit breaker around every command sent to the cache Redis.
+
+Without it a Redis outage costs each redirect a socket timeout before it
+falls back to the database.  The client returned by
+:func:`fiverr.get_redis` is guarded:
+
+* ``REDIS_BREAKER_FAILURES`` consecutive connection errors or timeouts
+  open the circuit;
+* while it is open ``get_redis`` returns None (call sites go straight to
+  the database) and clients already handed out raise
+  :class:`~fiverr.circuit.CircuitOpenError` without touching the network;
+* a background thread PINGs Redis once ``REDIS_BREAKER_RESET_SECONDS``
+  have passed and closes the circuit on the first success.
+
+Only connection-level errors count as failures; a command Redis answers
+with an error (wrong type, script error) means Redis is up.  Blocking
+click-stream reads bypass the breaker (see
+:class:`fiverr.clickstream.RedisClickLog`).  The async redirect service
+guards its own client the same way (:func:`guard_async_redis`).  The
+state is exported as ``circuit_breaker_state{breaker="redis"}``.
+"""
+import functools
+import logging
+import threading
+import time
+
+from fiverr.circuit import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from fiverr.metrics import observe_circuit_state
+
+logger = logging.getLogger(__name__)
+
+
+def _is_outage(exc):
+    import redis
+    return isinstance(exc, (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError))
+
+
+def _guarded(func, breaker):
+    @functools.wraps(func)
+    def call(*args, **kwargs):
+        if breaker.state != CLOSED:
+            raise CircuitOpenError(f'circuit {breaker.name!r} is open')
+        try:
+            result = func(*args, **kwargs)
+        except Exception as exc:
+            if _is_outage(exc):
+                breaker.record_failure()
+            raise
+        breaker.record_success()
+        return result
+    return call
+
+
+def _guarded_async(func, breaker):
+    @functools.wraps(func)
+    async def call(*args, **kwargs):
+        if not breaker.allow():
+            raise CircuitOpenError(f'circuit {breaker.name!r} is open')
+        try:
+            result = await func(*args, **kwargs)
+        except Exception as exc:
+            if _is_outage(exc):
+                breaker.record_failure()
+            raise
+        breaker.record_success()
+        return result
+    return call
+
+
+def guard_async_redis(client, breaker):
+    """:func:`guard_redis` for a ``redis.asyncio`` client.
+
+    There is no probe thread on the event loop: once the reset timeout has
+    passed, the next command is let through as the half-open probe.
+    """
+    client.execute_command = _guarded_async(client.execute_command, breaker)
+    raw_pipeline = client.pipeline
+
+    @functools.wraps(raw_pipeline)
+    def pipeline(*args, **kwargs):
+        pipe = raw_pipeline(*args, **kwargs)
+        pipe.execute = _guarded_async(pipe.execute, breaker)
+        return pipe
+
+    client.pipeline = pipeline
+    return client
+
+
+def guard_redis(client, breaker):
+    """Send ``client``'s commands and pipeline executes through ``breaker``.
+
+    Patches the client in place and returns the unguarded ``ping`` for
+    probing.
+    """
+    raw_execute = client.execute_command
+    client.execute_command = _guarded(raw_execute, breaker)
+    raw_pipeline = client.pipeline
+
+    @functools.wraps(raw_pipeline)
+    def pipeline(*args, **kwargs):
+        pipe = raw_pipeline(*args, **kwargs)
+        pipe.execute = _guarded(pipe.execute, breaker)
+        return pipe
+
+    client.pipeline = pipeline
+    return lambda: raw_execute('PING')
+
+
+class RedisProbe:
+    """Background prober that closes an open breaker once Redis answers."""
+
+    def __init__(self, breaker, ping, interval=1.0):
+        self.breaker = breaker
+        self.ping = ping
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """Start probing unless a probe thread is already running."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return self._thread
+            self._thread = threading.Thread(target=self._run, name='redis-probe', daemon=True)
+            self._thread.start()
+            return self._thread
+
+    def probe_once(self):
+        """One half-open probe; returns the breaker state afterwards."""
+        if self.breaker.state == HALF_OPEN and self.breaker.allow():
+            try:
+                self.ping()
+            except Exception as exc:
+                logger.warning("Redis probe failed, circuit stays open: %s", exc)
+                self.breaker.record_failure()
+            else:
+                logger.info("Redis probe succeeded, circuit closed")
+                self.breaker.record_success()
+        return self.breaker.state
+
+    def _run(self):
+        while self.probe_once() != CLOSED:
+            time.sleep(self.interval)
+
+
+def create_redis_breaker(app, client):
+    """Guard ``client`` with a new breaker (and its prober) for ``app``."""
+    probe = None
+
+    def on_state_change(breaker, previous, state):
+        observe_circuit_state(breaker, previous, state)
+        if state == OPEN and previous == CLOSED:
+            logger.warning("Redis circuit opened, serving links from the database")
+            probe.start()
+
+    breaker = CircuitBreaker(
+        'redis',
+        failure_threshold=app.config.get('REDIS_BREAKER_FAILURES', 5),
+        reset_timeout=app.config.get('REDIS_BREAKER_RESET_SECONDS', 5),
+        on_state_change=on_state_change,
+    )
+    probe = RedisProbe(
+        breaker, guard_redis(client, breaker),
+        interval=min(1.0, breaker.reset_timeout),
+    )
+    observe_circuit_state(breaker, None, CLOSED)
+    app.extensions['redis_breaker'] = breaker
+    app.extensions['redis_probe'] = probe
+    return breaker
@@ -0,0 +1,176 @@
+"""Read-replica routing for read-only endpoints.
+
+Each of ``DATABASE_REPLICA_URLS`` gets an engine (``replica_0``,
+``replica_1``, ..., created with ``SQLALCHEMY_ENGINE_OPTIONS``; they are
+not binds, so ``db.create_all()`` never touches them).  Code that only
+reads wraps itself in
+:func:`use_replica` (routes use the :func:`read_only` decorator); the
+session then sends its queries to the replica picked for the block.
+Everything else, and any INSERT/UPDATE/DELETE or flush issued inside such
+a block, stays on the primary.
+
+A replica is picked ``round_robin`` or by ``least_connections`` (fewest
+connections checked out of its pool).  Replication lag is measured at
+most every ``DATABASE_REPLICA_LAG_CHECK_SECONDS`` per replica; a replica
+lagging more than ``DATABASE_REPLICA_MAX_LAG_SECONDS`` (or failing the
+check) is skipped, and with no replica left the read goes to the
+primary.  Lag is only measurable on Postgres; other replicas count as
+current.
+"""
+import functools
+import itertools
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine, text
+
+from fiverr.metrics import DB_READ_ROUTING
+
+logger = logging.getLogger(__name__)
+
+SELECTIONS = ('round_robin', 'least_connections')
+
+_PG_LAG = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() "
+    "OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()) END"
+)
+
+
+class RoutingSession(Session):
+    """``db.session`` class: a replica set in ``info['replica']`` serves reads."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        replica = self.info.get('replica')
+        if (replica is not None and bind is None and not self._flushing
+                and not getattr(clause, 'is_dml', False)):
+            return replica
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def measure_lag(engine):
+    """Replication lag of ``engine`` in seconds (0 for non-Postgres)."""
+    if engine.dialect.name != 'postgresql':
+        return 0.0
+    with engine.connect() as connection:
+        return float(connection.execute(_PG_LAG).scalar() or 0)
+
+
+class _Replica:
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self.lag = 0.0
+        self.checked_at = -math.inf
+
+    def connections(self):
+        checkedout = getattr(self.engine.pool, 'checkedout', None)
+        return checkedout() if checkedout is not None else 0
+
+
+class ReplicaRouter:
+    """Picks the replica for a read-only block, or None for the primary."""
+
+    def __init__(self, engines, selection='round_robin', max_lag=5.0, lag_check_interval=5.0,
+                 measure=measure_lag, clock=time.monotonic):
+        if selection not in SELECTIONS:
+            raise ValueError(f'Unknown replica selection {selection!r} '
+                             f'(choose from {", ".join(SELECTIONS)})')
+        self.replicas = [_Replica(name, engine) for name, engine in engines.items()]
+        self.selection = selection
+        self.max_lag = max_lag
+        self.lag_check_interval = lag_check_interval
+        self._measure = measure
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._turn = itertools.count()
+
+    def _lag(self, replica):
+        now = self._clock()
+        with self._lock:
+            if now - replica.checked_at < self.lag_check_interval:
+                return replica.lag
+            # Claim the check; concurrent callers use the previous value.
+            replica.checked_at = now
+        try:
+            lag = self._measure(replica.engine)
+        except Exception as exc:
+            logger.warning("Replica %s lag check failed, skipping it: %s", replica.name, exc)
+            lag = math.inf
+        if lag > self.max_lag and replica.lag <= self.max_lag:
+            logger.warning("Replica %s is %.1fs behind, reading from the primary", replica.name, lag)
+        replica.lag = lag
+        return lag
+
+    def choose(self):
+        """The replica to read from, or None when every replica lags."""
+        candidates = [r for r in self.replicas if self._lag(r) <= self.max_lag]
+        if not candidates:
+            DB_READ_ROUTING.inc(('primary',))
+            return None
+        # Rotate the candidates so least_connections ties also take turns.
+        start = next(self._turn) % len(candidates)
+        candidates = candidates[start:] + candidates[:start]
+        if self.selection == 'least_connections':
+            replica = min(candidates, key=_Replica.connections)
+        else:
+            replica = candidates[0]
+        DB_READ_ROUTING.inc((replica.name,))
+        return replica
+
+
+def init_replicas(app):
+    """Create the app's :class:`ReplicaRouter` when replicas are configured."""
+    urls = app.config.get('DATABASE_REPLICA_URLS') or ()
+    if not urls:
+        app.extensions['db_router'] = None
+        return None
+    # Engines open no connection until first use.
+    options = app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {})
+    engines = {f'replica_{i}': create_engine(url, **options) for i, url in enumerate(urls)}
+    router = ReplicaRouter(
+        engines,
+        selection=app.config['DATABASE_REPLICA_SELECTION'],
+        max_lag=app.config['DATABASE_REPLICA_MAX_LAG_SECONDS'],
+        lag_check_interval=app.config['DATABASE_REPLICA_LAG_CHECK_SECONDS'],
+    )
+    app.extensions['db_router'] = router
+    return router
+
+
+@contextmanager
+def use_replica():
+    """Send this block's reads on ``db.session`` to a replica, if one is fit.
+
+    Yields the replica's name, or None when the block reads from the
+    primary or an enclosing block already picked the replica.
+    """
+    from fiverr import db
+
+    session = db.session()
+    router = current_app.extensions.get('db_router')
+    replica = None
+    if router is not None and 'replica' not in session.info:
+        replica = router.choose()
+    if replica is None:
+        yield None
+        return
+    session.info['replica'] = replica.engine
+    try:
+        yield replica.name
+    finally:
+        del session.info['replica']
+
+
+def read_only(view):
+    """Route decorator: run the view inside :func:`use_replica`."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with use_replica():
+            return view(*args, **kwargs)
+    return wrapper
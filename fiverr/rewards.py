@@ -0,0 +1,410 @@
+import logging
+import random
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+
+from flask import current_app
+from sqlalchemy import and_, func, insert, or_, select, update
+
+from fiverr import db
+from fiverr.metrics import observe_reward
+from fiverr.models import Click, Link, Reward
+
+logger = logging.getLogger(__name__)
+
+# Credits granted to the seller for every rewarded click.
+REWARD_AMOUNT = 0.05
+
+# Credit outcomes meaning "try again later" (see fiverr.credit_client); the
+# reward is stored as 'retrying' with a next_attempt_at.  A 'rejected'
+# credit never left this process (open circuit), so it costs no attempt.
+RETRY = 'retry'
+REJECTED = 'rejected'
+RETRYING = 'retrying'
+
+# Click reward status while a batch sweep has claimed it and is calling the
+# credit service (see claim_pending_rewards).
+SETTLING = 'settling'
+
+
+def retry_delay(attempt, base=None, cap=None, rng=random):
+    """Seconds to wait before attempt ``attempt + 1``.
+
+    Exponential backoff capped at ``cap``, with "equal jitter": half the
+    delay is fixed and half random, so retries of rewards that failed
+    together spread out instead of hitting a recovering service at once.
+    """
+    if base is None:
+        base = current_app.config['REWARD_RETRY_BASE_SECONDS']
+    if cap is None:
+        cap = current_app.config['REWARD_RETRY_MAX_SECONDS']
+    delay = min(cap, base * 2 ** (attempt - 1))
+    return delay / 2 + rng.uniform(0, delay / 2)
+
+
+def next_attempt_at(attempt, now=None):
+    now = now or datetime.now(timezone.utc)
+    return now + timedelta(seconds=retry_delay(attempt))
+
+
+def enqueue_reward(click_id, seller_id, link_id):
+    """Hand a recorded click to the reward pipeline (non-blocking).
+
+    In ``REWARD_MODE=batch`` nothing is enqueued: the click stays
+    ``pending`` and the periodic sweep settles it with its batch.
+    Failures are logged and swallowed: a broker outage must never break
+    the redirect or the click writer.
+    """
+    if current_app.config.get('REWARD_MODE') == 'batch':
+        return
+    try:
+        # Import locally to avoid circular imports.
+        from tasks import process_reward_task
+        process_reward_task.delay(click_id, seller_id, link_id, REWARD_AMOUNT)
+    except Exception as e:
+        logger.warning("Reward enqueue failed: %s", e)
+
+
+def credit_links(credits_by_link):
+    """Add ``{link_id: Decimal}`` to ``credits_earned`` with atomic increments.
+
+    The addition happens in SQL (``credits_earned = credits_earned + x``),
+    so concurrent workers never overwrite each other's credits.  Links are
+    updated in id order, so two transactions crediting overlapping links
+    always lock them in the same order and cannot deadlock.  Does not
+    commit; call it last before the commit to hold the row locks briefly.
+    """
+    for link_id in sorted(credits_by_link):
+        db.session.execute(
+            update(Link)
+            .where(Link.id == link_id)
+            .values(credits_earned=Link.credits_earned + credits_by_link[link_id])
+        )
+
+
+def record_reward(click_id, seller_id, link_id, amount, remote_status, txn_id=None):
+    """Persist one credit outcome: the Reward entry, the click status and,
+    if completed, the link's credit increment, in one transaction.
+
+    Returns ``(status, clicked_at)``.
+    """
+    # Transient failures are parked for the retry sweep instead of failing
+    # the reward for good.
+    status = RETRYING if remote_status in (RETRY, REJECTED) else remote_status
+    attempts = 0 if remote_status == REJECTED else 1
+    amount = Decimal(str(amount))
+    try:
+        db.session.add(Reward(
+            seller_id=seller_id,
+            link_id=link_id,
+            click_id=click_id,
+            amount=amount,
+            status=status,
+            aws_transaction_id=txn_id,
+            completed_at=datetime.now(timezone.utc) if status == 'completed' else None,
+            attempts=attempts,
+            next_attempt_at=next_attempt_at(max(attempts, 1)) if status == RETRYING else None,
+        ))
+
+        click = db.session.get(Click, click_id)
+        clicked_at = click.clicked_at if click else None
+        if click:
+            click.reward_status = status
+        db.session.flush()
+
+        if status == 'completed':
+            credit_links({link_id: amount})
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return status, clicked_at
+
+
+def reconcile_credits(fix=False, batch_size=1000):
+    """Compare every link's ``credits_earned`` with its rewards ledger.
+
+    The ledger total is the sum of the link's completed rewards.  Returns
+    ``[(link_id, recorded, ledger)]`` for links that disagree; with
+    ``fix=True`` those links are reset to the ledger total (computed in
+    the same UPDATE, so rewards landing meanwhile are not lost).
+    """
+    ledger = (
+        select(Reward.link_id, func.sum(Reward.amount).label('total'))
+        .where(Reward.status == 'completed')
+        .group_by(Reward.link_id)
+        .subquery()
+    )
+    cent = Decimal('0.01')
+    drift = [
+        (link_id, Decimal(str(recorded or 0)).quantize(cent), Decimal(str(total or 0)).quantize(cent))
+        for link_id, recorded, total in db.session.execute(
+            select(Link.id, Link.credits_earned, ledger.c.total)
+            .outerjoin(ledger, ledger.c.link_id == Link.id)
+            .order_by(Link.id)
+            .execution_options(yield_per=batch_size)
+        )
+    ]
+    drift = [row for row in drift if row[1] != row[2]]
+
+    if fix and drift:
+        ledger_total = (
+            select(func.coalesce(func.sum(Reward.amount), 0))
+            .where(Reward.link_id == Link.id)
+            .where(Reward.status == 'completed')
+            .scalar_subquery()
+        )
+        link_ids = [link_id for link_id, _, _ in drift]
+        for i in range(0, len(link_ids), batch_size):
+            db.session.execute(
+                update(Link)
+                .where(Link.id.in_(link_ids[i:i + batch_size]))
+                .values(credits_earned=ledger_total)
+            )
+    db.session.commit()
+    return drift
+
+
+def claim_pending_rewards(limit):
+    """Claim up to ``limit`` clicks awaiting a reward and return them as batch items.
+
+    The clicks are marked ``settling`` with a ``reward_claimed_at`` and the
+    claim is committed, so the credit call that follows runs with no
+    transaction open and no row locks held.  ``FOR UPDATE SKIP LOCKED``
+    (ignored by SQLite) keeps concurrent sweepers off each other's rows
+    while claiming.  Claims older than ``REWARD_CLAIM_TIMEOUT_SECONDS``
+    (their sweeper died before settling) are claimed again; the credit
+    service dedupes on click id, so re-crediting them is safe.
+    """
+    now = datetime.now(timezone.utc)
+    stale = now - timedelta(seconds=current_app.config['REWARD_CLAIM_TIMEOUT_SECONDS'])
+    try:
+        rows = db.session.execute(
+            select(Click.id, Click.link_id, Link.seller_id, Click.clicked_at)
+            .join(Link, Link.id == Click.link_id)
+            .where(or_(
+                Click.reward_status == 'pending',
+                and_(Click.reward_status == SETTLING, Click.reward_claimed_at < stale),
+            ))
+            .order_by(Click.id)
+            .limit(limit)
+            .with_for_update(of=Click, skip_locked=True)
+        ).all()
+        if rows:
+            db.session.execute(
+                update(Click)
+                .where(Click.id.in_([row[0] for row in rows]))
+                .values(reward_status=SETTLING, reward_claimed_at=now)
+            )
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return [
+        {'click_id': click_id, 'seller_id': seller_id, 'link_id': link_id,
+         'amount': REWARD_AMOUNT, 'clicked_at': clicked_at.isoformat(),
+         'claimed_at': now.isoformat()}
+        for click_id, link_id, seller_id, clicked_at in rows
+    ]
+
+
+def _owned_items(items, outcomes):
+    """Lock the claimed clicks still held by these items' claim.
+
+    Returns the ``(item, outcome)`` pairs to settle.  Items claimed by
+    :func:`claim_pending_rewards` are dropped if their claim went stale and
+    another sweeper took the click over; unclaimed items pass through.
+    """
+    pairs = list(zip(items, outcomes))
+    claims = {item['claimed_at'] for item in items if item.get('claimed_at')}
+    if not claims:
+        return pairs
+    owned = set()
+    for claimed_at in claims:
+        owned.update(db.session.execute(
+            select(Click.id)
+            .where(Click.id.in_([item['click_id'] for item in items
+                                 if item.get('claimed_at') == claimed_at]))
+            .where(Click.reward_status == SETTLING)
+            .where(Click.reward_claimed_at == datetime.fromisoformat(claimed_at))
+            .with_for_update(of=Click)
+        ).scalars())
+    lost = [item['click_id'] for item, _ in pairs
+            if item.get('claimed_at') and item['click_id'] not in owned]
+    if lost:
+        logger.warning("Skipping %d reward(s) whose claim was taken over: %s", len(lost), lost)
+    return [(item, outcome) for item, outcome in pairs
+            if not item.get('claimed_at') or item['click_id'] in owned]
+
+
+def settle_reward_batch(items, outcomes):
+    """Record a batch of credit outcomes in a single short transaction.
+
+    ``outcomes`` holds one ``(status, transaction_id)`` per item.  Locks
+    the clicks still claimed by this batch, then issues one multi-row
+    Reward INSERT, one Click UPDATE per distinct status and one
+    ``credits_earned`` increment per rewarded link, and commits.
+    """
+    now = datetime.now(timezone.utc)
+    rewards = []
+    clicks_by_status = defaultdict(list)
+    credits_by_link = defaultdict(Decimal)
+
+    try:
+        pairs = _owned_items(items, outcomes)
+        for item, (status, txn_id) in pairs:
+            amount = Decimal(str(item['amount']))
+            attempts = 0 if status == REJECTED else 1
+            if status in (RETRY, REJECTED):
+                status = RETRYING
+            rewards.append({
+                'seller_id': item['seller_id'],
+                'link_id': item['link_id'],
+                'click_id': item['click_id'],
+                'amount': amount,
+                'status': status,
+                'aws_transaction_id': txn_id,
+                'created_at': now,
+                'completed_at': now if status == 'completed' else None,
+                'attempts': attempts,
+                'next_attempt_at': next_attempt_at(max(attempts, 1), now) if status == RETRYING else None,
+            })
+            clicks_by_status[status].append(item['click_id'])
+            if status == 'completed':
+                credits_by_link[item['link_id']] += amount
+
+        if rewards:
+            db.session.execute(insert(Reward), rewards)
+        for status, click_ids in clicks_by_status.items():
+            db.session.execute(
+                update(Click)
+                .where(Click.id.in_(click_ids))
+                .values(reward_status=status, reward_claimed_at=None)
+            )
+        credit_links(credits_by_link)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    for item, (status, _) in pairs:
+        observe_reward(status, item.get('clicked_at'))
+
+
+def claim_due_retries(limit):
+    """Claim up to ``limit`` rewards whose next attempt is due.
+
+    Each claimed reward's ``next_attempt_at`` is pushed out by
+    ``REWARD_CLAIM_TIMEOUT_SECONDS`` (its lease) and the claim is
+    committed, so the credit call runs with no transaction open; a worker
+    that dies mid-call simply leaves the reward due again once the lease
+    expires.  ``SKIP LOCKED`` keeps concurrent sweepers apart while claiming.
+
+    Returns one dict per reward with its ids, amount, ``clicked_at`` and
+    ``lease``.
+    """
+    now = datetime.now(timezone.utc)
+    lease = now + timedelta(seconds=current_app.config['REWARD_CLAIM_TIMEOUT_SECONDS'])
+    try:
+        rows = db.session.execute(
+            select(Reward, Click.clicked_at)
+            .outerjoin(Click, Click.id == Reward.click_id)
+            .where(Reward.status == RETRYING)
+            .where(Reward.next_attempt_at <= now)
+            .order_by(Reward.next_attempt_at)
+            .limit(limit)
+            .with_for_update(of=Reward, skip_locked=True)
+        ).all()
+        claimed = [
+            {'reward_id': reward.id, 'click_id': reward.click_id,
+             'seller_id': reward.seller_id, 'link_id': reward.link_id,
+             'amount': reward.amount, 'clicked_at': clicked_at, 'lease': lease}
+            for reward, clicked_at in rows
+        ]
+        for reward, _ in rows:
+            reward.next_attempt_at = lease
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return claimed
+
+
+def settle_retries(claimed, outcomes):
+    """Apply credit outcomes to rewards claimed by :func:`claim_due_retries`.
+
+    Runs in one short transaction that re-locks the rewards still held by
+    their lease (one whose lease expired may have been claimed again).
+    Completed rewards credit their link (and the rollups, if the rollup job
+    already passed them); rewards still failing are rescheduled with a
+    longer backoff until ``REWARD_MAX_ATTEMPTS``, then marked failed.
+    Rewards the open circuit rejected keep their attempt count and backoff.
+    Commits.
+    """
+    from fiverr.rollups import add_late_credits
+
+    now = datetime.now(timezone.utc)
+    max_attempts = current_app.config['REWARD_MAX_ATTEMPTS']
+    clicks_by_status = defaultdict(list)
+    credits_by_link = defaultdict(Decimal)
+    late_credits = []
+    observed = []
+
+    rewards = {}
+    for lease in {item['lease'] for item in claimed}:
+        rewards.update((reward.id, reward) for reward in db.session.execute(
+            select(Reward)
+            .where(Reward.id.in_([item['reward_id'] for item in claimed
+                                  if item['lease'] == lease]))
+            .where(Reward.status == RETRYING)
+            .where(Reward.next_attempt_at == lease)
+            .with_for_update()
+        ).scalars())
+
+    for item, (status, txn_id) in zip(claimed, outcomes):
+        reward, clicked_at = rewards.get(item['reward_id']), item['clicked_at']
+        if reward is None:
+            logger.warning("Skipping reward %s: its retry lease was taken over", item['reward_id'])
+            continue
+        if status == REJECTED:
+            reward.next_attempt_at = next_attempt_at(max(reward.attempts, 1), now)
+            observed.append((REJECTED, None))
+            continue
+        reward.attempts += 1
+        if status == RETRY and reward.attempts < max_attempts:
+            reward.next_attempt_at = next_attempt_at(reward.attempts, now)
+            observed.append((RETRY, None))
+            continue
+        if status == RETRY:
+            status = 'failed'
+            reward.last_error = f'gave up after {reward.attempts} attempts'
+
+        reward.status = status
+        reward.next_attempt_at = None
+        if status == 'completed':
+            reward.completed_at = now
+            reward.aws_transaction_id = txn_id
+            amount = Decimal(str(reward.amount))
+            credits_by_link[reward.link_id] += amount
+            late_credits.append((reward.txid, reward.id, reward.link_id, clicked_at or reward.created_at, amount))
+        if reward.click_id is not None:
+            clicks_by_status[status].append(reward.click_id)
+        observed.append((status, clicked_at))
+
+    try:
+        for status, click_ids in clicks_by_status.items():
+            db.session.execute(
+                update(Click)
+                .where(Click.id.in_(click_ids))
+                .values(reward_status=status)
+            )
+        credit_links(credits_by_link)
+        add_late_credits(late_credits)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    for status, clicked_at in observed:
+        observe_reward(status, clicked_at)
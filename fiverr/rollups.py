@@ -0,0 +1,212 @@
+"""Incremental hourly click rollups.
+
+A periodic job folds new ``clicks`` rows (and completed ``rewards``) into
+``click_rollups`` keyed by ``(link_id, hour)``.  Progress is tracked with
+high-water marks stored in ``rollup_checkpoints`` and advanced in the same
+transaction as the increments, so every row is counted exactly once.
+Analytics read only the rollups and never scan raw clicks.
+
+The mark is ``(txid, id)``, not ``id`` or a timestamp: ids are assigned
+before commit (concurrent stream consumers commit out of order) and
+``clicked_at`` is event time (drained stream clicks arrive late), so
+neither tells which rows are visible yet.  On Postgres every row records
+the inserting transaction (``txid_current()``) and a run only consumes rows
+from transactions older than its snapshot's ``xmin``, all of which have
+finished; a row that commits later always sorts after the mark.  SQLite
+has a single writer, so rows become visible in id order (``txid`` is 0).
+"""
+from collections import defaultdict
+from datetime import timedelta, timezone
+from decimal import Decimal
+
+from sqlalchemy import select, text, tuple_, update
+
+from fiverr import db
+from fiverr.models import Click, ClickRollup, Reward, RollupCheckpoint
+from fiverr.utils import dialect_insert
+
+BUCKETS = {'hour': timedelta(hours=1), 'day': timedelta(days=1)}
+
+
+def _naive(value):
+    """Naive UTC datetime, the form timestamps are stored in."""
+    if value.tzinfo is not None:
+        return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def hour_bucket(value):
+    """Truncate to the hour as a naive UTC datetime (the rollup key)."""
+    return _naive(value).replace(minute=0, second=0, microsecond=0)
+
+
+def _checkpoint(name):
+    """Lock and return the job's ``(last_txid, last_id)`` mark."""
+    # Row lock: serializes with add_late_credits (see there).
+    mark = db.session.execute(
+        select(RollupCheckpoint.last_txid, RollupCheckpoint.last_id)
+        .where(RollupCheckpoint.name == name)
+        .with_for_update()
+    ).first()
+    if mark is None:
+        db.session.add(RollupCheckpoint(name=name, last_txid=0, last_id=0))
+        db.session.flush()
+        return 0, 0
+    return tuple(mark)
+
+
+def _advance(name, last_txid, last_id):
+    db.session.execute(
+        update(RollupCheckpoint)
+        .where(RollupCheckpoint.name == name)
+        .values(last_txid=last_txid, last_id=last_id)
+    )
+
+
+def _finished_txid_bound():
+    """Txids below this belong to finished transactions (None: no bound needed)."""
+    if db.engine.dialect.name != 'postgresql':
+        return None
+    return db.session.execute(
+        text('SELECT txid_snapshot_xmin(txid_current_snapshot())')
+    ).scalar()
+
+
+def _after_mark(model, mark):
+    """WHERE clauses selecting rows past ``mark`` whose writers have finished."""
+    clauses = [tuple_(model.txid, model.id) > tuple_(*mark)]
+    bound = _finished_txid_bound()
+    if bound is not None:
+        clauses.append(model.txid < bound)
+    return clauses
+
+
+def _apply(increments):
+    """Add ``{(link_id, hour): [clicks, credits]}`` onto the rollup rows."""
+    if not increments:
+        return
+    stmt = dialect_insert(ClickRollup)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['link_id', 'hour'],
+        set_={
+            'clicks': ClickRollup.clicks + stmt.excluded.clicks,
+            'credits': ClickRollup.credits + stmt.excluded.credits,
+        },
+    )
+    db.session.execute(stmt, [
+        {'link_id': link_id, 'hour': hour, 'clicks': clicks, 'credits': credits}
+        for (link_id, hour), (clicks, credits) in increments.items()
+    ])
+
+
+def roll_up_clicks(batch_size=10000):
+    """Fold the next batch of clicks into the rollups. Returns rows processed."""
+    try:
+        mark = _checkpoint('clicks')
+        rows = db.session.execute(
+            select(Click.txid, Click.id, Click.link_id, Click.clicked_at)
+            .where(*_after_mark(Click, mark))
+            .order_by(Click.txid, Click.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            db.session.commit()
+            return 0
+
+        increments = defaultdict(lambda: [0, Decimal('0')])
+        for _, _, link_id, clicked_at in rows:
+            increments[(link_id, hour_bucket(clicked_at))][0] += 1
+        _apply(increments)
+        _advance('clicks', rows[-1][0], rows[-1][1])
+        db.session.commit()
+        return len(rows)
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def roll_up_rewards(batch_size=10000):
+    """Fold the next batch of completed rewards into the credit totals.
+
+    Credits land in the hour of the click that earned them (the reward's
+    own creation time if the click is gone).
+    """
+    try:
+        mark = _checkpoint('rewards')
+        rows = db.session.execute(
+            select(Reward.txid, Reward.id, Reward.link_id, Reward.status, Reward.amount,
+                   Click.clicked_at, Reward.created_at)
+            .outerjoin(Click, Click.id == Reward.click_id)
+            .where(*_after_mark(Reward, mark))
+            .order_by(Reward.txid, Reward.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            db.session.commit()
+            return 0
+
+        increments = defaultdict(lambda: [0, Decimal('0')])
+        for _, _, link_id, status, amount, clicked_at, created_at in rows:
+            if status == 'completed':
+                increments[(link_id, hour_bucket(clicked_at or created_at))][1] += Decimal(str(amount))
+        _apply(increments)
+        _advance('rewards', rows[-1][0], rows[-1][1])
+        db.session.commit()
+        return len(rows)
+    except Exception:
+        db.session.rollback()
+        raise
+
+
+def add_late_credits(rewards):
+    """Count rewards that completed after :func:`roll_up_rewards` passed them.
+
+    ``rewards`` is ``[(txid, reward_id, link_id, clicked_at, amount)]`` for
+    rewards that just moved from 'retrying' to 'completed'.  Those at or
+    below the rewards high-water mark were already seen (and skipped) by
+    the rollup, so their credits are added here; the rest will be counted
+    normally.  The checkpoint row is locked so a concurrent rollup run
+    cannot advance past a reward between the two decisions.  Does not
+    commit.
+    """
+    if not rewards:
+        return
+    mark = tuple(db.session.execute(
+        select(RollupCheckpoint.last_txid, RollupCheckpoint.last_id)
+        .where(RollupCheckpoint.name == 'rewards')
+        .with_for_update()
+    ).first() or (0, 0))
+    increments = defaultdict(lambda: [0, Decimal('0')])
+    for txid, reward_id, link_id, clicked_at, amount in rewards:
+        if (txid, reward_id) <= mark:
+            increments[(link_id, hour_bucket(clicked_at))][1] += Decimal(str(amount))
+    _apply(increments)
+
+
+def link_series(link_id, start, end, bucket='hour'):
+    """Zero-filled ``[(bucket_start, clicks, credits)]`` for ``[start, end)``."""
+    step = BUCKETS[bucket]
+    start = hour_bucket(start)
+    if bucket == 'day':
+        start = start.replace(hour=0)
+
+    rows = db.session.execute(
+        select(ClickRollup.hour, ClickRollup.clicks, ClickRollup.credits)
+        .where(ClickRollup.link_id == link_id)
+        .where(ClickRollup.hour >= start)
+        .where(ClickRollup.hour < _naive(end))
+    ).all()
+
+    totals = {}
+    for hour, clicks, credits in rows:
+        key = hour if bucket == 'hour' else hour.replace(hour=0)
+        bucket_clicks, bucket_credits = totals.get(key, (0, Decimal('0')))
+        totals[key] = (bucket_clicks + clicks, bucket_credits + Decimal(str(credits)))
+
+    series = []
+    current = start
+    while current < _naive(end):
+        clicks, credits = totals.get(current, (0, Decimal('0')))
+        series.append((current, clicks, credits))
+        current += step
+    return series
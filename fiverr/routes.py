@@ -1,12 +1,26 @@
+import hmac
 import json
 import logging
-from datetime import datetime, timezone
-from flask import Blueprint, jsonify, request, redirect, current_app
+from datetime import datetime, timedelta, timezone
+from flask import Blueprint, Response, jsonify, request, redirect, current_app, stream_with_context
 from pydantic import ValidationError
-from sqlalchemy import text
-from fiverr import db
+from sqlalchemy import insert, select, text, update
+from fiverr import db, get_redis
+from fiverr.cache import LinkRecord, link_cache_key, store_link
+from fiverr.clickstream import get_click_log, publish_click
+from fiverr.dedup import is_duplicate_click
+from fiverr.export import EXPORTS, FORMATS, TableExport
+from fiverr.links import insert_links_ignoring_duplicates, links_by_pair, upsert_link
+from fiverr.metrics import LINK_CACHE_LOOKUPS, REGISTRY, CONTENT_TYPE as METRICS_CONTENT_TYPE
 from fiverr.models import Link, Click
+from fiverr.pagination import (
+    InvalidCursor, estimated_total, exact_total, keyset_page,
+)
+from fiverr.replicas import read_only, use_replica
+from fiverr.rewards import enqueue_reward
+from fiverr.rollups import BUCKETS, link_series
 from fiverr.schemas import CreateLinkRequest
+from fiverr.shortcodes import get_allocator
 from fiverr.utils import generate_short_code, get_client_ip
 
 logger = logging.getLogger(__name__)
@@ -15,6 +29,7 @@ api_bp = Blueprint('api', __name__)
 
 
 @api_bp.route('/health', methods=['GET'])
+@read_only
 def health():
     try:
         db.session.execute(text('SELECT 1'))
@@ -37,8 +52,10 @@ def index():
         'version': '1.0',
         'endpoints': {
             'POST /link': 'Create a short link',
+            'POST /links/batch': 'Create many short links in one request',
             'GET /link/<short_code>': 'Redirect to original URL and reward seller',
-            'GET /state': 'Get analytics (paginated)'
+            'GET /state': 'Get analytics (paginated)',
+            'GET /links/<short_code>/stats': 'Click and credit time series'
         }
     }), 200
 
@@ -64,32 +81,90 @@ def create_link():
         seller_id = body.seller_id
         original_url = str(body.original_url)
 
-        existing_link = Link.query.filter_by(
-            seller_id=seller_id,
-            original_url=original_url
-        ).first()
+        short_code = generate_short_code()
+        link = upsert_link(seller_id, original_url, short_code)
+        # Read before commit so expired attributes aren't reloaded.
+        created = link.short_code == short_code
+        link_data = link.to_dict()
+        db.session.commit()
 
-        if existing_link:
+        if not created:
             return jsonify({
                 'message': 'Link already exists (reusing existing short code)',
-                'link': existing_link.to_dict()
+                'link': link_data
             }), 200
 
-        short_code = generate_short_code()
+        return jsonify({
+            'message': 'Short link created successfully',
+            'link': link_data
+        }), 201
 
-        link = Link(
-            seller_id=seller_id,
-            original_url=original_url,
-            short_code=short_code
-        )
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
 
-        db.session.add(link)
+
+@api_bp.route('/links/batch', methods=['POST'])
+def create_links_batch():
+    """
+    POST /links/batch
+    Create (or reuse) many short links at once.
+
+    Body is a JSON array of ``{seller_id, original_url}``.  All new links
+    are written with one ``INSERT ... ON CONFLICT DO NOTHING`` and resolved
+    with one lookup; ``results`` has one entry per input item, in order.
+    """
+    try:
+        items = request.get_json(silent=True)
+        if not isinstance(items, list) or not items:
+            return jsonify({'error': 'Expected a non-empty JSON array of links'}), 400
+
+        max_size = current_app.config['LINK_BATCH_MAX_SIZE']
+        if len(items) > max_size:
+            return jsonify({'error': f'Batch too large (max {max_size} links)'}), 400
+
+        # One validation pass; remember each valid item's pair.
+        results = [None] * len(items)
+        item_pairs = {}
+        for index, item in enumerate(items):
+            try:
+                body = CreateLinkRequest(**item) if isinstance(item, dict) else None
+            except ValidationError as ve:
+                results[index] = {'index': index, 'status': 'error', 'error': ve.errors()[0]['msg']}
+                continue
+            if body is None:
+                results[index] = {'index': index, 'status': 'error', 'error': 'Item must be an object'}
+                continue
+            item_pairs[index] = (body.seller_id, str(body.original_url))
+
+        unique_pairs = list(dict.fromkeys(item_pairs.values()))
+        codes = dict(zip(unique_pairs, get_allocator().allocate_many(len(unique_pairs))))
+
+        insert_links_ignoring_duplicates([
+            {'seller_id': seller_id, 'original_url': original_url, 'short_code': code}
+            for (seller_id, original_url), code in codes.items()
+        ])
+        links = links_by_pair(unique_pairs)
         db.session.commit()
 
-        return jsonify({
-            'message': 'Short link created successfully',
-            'link': link.to_dict()
-        }), 201
+        # A pair was created by this request iff it carries the code we
+        # allocated for it; repeats within the batch report 'existing'.
+        reported = set()
+        for index, pair in item_pairs.items():
+            link = links[pair]
+            created = link.short_code == codes[pair] and pair not in reported
+            reported.add(pair)
+            results[index] = {
+                'index': index,
+                'status': 'created' if created else 'existing',
+                'link': link.to_dict(),
+            }
+
+        summary = {'created': 0, 'existing': 0, 'error': 0}
+        for result in results:
+            summary[result['status']] += 1
+
+        return jsonify({'results': results, 'summary': summary}), 200
 
     except Exception as e:
         db.session.rollback()
@@ -97,41 +172,172 @@ def create_link():
 
 
 def _get_link_from_cache(short_code):
-    """Try Redis first, fall back to DB. Returns (link_obj, original_url) or (None, None)."""
-    redis_client = current_app.extensions.get('redis')
-    cache_key = f'link:{short_code}'
+    """Try the L1 cache, then Redis, then the DB. Returns a LinkRecord or None.
 
-    # Try cache
+    Cache hits are served without touching the ORM session.
+    """
+    local_cache = current_app.extensions.get('link_cache')
+    redis_client = get_redis()
+    cache_key = link_cache_key(short_code)
+
+    # L1: process memory, no network call
+    if local_cache is not None:
+        record = local_cache.get(short_code)
+        if record:
+            LINK_CACHE_LOOKUPS.inc(('l1', 'hit'))
+            return record
+        LINK_CACHE_LOOKUPS.inc(('l1', 'miss'))
+
+    # Try Redis
     if redis_client:
         try:
             cached = redis_client.hgetall(cache_key)
             if cached:
-                # We still need the ORM object for the click insert, but we
-                # avoid a full table scan by doing a PK lookup.
-                link = db.session.get(Link, int(cached['id']))
-                if link:
-                    return link, cached['original_url']
+                LINK_CACHE_LOOKUPS.inc(('redis', 'hit'))
+                record = LinkRecord.from_cache(cached)
+                if local_cache is not None:
+                    local_cache.set(short_code, record)
+                return record
+            LINK_CACHE_LOOKUPS.inc(('redis', 'miss'))
         except Exception:
-            pass  # Redis down mid-request — fall through to DB
+            LINK_CACHE_LOOKUPS.inc(('redis', 'error'))
+            # Redis down mid-request — fall through to DB
+
+    # DB lookup (columns only, no ORM instance)
+    row = db.session.execute(
+        select(Link.id, Link.original_url, Link.seller_id)
+        .where(Link.short_code == short_code)
+    ).first()
+    if not row:
+        return None
 
-    # DB lookup
-    link = Link.query.filter_by(short_code=short_code).first()
-    if not link:
-        return None, None
+    record = LinkRecord(*row)
+    if local_cache is not None:
+        local_cache.set(short_code, record)
 
     # Populate cache (1 hour TTL)
     if redis_client:
         try:
-            redis_client.hset(cache_key, mapping={
-                'id': str(link.id),
-                'original_url': link.original_url,
-                'seller_id': link.seller_id,
-            })
-            redis_client.expire(cache_key, 3600)
+            store_link(redis_client, short_code, record)
         except Exception:
             pass
 
-    return link, link.original_url
+    return record
+
+
+def _record_click(link_id, ip_address, user_agent):
+    """Insert a click and bump the link's counter in one commit. Returns the click id."""
+    click_id = db.session.execute(
+        insert(Click)
+        .values(link_id=link_id, ip_address=ip_address, user_agent=user_agent)
+        .returning(Click.id)
+    ).scalar_one()
+    db.session.execute(
+        update(Link)
+        .where(Link.id == link_id)
+        .values(click_count=Link.click_count + 1)
+    )
+    db.session.commit()
+    return click_id
+
+
+def _count_duplicate_click(link_id):
+    """Bump the link's counter for a suppressed repeat click (no Click row)."""
+    db.session.execute(
+        update(Link)
+        .where(Link.id == link_id)
+        .values(click_count=Link.click_count + 1)
+    )
+    db.session.commit()
+
+
+@api_bp.route('/metrics', methods=['GET'])
+def metrics():
+    """
+    GET /metrics
+    Prometheus text exposition (summed over all worker processes)
+    """
+    if not current_app.config.get('METRICS_ENABLED'):
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    return Response(REGISTRY.render(), content_type=METRICS_CONTENT_TYPE)
+
+
+@api_bp.route('/admin/cache/stats', methods=['GET'])
+def cache_stats():
+    """
+    GET /admin/cache/stats
+    L1 link cache counters (hits, misses, evictions, size) for this worker
+    """
+    local_cache = current_app.extensions.get('link_cache')
+    if local_cache is None:
+        return jsonify({'enabled': False}), 200
+    return jsonify({'enabled': True, **local_cache.stats()}), 200
+
+
+@api_bp.route('/admin/hot-links', methods=['GET'])
+def hot_links():
+    """
+    GET /admin/hot-links?limit=
+    Current heavy hitters for this worker (estimated hits per decay window)
+    """
+    tracker = current_app.extensions.get('hot_links')
+    if tracker is None:
+        return jsonify({'enabled': False}), 200
+    try:
+        limit = int(request.args.get('limit', tracker.k))
+    except ValueError:
+        return jsonify({'error': 'limit must be an integer'}), 400
+
+    pinned = current_app.extensions.get('hot_links_pinned', set())
+    return jsonify({
+        'enabled': True,
+        **tracker.stats(),
+        'top': [
+            {'short_code': code, 'estimated_hits': hits, 'pinned': code in pinned}
+            for code, hits in tracker.top(max(limit, 0))
+        ],
+    }), 200
+
+
+@api_bp.route('/admin/export/<table>', methods=['GET'])
+def export_table(table):
+    """
+    GET /admin/export/<links|clicks|rewards>?format=ndjson|csv&gzip=1&since_id=
+    Stream the whole table (or rows after since_id) in id order.
+    Requires ``Authorization: Bearer <EXPORT_API_TOKEN>``.
+    """
+    token = current_app.config.get('EXPORT_API_TOKEN')
+    if not token:
+        return jsonify({'error': 'HTTP export is disabled; use `flask export`'}), 404
+    supplied = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(supplied.encode(), f'Bearer {token}'.encode()):
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    if table not in EXPORTS:
+        return jsonify({'error': f'Unknown export (choose from {", ".join(EXPORTS)})'}), 404
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in FORMATS:
+        return jsonify({'error': f'format must be one of: {", ".join(FORMATS)}'}), 400
+    since_id = request.args.get('since_id', type=int)
+    if 'since_id' in request.args and since_id is None:
+        return jsonify({'error': 'since_id must be an integer'}), 400
+
+    export = TableExport(
+        table, fmt,
+        compress=request.args.get('gzip', '0').lower() in ('1', 'true', 'yes'),
+        since_id=since_id,
+    )
+
+    def stream():
+        # The rows are read while streaming, after the view has returned.
+        with use_replica():
+            yield from export
+
+    response = Response(stream_with_context(stream()), content_type=export.content_type)
+    response.headers['Content-Disposition'] = f'attachment; filename={export.filename}'
+    if export.compress:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
 
 
 @api_bp.route('/link/<short_code>', methods=['GET'])
@@ -144,48 +350,133 @@ def redirect_link(short_code):
         if not short_code or len(short_code) > 10:
             return jsonify({'error': 'Invalid short code'}), 400
 
-        link, original_url = _get_link_from_cache(short_code)
+        link = _get_link_from_cache(short_code)
         if not link:
             return jsonify({'error': 'Short link not found'}), 404
 
-        click = Click(
-            link_id=link.id,
-            ip_address=get_client_ip(request),
-            user_agent=request.headers.get('User-Agent', '')
-        )
+        hot_links = current_app.extensions.get('hot_links')
+        if hot_links is not None:
+            hot_links.observe(short_code)
+
+        ip_address = get_client_ip(request)
+        user_agent = request.headers.get('User-Agent', '')
 
-        db.session.add(click)
-        Link.query.filter_by(id=link.id).update(
-            {Link.click_count: Link.click_count + 1}
+        # Repeat clicks inside the dedup window are counted but not rewarded.
+        duplicate = is_duplicate_click(
+            current_app.extensions.get('click_dedup'), link.id, ip_address, user_agent
         )
-        db.session.commit()
+
+        # Write-behind mode: append to the click log and return immediately;
+        # the click writer persists it in batches. Falls back to an inline
+        # write if the log is unreachable.
+        click_log = get_click_log()
+        if click_log is not None:
+            try:
+                publish_click(click_log, link.id, link.seller_id, ip_address, user_agent,
+                              duplicate=duplicate)
+                return redirect(link.original_url, code=302)
+            except Exception as e:
+                logger.warning("Click log append failed, writing inline: %s", e)
+
+        if duplicate:
+            _count_duplicate_click(link.id)
+            return redirect(link.original_url, code=302)
+
+        click_id = _record_click(link.id, ip_address, user_agent)
 
         # Enqueue reward processing to Celery (non-blocking).
-        # Import locally to avoid circular imports.
-        try:
-            from tasks import process_reward_task
-            process_reward_task.delay(click.id, link.seller_id, link.id, 0.05)
-        except Exception as e:
-            logger.warning("Reward enqueue failed: %s", e)
+        enqueue_reward(click_id, link.seller_id, link.id)
 
-        return redirect(original_url, code=302)
+        return redirect(link.original_url, code=302)
 
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 
+@api_bp.route('/links/<short_code>/stats', methods=['GET'])
+@read_only
+def link_stats(short_code):
+    """
+    GET /links/<short_code>/stats?from=&to=&bucket=hour|day
+    Time series of clicks and rewarded credits, read from the hourly rollups
+
+    ``from``/``to`` are ISO-8601 timestamps (UTC if no offset); the range
+    defaults to the last 24 hours (hour buckets) or 30 days (day buckets).
+    """
+    try:
+        bucket = request.args.get('bucket', 'hour')
+        if bucket not in BUCKETS:
+            return jsonify({'error': 'bucket must be one of: hour, day'}), 400
+
+        try:
+            end = _parse_utc(request.args.get('to')) or datetime.now(timezone.utc)
+            start = _parse_utc(request.args.get('from')) or (
+                end - (timedelta(days=1) if bucket == 'hour' else timedelta(days=30))
+            )
+        except ValueError:
+            return jsonify({'error': 'from/to must be ISO-8601 timestamps'}), 400
+
+        max_buckets = current_app.config['STATS_MAX_BUCKETS']
+        if start >= end or (end - start) / BUCKETS[bucket] > max_buckets:
+            return jsonify({'error': f'Invalid range (at most {max_buckets} {bucket} buckets)'}), 400
+
+        link = _get_link_from_cache(short_code)
+        if not link:
+            return jsonify({'error': 'Short link not found'}), 404
+
+        series = link_series(link.id, start, end, bucket)
+        return jsonify({
+            'short_code': short_code,
+            'bucket': bucket,
+            'from': start.isoformat(),
+            'to': end.isoformat(),
+            'series': [
+                {'start': bucket_start.isoformat(), 'clicks': clicks, 'credits': float(credits)}
+                for bucket_start, clicks, credits in series
+            ],
+            'totals': {
+                'clicks': sum(clicks for _, clicks, _ in series),
+                'credits': float(sum(credits for _, _, credits in series)),
+            },
+        }), 200
+
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+
+def _parse_utc(value):
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+
 @api_bp.route('/state', methods=['GET'])
+@read_only
 def get_state():
     """
     GET /state?page=1&limit=10
+    GET /state?cursor=&limit=10&total=none|estimate|exact
     Get all generated links with analytics (paginated)
+
+    Passing ``cursor`` (empty for the first page) switches to keyset
+    pagination: follow ``next_cursor`` until it is null.  The total is
+    skipped by default in that mode.
     """
     try:
-        page = request.args.get('page', 1, type=int)
         limit = request.args.get('limit', 10, type=int)
+        if limit < 1 or limit > 100:
+            return jsonify({'error': 'Invalid pagination parameters'}), 400
+
+        if 'cursor' in request.args:
+            return _get_state_keyset(limit)
 
-        if page < 1 or limit < 1 or limit > 100:
+        page = request.args.get('page', 1, type=int)
+
+        if page < 1:
             return jsonify({'error': 'Invalid pagination parameters'}), 400
 
         offset = (page - 1) * limit
@@ -205,3 +496,26 @@ def get_state():
 
     except Exception as e:
         return jsonify({'error': str(e)}), 500
+
+
+def _get_state_keyset(limit):
+    total_mode = request.args.get('total', 'none')
+    if total_mode not in ('none', 'estimate', 'exact'):
+        return jsonify({'error': 'total must be one of: none, estimate, exact'}), 400
+
+    try:
+        links, next_cursor = keyset_page(limit, request.args.get('cursor'))
+    except InvalidCursor:
+        return jsonify({'error': 'Invalid cursor'}), 400
+
+    pagination = {'limit': limit, 'next_cursor': next_cursor}
+    if total_mode == 'exact':
+        pagination['total'] = exact_total()
+    elif total_mode == 'estimate':
+        pagination['total'] = estimated_total()
+        pagination['total_is_estimate'] = True
+
+    return jsonify({
+        'data': [link.to_dict() for link in links],
+        'pagination': pagination,
+    }), 200
@@ -0,0 +1,141 @@
+"""Short code allocation without per-create database lookups.
+
+Each worker reserves a block of sequence numbers with a single atomic
+UPDATE on ``code_sequences`` and hands numbers out from memory.  A number
+is turned into a code by a keyed Feistel permutation over a 42-bit domain
+(cycle-walked into ``[0, 62**7)``) and then base62-encoded to exactly
+seven characters.  The permutation is a bijection, so distinct numbers
+always give distinct codes, yet consecutive numbers give unrelated-looking
+codes.  Legacy random codes are eight characters long, so the two spaces
+never collide.
+"""
+import hashlib
+import threading
+
+from flask import current_app
+from sqlalchemy import insert, update
+from sqlalchemy.exc import IntegrityError
+
+from fiverr import db
+from fiverr.models import CodeSequence
+
+ALPHABET = '0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+CODE_LENGTH = 7
+CODE_SPACE = len(ALPHABET) ** CODE_LENGTH
+
+SEQUENCE_NAME = 'short_code'
+
+_HALF_BITS = 21
+_HALF_MASK = (1 << _HALF_BITS) - 1
+_ROUNDS = 4
+
+
+class CodePermutation:
+    """Keyed bijection on ``[0, CODE_SPACE)``."""
+
+    def __init__(self, key):
+        if isinstance(key, str):
+            key = key.encode()
+        self._round_keys = [
+            hashlib.blake2b(bytes([i]), key=key[:64], digest_size=16).digest()
+            for i in range(_ROUNDS)
+        ]
+
+    def _round(self, i, value):
+        digest = hashlib.blake2b(
+            value.to_bytes(3, 'big'), key=self._round_keys[i], digest_size=4
+        ).digest()
+        return int.from_bytes(digest, 'big') & _HALF_MASK
+
+    def _feistel(self, value):
+        left, right = value >> _HALF_BITS, value & _HALF_MASK
+        for i in range(_ROUNDS):
+            left, right = right, left ^ self._round(i, right)
+        return (left << _HALF_BITS) | right
+
+    def permute(self, n):
+        if not 0 <= n < CODE_SPACE:
+            raise ValueError(f'sequence number {n} outside code space')
+        # Cycle-walk: the 42-bit Feistel domain is slightly larger than the
+        # code space, so re-apply until the result lands inside it.
+        value = self._feistel(n)
+        while value >= CODE_SPACE:
+            value = self._feistel(value)
+        return value
+
+
+def encode_base62(value, length=CODE_LENGTH):
+    chars = []
+    for _ in range(length):
+        value, rem = divmod(value, 62)
+        chars.append(ALPHABET[rem])
+    return ''.join(reversed(chars))
+
+
+def reserve_block(size, name=SEQUENCE_NAME):
+    """Atomically reserve ``size`` sequence numbers. Returns ``(start, end)``.
+
+    Runs in its own connection and transaction so the reservation is
+    durable even if the caller's session later rolls back.
+    """
+    for _ in range(2):
+        with db.engine.begin() as conn:
+            end = conn.execute(
+                update(CodeSequence)
+                .where(CodeSequence.name == name)
+                .values(next_value=CodeSequence.next_value + size)
+                .returning(CodeSequence.next_value)
+            ).scalar()
+            if end is not None:
+                return end - size, end
+            try:
+                conn.execute(insert(CodeSequence).values(name=name, next_value=size))
+                return 0, size
+            except IntegrityError:
+                # Another worker created the row first; retry the UPDATE.
+                pass
+    raise RuntimeError(f'could not reserve a block from sequence {name!r}')
+
+
+class ShortCodeAllocator:
+    """Thread-safe allocator handing out codes from reserved blocks."""
+
+    def __init__(self, key, block_size=1000, reserve=reserve_block):
+        self.permutation = CodePermutation(key)
+        self.block_size = block_size
+        self._reserve = reserve
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+
+    def _take(self, count):
+        """Return sequence numbers for ``count`` codes, reserving as needed."""
+        numbers = []
+        while len(numbers) < count:
+            if self._next >= self._end:
+                self._next, self._end = self._reserve(max(self.block_size, count - len(numbers)))
+            take = min(self._end - self._next, count - len(numbers))
+            numbers.extend(range(self._next, self._next + take))
+            self._next += take
+        return numbers
+
+    def allocate(self):
+        return self.allocate_many(1)[0]
+
+    def allocate_many(self, count):
+        with self._lock:
+            numbers = self._take(count)
+        return [encode_base62(self.permutation.permute(n)) for n in numbers]
+
+
+def get_allocator(app=None):
+    """Return the app's allocator, creating it on first use."""
+    app = app or current_app._get_current_object()
+    allocator = app.extensions.get('short_codes')
+    if allocator is None:
+        allocator = ShortCodeAllocator(
+            app.config['SHORT_CODE_KEY'],
+            block_size=app.config['SHORT_CODE_BLOCK_SIZE'],
+        )
+        app.extensions['short_codes'] = allocator
+    return allocator
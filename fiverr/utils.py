@@ -2,8 +2,17 @@ import secrets
 from fiverr.models import Link
 
 
-def generate_short_code(length=6):
-    """Generate a cryptographically secure unique short code."""
+def generate_short_code():
+    """Allocate a guaranteed-unique short code from this worker's reserved block."""
+    from fiverr.shortcodes import get_allocator
+    return get_allocator().allocate()
+
+
+def generate_random_short_code(length=6):
+    """Legacy generator: random code plus an existence check per attempt.
+
+    Kept for comparison benchmarks; new links use generate_short_code().
+    """
     while True:
         code = secrets.token_urlsafe(length)[:8]
         if not Link.query.filter_by(short_code=code).first():
@@ -15,3 +24,21 @@ def get_client_ip(req):
     if req.headers.get('X-Forwarded-For'):
         return req.headers.get('X-Forwarded-For').split(',')[0]
     return req.remote_addr
+
+
+def dialect_insert(table):
+    """Return an INSERT for ``table`` supporting ``ON CONFLICT`` clauses.
+
+    Postgres and SQLite both implement ``on_conflict_do_nothing`` /
+    ``on_conflict_do_update``; other dialects are not supported.
+    """
+    from fiverr import db
+
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f'ON CONFLICT inserts are not supported on {dialect}')
+    return insert(table)
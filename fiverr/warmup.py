@@ -0,0 +1,101 @@
+"""Preload the hottest links into the Redis (and local L1) cache.
+
+Run after a deploy or Redis flush so the first wave of redirects hits the
+cache instead of Postgres::
+
+    flask --app app warm-cache --top 5000 --source recent
+
+or set ``CACHE_WARMUP_ON_START=1`` to warm in a background thread from
+``create_app``.
+"""
+import logging
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, select
+
+from fiverr import db, get_redis
+from fiverr.cache import LinkRecord, store_link
+from fiverr.models import ClickRollup, Link
+
+logger = logging.getLogger(__name__)
+
+SOURCES = ('click_count', 'recent')
+
+
+def top_links(top_n, source='click_count', window_hours=24):
+    """Return ``[(short_code, LinkRecord)]`` for the ``top_n`` hottest links.
+
+    ``click_count`` ranks by lifetime clicks; ``recent`` ranks by clicks in
+    the last ``window_hours`` using the hourly rollups (no raw click scan).
+    """
+    columns = (Link.short_code, Link.id, Link.original_url, Link.seller_id)
+    if source == 'click_count':
+        query = select(*columns).order_by(Link.click_count.desc()).limit(top_n)
+    elif source == 'recent':
+        since = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=window_hours)
+        recent = (
+            select(ClickRollup.link_id, func.sum(ClickRollup.clicks).label('clicks'))
+            .where(ClickRollup.hour >= since)
+            .group_by(ClickRollup.link_id)
+            .order_by(func.sum(ClickRollup.clicks).desc())
+            .limit(top_n)
+            .subquery()
+        )
+        query = (
+            select(*columns)
+            .join(recent, recent.c.link_id == Link.id)
+            .order_by(recent.c.clicks.desc())
+        )
+    else:
+        raise ValueError(f'source must be one of {SOURCES}')
+
+    return [(code, LinkRecord(link_id, url, seller_id))
+            for code, link_id, url, seller_id in db.session.execute(query)]
+
+
+def warm_link_cache(app, top_n=1000, source='click_count', window_hours=24, batch_size=500):
+    """Load the top links into Redis with pipelined writes.
+
+    Must run inside an app context.  Returns ``{'loaded', 'elapsed_seconds',
+    'source'}``; ``loaded`` is 0 when Redis is unavailable.
+    """
+    start = time.perf_counter()
+    redis_client = get_redis(app)
+    local_cache = app.extensions.get('link_cache')
+    loaded = 0
+
+    links = top_links(top_n, source, window_hours)
+    if redis_client:
+        for i in range(0, len(links), batch_size):
+            pipe = redis_client.pipeline(transaction=False)
+            for short_code, record in links[i:i + batch_size]:
+                store_link(pipe, short_code, record)
+            pipe.execute()
+            loaded += len(links[i:i + batch_size])
+    if local_cache is not None:
+        for short_code, record in links[:local_cache.max_entries]:
+            local_cache.set(short_code, record)
+
+    elapsed = time.perf_counter() - start
+    logger.info("Cache warm-up loaded %d links (%s) in %.3fs", loaded, source, elapsed)
+    return {'loaded': loaded, 'elapsed_seconds': elapsed, 'source': source}
+
+
+def start_background_warmup(app):
+    """Warm the cache from a daemon thread so startup is not delayed."""
+    def run():
+        try:
+            with app.app_context():
+                warm_link_cache(
+                    app,
+                    top_n=app.config['CACHE_WARMUP_TOP_N'],
+                    source=app.config['CACHE_WARMUP_SOURCE'],
+                )
+        except Exception as exc:
+            logger.warning("Cache warm-up failed: %s", exc)
+
+    thread = threading.Thread(target=run, name='link-cache-warmup', daemon=True)
+    thread.start()
+    return thread
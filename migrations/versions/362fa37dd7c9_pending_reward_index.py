@@ -0,0 +1,31 @@
+"""partial index for pending click rewards
+
+Revision ID: 362fa37dd7c9
+Revises: 4b59503e9f7b
+Create Date: 2026-10-16 09:12:41.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '362fa37dd7c9'
+down_revision: Union[str, Sequence[str], None] = '4b59503e9f7b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(
+        'ix_clicks_reward_pending', 'clicks', ['id'], unique=False,
+        postgresql_where=sa.text("reward_status = 'pending'"),
+        sqlite_where=sa.text("reward_status = 'pending'"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_clicks_reward_pending', table_name='clicks')
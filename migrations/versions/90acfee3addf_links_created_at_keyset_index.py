@@ -0,0 +1,30 @@
+"""(created_at, id) index on links for keyset pagination
+
+Revision ID: 90acfee3addf
+Revises: 267071c548ce
+Create Date: 2026-10-16 11:26:54.304117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = '90acfee3addf'
+down_revision: Union[str, Sequence[str], None] = '267071c548ce'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Databases bootstrapped from schema.sql have a created_at-only index
+    # under this name; replace it with the (created_at, id) keyset index.
+    op.execute('DROP INDEX IF EXISTS idx_links_created_at')
+    op.create_index('idx_links_created_at', 'links', ['created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('idx_links_created_at', table_name='links')
@@ -0,0 +1,120 @@
+"""range-partition clicks by clicked_at (Postgres only)
+
+Revision ID: a41d0e6c93b2
+Revises: f80c0622defa
+Create Date: 2026-10-17 13:08:45.902117
+
+Rebuilds ``clicks`` as a table partitioned by month on ``clicked_at``:
+partitions are created for every month that has data plus three ahead,
+rows are copied across and the old table is dropped.  A partitioned
+table's primary key must include the partition key, so it becomes
+``(id, clicked_at)``; ``id`` stays unique through the existing sequence.
+Foreign keys into a partitioned table would need that composite key too,
+so ``rewards.click_id`` loses its FK constraint (the column is kept).
+
+The copy holds an exclusive lock on ``clicks`` for its duration; run it in
+a maintenance window.  Other dialects are left untouched.
+"""
+from datetime import date
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'a41d0e6c93b2'
+down_revision: Union[str, Sequence[str], None] = 'f80c0622defa'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+MONTHS_AHEAD = 3
+
+
+def _next_month(start):
+    return date(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+
+def _create_click_indexes():
+    op.create_index(op.f('ix_clicks_clicked_at'), 'clicks', ['clicked_at'], unique=False)
+    op.create_index(op.f('ix_clicks_link_id'), 'clicks', ['link_id'], unique=False)
+    op.create_index(
+        'ix_clicks_reward_pending', 'clicks', ['id'], unique=False,
+        postgresql_where=sa.text("reward_status = 'pending'"),
+    )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    op.execute('ALTER TABLE rewards DROP CONSTRAINT IF EXISTS rewards_click_id_fkey')
+    op.execute('LOCK TABLE clicks IN ACCESS EXCLUSIVE MODE')
+    op.execute('ALTER SEQUENCE clicks_id_seq OWNED BY NONE')
+    op.execute("""
+        CREATE TABLE clicks_partitioned (
+            id INTEGER NOT NULL DEFAULT nextval('clicks_id_seq'),
+            link_id INTEGER NOT NULL REFERENCES links(id),
+            clicked_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            ip_address VARCHAR(45),
+            user_agent TEXT,
+            reward_status VARCHAR(20),
+            PRIMARY KEY (id, clicked_at)
+        ) PARTITION BY RANGE (clicked_at)
+    """)
+
+    oldest = bind.execute(sa.text('SELECT min(clicked_at) FROM clicks')).scalar()
+    today = date.today()
+    start = (oldest.date() if oldest else today).replace(day=1)
+    last = today.replace(day=1)
+    for _ in range(MONTHS_AHEAD):
+        last = _next_month(last)
+    while start <= last:
+        end = _next_month(start)
+        op.execute(
+            f'CREATE TABLE clicks_p{start:%Y_%m} PARTITION OF clicks_partitioned '
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        )
+        start = end
+
+    op.execute(
+        'INSERT INTO clicks_partitioned (id, link_id, clicked_at, ip_address, user_agent, reward_status) '
+        'SELECT id, link_id, clicked_at, ip_address, user_agent, reward_status FROM clicks'
+    )
+    op.execute('DROP TABLE clicks')
+    op.execute('ALTER TABLE clicks_partitioned RENAME TO clicks')
+    op.execute('ALTER SEQUENCE clicks_id_seq OWNED BY clicks.id')
+    _create_click_indexes()
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    bind = op.get_bind()
+    if bind.dialect.name != 'postgresql':
+        return
+
+    op.execute('LOCK TABLE clicks IN ACCESS EXCLUSIVE MODE')
+    op.execute('ALTER SEQUENCE clicks_id_seq OWNED BY NONE')
+    op.execute("""
+        CREATE TABLE clicks_plain (
+            id INTEGER NOT NULL DEFAULT nextval('clicks_id_seq') PRIMARY KEY,
+            link_id INTEGER NOT NULL REFERENCES links(id),
+            clicked_at TIMESTAMP WITHOUT TIME ZONE NOT NULL,
+            ip_address VARCHAR(45),
+            user_agent TEXT,
+            reward_status VARCHAR(20)
+        )
+    """)
+    op.execute(
+        'INSERT INTO clicks_plain (id, link_id, clicked_at, ip_address, user_agent, reward_status) '
+        'SELECT id, link_id, clicked_at, ip_address, user_agent, reward_status FROM clicks'
+    )
+    op.execute('DROP TABLE clicks CASCADE')
+    op.execute('ALTER TABLE clicks_plain RENAME TO clicks')
+    op.execute('ALTER SEQUENCE clicks_id_seq OWNED BY clicks.id')
+    _create_click_indexes()
+    op.execute(
+        'ALTER TABLE rewards ADD CONSTRAINT rewards_click_id_fkey '
+        'FOREIGN KEY (click_id) REFERENCES clicks(id)'
+    )
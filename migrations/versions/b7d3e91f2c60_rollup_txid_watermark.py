@@ -0,0 +1,43 @@
+"""transaction ids for commit-safe rollup watermarks
+
+Revision ID: b7d3e91f2c60
+Revises: c5e82f19d7a4
+Create Date: 2026-10-18 09:12:40.118204
+
+``clicks`` and ``rewards`` record the inserting transaction
+(``txid_current()`` on Postgres, 0 elsewhere) and the rollup checkpoints
+move from ``last_id`` to ``(last_txid, last_id)``.  Existing rows and
+checkpoints get txid 0, so the old id marks keep their meaning.  The
+column is added with a constant default first (no table rewrite), then
+switched to ``txid_current()`` for new rows.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7d3e91f2c60'
+down_revision: Union[str, Sequence[str], None] = 'c5e82f19d7a4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    postgres = op.get_bind().dialect.name == 'postgresql'
+    for table in ('clicks', 'rewards'):
+        op.add_column(table, sa.Column('txid', sa.BigInteger(), nullable=False, server_default='0'))
+        if postgres:
+            op.alter_column(table, 'txid', server_default=sa.text('txid_current()'))
+        op.create_index(f'ix_{table}_txid_id', table, ['txid', 'id'], unique=False)
+    op.add_column('rollup_checkpoints',
+                  sa.Column('last_txid', sa.BigInteger(), nullable=False, server_default='0'))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('rollup_checkpoints', 'last_txid')
+    for table in ('rewards', 'clicks'):
+        op.drop_index(f'ix_{table}_txid_id', table_name=table)
+        op.drop_column(table, 'txid')
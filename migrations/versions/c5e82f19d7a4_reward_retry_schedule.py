@@ -0,0 +1,37 @@
+"""retry schedule columns for rewards
+
+Revision ID: c5e82f19d7a4
+Revises: a41d0e6c93b2
+Create Date: 2026-10-17 16:41:27.530918
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5e82f19d7a4'
+down_revision: Union[str, Sequence[str], None] = 'a41d0e6c93b2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('rewards', sa.Column('attempts', sa.Integer(), nullable=False, server_default='1'))
+    op.add_column('rewards', sa.Column('next_attempt_at', sa.DateTime(), nullable=True))
+    op.add_column('rewards', sa.Column('last_error', sa.String(length=255), nullable=True))
+    op.create_index(
+        'ix_rewards_retry_due', 'rewards', ['next_attempt_at'], unique=False,
+        postgresql_where=sa.text("status = 'retrying'"),
+        sqlite_where=sa.text("status = 'retrying'"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_rewards_retry_due', table_name='rewards')
+    op.drop_column('rewards', 'last_error')
+    op.drop_column('rewards', 'next_attempt_at')
+    op.drop_column('rewards', 'attempts')
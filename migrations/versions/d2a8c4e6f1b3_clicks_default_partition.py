@@ -0,0 +1,36 @@
+"""default partition for clicks (Postgres only)
+
+Revision ID: d2a8c4e6f1b3
+Revises: b7d3e91f2c60
+Create Date: 2026-10-18 10:02:17.604381
+
+Clicks whose ``clicked_at`` falls outside every range partition (late
+stream events for an archived month, or ones ahead of the partitions
+created so far) go to ``clicks_default`` instead of failing the insert.
+Partition maintenance moves them into a range partition when one is
+created for them.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2a8c4e6f1b3'
+down_revision: Union[str, Sequence[str], None] = 'b7d3e91f2c60'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.execute('CREATE TABLE IF NOT EXISTS clicks_default PARTITION OF clicks DEFAULT')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    # Rows still in the default partition have no range to go back to.
+    op.execute('DROP TABLE IF EXISTS clicks_default')
@@ -0,0 +1,37 @@
+"""claim marker for batch reward settlement
+
+Revision ID: e4b7f2a9c318
+Revises: d2a8c4e6f1b3
+Create Date: 2026-10-18 14:37:52.219046
+
+The batch sweep marks the clicks it claims ``settling`` with a
+``reward_claimed_at`` and commits before calling the credit service, so
+no row locks are held across the HTTP call.  Claims older than
+``REWARD_CLAIM_TIMEOUT_SECONDS`` (the sweeper died) are taken over.
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4b7f2a9c318'
+down_revision: Union[str, Sequence[str], None] = 'd2a8c4e6f1b3'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('clicks', sa.Column('reward_claimed_at', sa.DateTime(), nullable=True))
+    op.create_index(
+        'ix_clicks_reward_settling', 'clicks', ['reward_claimed_at'], unique=False,
+        postgresql_where=sa.text("reward_status = 'settling'"),
+        sqlite_where=sa.text("reward_status = 'settling'"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_clicks_reward_settling', table_name='clicks')
+    op.drop_column('clicks', 'reward_claimed_at')
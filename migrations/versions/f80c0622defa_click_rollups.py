@@ -0,0 +1,40 @@
+"""hourly click rollups and rollup checkpoints
+
+Revision ID: f80c0622defa
+Revises: 90acfee3addf
+Create Date: 2026-10-17 09:41:12.640518
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = 'f80c0622defa'
+down_revision: Union[str, Sequence[str], None] = '90acfee3addf'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('click_rollups',
+    sa.Column('link_id', sa.Integer(), nullable=False),
+    sa.Column('hour', sa.DateTime(), nullable=False),
+    sa.Column('clicks', sa.Integer(), nullable=False),
+    sa.Column('credits', sa.Numeric(precision=12, scale=2), nullable=False),
+    sa.ForeignKeyConstraint(['link_id'], ['links.id'], ),
+    sa.PrimaryKeyConstraint('link_id', 'hour')
+    )
+    op.create_table('rollup_checkpoints',
+    sa.Column('name', sa.String(length=50), nullable=False),
+    sa.Column('last_id', sa.BigInteger(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('rollup_checkpoints')
+    op.drop_table('click_rollups')
@@ -14,34 +14,73 @@ CREATE TABLE IF NOT EXISTS links (
     UNIQUE(seller_id, original_url)
 );
 
--- Clicks table (detailed tracking)
+-- Clicks table (detailed tracking), range partitioned by clicked_at.
+-- The primary key must include the partition key; ids stay unique through
+-- clicks_id_seq. Range partitions (clicks_pYYYY_MM) are created by the
+-- partition maintenance task; rows outside them land in clicks_default.
+CREATE SEQUENCE IF NOT EXISTS clicks_id_seq;
 CREATE TABLE IF NOT EXISTS clicks (
-    id SERIAL PRIMARY KEY,
+    id INTEGER NOT NULL DEFAULT nextval('clicks_id_seq'),
     link_id INTEGER NOT NULL REFERENCES links(id) ON DELETE CASCADE,
-    clicked_at TIMESTAMP DEFAULT NOW(),
+    clicked_at TIMESTAMP NOT NULL DEFAULT NOW(),
     ip_address VARCHAR(45),
     user_agent TEXT,
-    reward_status VARCHAR(20) DEFAULT 'pending'
-);
+    reward_status VARCHAR(20) DEFAULT 'pending',
+    reward_claimed_at TIMESTAMP,
+    txid BIGINT NOT NULL DEFAULT txid_current(),
+    PRIMARY KEY (id, clicked_at)
+) PARTITION BY RANGE (clicked_at);
+ALTER SEQUENCE clicks_id_seq OWNED BY clicks.id;
+CREATE TABLE IF NOT EXISTS clicks_default PARTITION OF clicks DEFAULT;
 
 -- Rewards table (audit trail)
 CREATE TABLE IF NOT EXISTS rewards (
     id SERIAL PRIMARY KEY,
     seller_id VARCHAR(255) NOT NULL,
     link_id INTEGER NOT NULL REFERENCES links(id) ON DELETE CASCADE,
-    click_id INTEGER REFERENCES clicks(id) ON DELETE SET NULL,
+    click_id INTEGER,  -- no FK: partitioned clicks is keyed on (id, clicked_at)
     amount DECIMAL(10,2) NOT NULL,
     status VARCHAR(20) DEFAULT 'pending',
     aws_transaction_id VARCHAR(255),
     created_at TIMESTAMP DEFAULT NOW(),
-    completed_at TIMESTAMP
+    completed_at TIMESTAMP,
+    attempts INTEGER NOT NULL DEFAULT 1,
+    next_attempt_at TIMESTAMP,
+    last_error VARCHAR(255),
+    txid BIGINT NOT NULL DEFAULT txid_current()
+);
+
+-- Short code sequences (workers reserve blocks of numbers from here)
+CREATE TABLE IF NOT EXISTS code_sequences (
+    name VARCHAR(50) PRIMARY KEY,
+    next_value BIGINT NOT NULL DEFAULT 0
+);
+
+-- Hourly click/credit rollups (UTC hours) and their (txid, id) high-water marks
+CREATE TABLE IF NOT EXISTS click_rollups (
+    link_id INTEGER NOT NULL REFERENCES links(id) ON DELETE CASCADE,
+    hour TIMESTAMP NOT NULL,
+    clicks INTEGER NOT NULL DEFAULT 0,
+    credits DECIMAL(12,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (link_id, hour)
+);
+
+CREATE TABLE IF NOT EXISTS rollup_checkpoints (
+    name VARCHAR(50) PRIMARY KEY,
+    last_id BIGINT NOT NULL DEFAULT 0,
+    last_txid BIGINT NOT NULL DEFAULT 0
 );
 
 -- Indexes for performance
 CREATE INDEX IF NOT EXISTS idx_links_short_code ON links(short_code);
 CREATE INDEX IF NOT EXISTS idx_links_seller_id ON links(seller_id);
-CREATE INDEX IF NOT EXISTS idx_links_created_at ON links(created_at DESC);
+CREATE INDEX IF NOT EXISTS idx_links_created_at ON links(created_at DESC, id DESC);
 CREATE INDEX IF NOT EXISTS idx_clicks_link_id ON clicks(link_id);
 CREATE INDEX IF NOT EXISTS idx_clicks_created_at ON clicks(clicked_at DESC);
 CREATE INDEX IF NOT EXISTS idx_rewards_seller_id ON rewards(seller_id);
 CREATE INDEX IF NOT EXISTS idx_rewards_status ON rewards(status);
+CREATE INDEX IF NOT EXISTS ix_clicks_reward_pending ON clicks(id) WHERE reward_status = 'pending';
+CREATE INDEX IF NOT EXISTS ix_clicks_reward_settling ON clicks(reward_claimed_at) WHERE reward_status = 'settling';
+CREATE INDEX IF NOT EXISTS ix_clicks_txid_id ON clicks(txid, id);
+CREATE INDEX IF NOT EXISTS ix_rewards_txid_id ON rewards(txid, id);
+CREATE INDEX IF NOT EXISTS ix_rewards_retry_due ON rewards(next_attempt_at) WHERE status = 'retrying';
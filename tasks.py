@@ -1,75 +1,222 @@
 import os
-import time
-from decimal import Decimal
+import socket
+import threading
+import uuid
+
+from flask import current_app, has_app_context
+
 from celery_app import celery
-from app import db, Click, Link, Reward, app
+from fiverr import create_app, db
+from fiverr.credit_client import get_credit_client
+from fiverr.metrics import observe_reward
+from fiverr.rewards import record_reward
+
+
+_worker_app = None
+_worker_app_lock = threading.Lock()
+
+
+def get_app():
+    """The Flask app task bodies run under.
+
+    Tasks executed inline (tests, eager mode, the web process) reuse the
+    caller's app.  A worker process builds a minimal app on its first
+    task: config, database and a lazily connected Redis, without the
+    blueprint, request hooks or web-only background threads.
+    """
+    global _worker_app
+    if has_app_context():
+        return current_app._get_current_object()
+    if _worker_app is None:
+        with _worker_app_lock:
+            if _worker_app is None:
+                _worker_app = create_app(web=False)
+    return _worker_app
+
+
+def _call_credit_service(click_id, seller_id, link_id, amount):
+    """Credit one click via Bedrock (or the local mock). Returns (status, txn_id)."""
+    return get_credit_client().credit(click_id, seller_id, link_id, amount)
+
+
+def _call_credit_service_batch(items):
+    """Credit a batch of clicks. Returns one (status, txn_id) per item, in order."""
+    return get_credit_client().credit_batch(items)
 
 
 @celery.task(name='tasks.process_reward')
 def process_reward_task(click_id, seller_id, link_id, amount):
     """Celery task to process rewards via Bedrock or local mock."""
     try:
-        bedrock_url = os.getenv('BEDROCK_CREDIT_URL')
-        bedrock_token = os.getenv('BEDROCK_BEARER_TOKEN')
-
-        aws_txn_id = None
-        remote_status = 'completed'
+        remote_status, aws_txn_id = _call_credit_service(click_id, seller_id, link_id, amount)
 
-        if bedrock_url and bedrock_token:
-            try:
-                import requests
-
-                headers = {
-                    'Authorization': f'Bearer {bedrock_token}',
-                    'Content-Type': 'application/json'
-                }
-                payload = {
-                    'seller_id': seller_id,
-                    'amount': float(amount),
-                    'link_id': link_id,
-                    'click_id': click_id
-                }
-                resp = requests.post(bedrock_url, json=payload, headers=headers, timeout=5)
-                if 200 <= resp.status_code < 300:
-                    try:
-                        resp_json = resp.json()
-                        aws_txn_id = resp_json.get('transaction_id') or resp_json.get('transactionId')
-                    except Exception:
-                        aws_txn_id = None
-                    remote_status = 'completed'
-                else:
-                    remote_status = 'failed'
-            except Exception as e:
-                print(f'Bedrock call failed: {e}')
-                remote_status = 'failed'
-        else:
-            # local mock latency
-            time.sleep(0.05)
-
-        with app.app_context():
-            reward = Reward(
-                seller_id=seller_id,
-                link_id=link_id,
-                click_id=click_id,
-                amount=Decimal(str(amount)),
-                status=remote_status,
-                aws_transaction_id=aws_txn_id
+        with get_app().app_context():
+            _, clicked_at = record_reward(
+                click_id, seller_id, link_id, amount, remote_status, aws_txn_id
             )
-            db.session.add(reward)
+        observe_reward(remote_status, clicked_at)
+    except Exception as e:
+        print(f'Celery reward task error: {e}')
+        observe_reward('error')
+
+
+def _settle_batch(items):
+    from fiverr.rewards import settle_reward_batch
 
-            click = db.session.get(Click, click_id)
-            if click:
-                click.reward_status = remote_status
+    outcomes = _call_credit_service_batch(items)
+    settle_reward_batch(items, outcomes)
 
-            link = db.session.get(Link, link_id)
-            if link and remote_status == 'completed':
-                link.credits_earned = Decimal(str(link.credits_earned)) + Decimal(str(amount))
 
-            db.session.commit()
+@celery.task(name='tasks.process_reward_batch')
+def process_reward_batch_task(items):
+    """Settle a batch of rewards in one transaction.
+
+    ``items`` is a list of dicts with click_id, seller_id, link_id, amount.
+    """
+    if not items:
+        return 0
+    try:
+        with get_app().app_context():
+            _settle_batch(items)
+        return len(items)
     except Exception as e:
-        print(f'Celery reward task error: {e}')
+        print(f'Celery reward batch error: {e}')
         try:
-            with app.app_context():
+            with get_app().app_context():
                 db.session.rollback()
         except Exception:
             pass
+        return 0
+
+
+@celery.task(name='tasks.settle_pending_rewards')
+def settle_pending_rewards_task(batch_size=None, max_batches=20):
+    """Sweep clicks still pending a reward and settle them batch by batch.
+
+    Scheduled every ``REWARD_BATCH_INTERVAL`` seconds when
+    ``REWARD_MODE=batch``; each run drains up to ``max_batches`` batches of
+    ``REWARD_BATCH_SIZE`` clicks, so a batch closes on count or on the
+    next tick, whichever comes first.
+    Each batch is claimed in one short transaction, credited with none
+    open, and settled in a second one (see ``claim_pending_rewards``).
+    """
+    from fiverr.rewards import claim_pending_rewards
+
+    settled = 0
+    app = get_app()
+    with app.app_context():
+        if app.config.get('REWARD_MODE') != 'batch':
+            return 0
+        batch_size = batch_size or app.config['REWARD_BATCH_SIZE']
+        for _ in range(max_batches):
+            try:
+                items = claim_pending_rewards(batch_size)
+                if not items:
+                    break
+                _settle_batch(items)
+                settled += len(items)
+            except Exception as e:
+                print(f'Celery reward sweep error: {e}')
+                db.session.rollback()
+                break
+            if len(items) < batch_size:
+                break
+    return settled
+
+
+@celery.task(name='tasks.retry_rewards')
+def retry_rewards_task(batch_size=None, max_batches=10):
+    """Re-attempt credits for rewards whose backoff has elapsed.
+
+    Scheduled every ``REWARD_RETRY_INTERVAL`` seconds.  Skips the run while
+    this worker's credit circuit is open, so an outage costs no worker time;
+    the breaker's half-open probes decide when retries resume.
+    Rewards are leased in one short transaction, credited with none open,
+    and settled in a second one (see ``claim_due_retries``).
+    """
+    from fiverr.circuit import OPEN
+    from fiverr.rewards import claim_due_retries, settle_retries
+
+    client = get_credit_client()
+    settled = 0
+    app = get_app()
+    with app.app_context():
+        batch_size = batch_size or app.config['REWARD_RETRY_BATCH_SIZE']
+        for _ in range(max_batches):
+            if client.breaker.state == OPEN:
+                break
+            try:
+                claimed = claim_due_retries(batch_size)
+                if not claimed:
+                    break
+                outcomes = client.credit_many([
+                    {'click_id': item['click_id'], 'seller_id': item['seller_id'],
+                     'link_id': item['link_id'], 'amount': item['amount']}
+                    for item in claimed
+                ])
+                settle_retries(claimed, outcomes)
+                settled += len(claimed)
+            except Exception as e:
+                print(f'Celery reward retry error: {e}')
+                db.session.rollback()
+                break
+            if len(claimed) < batch_size:
+                break
+    return settled
+
+
+@celery.task(name='tasks.drain_clicks')
+def drain_clicks_task(consumer=None, batch_size=None):
+    """Write one batch from the click stream (for periodic scheduling).
+
+    Each run reads as its own consumer (host, pid and a run id), so
+    concurrent runs never share, and double-write, a pending batch.  The
+    consumer is removed afterwards unless it left entries unacked.
+    """
+    from fiverr.clickstream import drain_clicks, get_click_log
+
+    consumer = consumer or f'celery-{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:12]}'
+    app = get_app()
+    with app.app_context():
+        click_log = get_click_log()
+        if click_log is None:
+            return 0
+        try:
+            return drain_clicks(
+                click_log, consumer, batch_size or app.config['CLICK_BATCH_SIZE']
+            )
+        finally:
+            click_log.remove_consumer(consumer)
+
+
+@celery.task(name='tasks.roll_up_clicks')
+def roll_up_clicks_task(max_batches=10):
+    """Fold new clicks and rewards into the hourly rollups."""
+    from fiverr.rollups import roll_up_clicks, roll_up_rewards
+
+    processed = 0
+    app = get_app()
+    with app.app_context():
+        batch_size = app.config['ROLLUP_BATCH_SIZE']
+        for roll_up in (roll_up_clicks, roll_up_rewards):
+            for _ in range(max_batches):
+                count = roll_up(batch_size)
+                processed += count
+                if count < batch_size:
+                    break
+    return processed
+
+
+@celery.task(name='tasks.maintain_click_partitions')
+def maintain_click_partitions_task():
+    """Create upcoming clicks partitions; archive and drop expired ones."""
+    from fiverr.partitions import archive_expired_partitions, ensure_future_partitions
+
+    app = get_app()
+    with app.app_context():
+        interval = app.config['CLICK_PARTITION_INTERVAL']
+        created = ensure_future_partitions(interval, app.config['CLICK_PARTITIONS_AHEAD'])
+        archived = archive_expired_partitions(
+            app.config['CLICK_ARCHIVE_DIR'], interval, app.config['CLICK_RETENTION_PERIODS']
+        )
+    return {'ensured': created, 'archived': [name for name, _, _ in archived]}